@@ -0,0 +1,178 @@
+import os
+import json
+import numpy as np
+from estadisticas import Acumulador
+
+# Resultados individuales en disco, por columnas, en DIRECTORIO_ALMACEN/<modelo_id>/:
+# un archivo binario por columna (indice del escenario, worker y valor, y
+# opcionalmente las entradas) mapeado en memoria, y 'meta.json' con cuantas
+# filas son validas. Se escribe por lotes y se lee por trozos: analizar o
+# volver a graficar una simulacion no la carga entera en RAM ni la repite.
+
+DIRECTORIO_ALMACEN = 'resultados'
+
+# Los archivos crecen de a FILAS_POR_TROZO filas; los lectores recorren de a tantas
+FILAS_POR_TROZO = 1 << 20
+
+COLUMNAS_BASE = {'indice': '<i8', 'worker': '<u2', 'valor': '<f8'}
+TIPO_ENTRADA = '<f8'
+PREFIJO_ENTRADA = 'entrada.'
+
+
+def _ruta_columna(ruta, nombre):
+    return os.path.join(ruta, f"{nombre}.bin")
+
+
+def _leer_meta(ruta):
+    with open(os.path.join(ruta, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class AlmacenResultados:
+    """
+    Escritor del almacen de una simulacion (uno solo por modelo_id). Si ya
+    existe, sigue agregando al final. Las filas escritas se vuelven visibles
+    para los lectores al llamar a sincronizar().
+    """
+
+    def __init__(self, modelo_id, directorio=DIRECTORIO_ALMACEN):
+        self.modelo_id = modelo_id
+        self.ruta = os.path.join(directorio, modelo_id)
+        os.makedirs(self.ruta, exist_ok=True)
+        self.columnas = dict(COLUMNAS_BASE)
+        self.workers = []       # el codigo de cada worker es su posicion
+        self.filas = 0
+        if os.path.exists(os.path.join(self.ruta, 'meta.json')):
+            meta = _leer_meta(self.ruta)
+            self.columnas, self.workers, self.filas = meta['columnas'], meta['workers'], meta['filas']
+        self.codigos = {w_id: k for k, w_id in enumerate(self.workers)}
+        self.capacidad = 0
+        self.mapas = {}
+        self._asegurar(self.filas)
+
+    def _mapear(self, nombre, capacidad):
+        ruta = _ruta_columna(self.ruta, nombre)
+        tipo = np.dtype(self.columnas[nombre])
+        with open(ruta, 'ab') as f:
+            f.truncate(capacidad * tipo.itemsize)
+        return np.memmap(ruta, dtype=tipo, mode='r+', shape=(capacidad,))
+
+    def _asegurar(self, filas):
+        """Agranda los archivos de a trozos enteros hasta que entren 'filas'"""
+        if filas <= self.capacidad and self.mapas:
+            return
+        capacidad = max(1, -(-filas // FILAS_POR_TROZO)) * FILAS_POR_TROZO
+        for mapa in self.mapas.values():
+            mapa.flush()
+        self.mapas = {nombre: self._mapear(nombre, capacidad) for nombre in self.columnas}
+        self.capacidad = capacidad
+
+    def _agregar_entrada(self, nombre):
+        """Columna de entrada nueva; las filas anteriores quedan en NaN"""
+        columna = PREFIJO_ENTRADA + nombre
+        self.columnas[columna] = TIPO_ENTRADA
+        self.mapas[columna] = self._mapear(columna, self.capacidad)
+        self.mapas[columna][:self.filas] = np.nan
+        return columna
+
+    def codigo_worker(self, worker_id):
+        if worker_id not in self.codigos:
+            self.codigos[worker_id] = len(self.workers)
+            self.workers.append(worker_id)
+        return self.codigos[worker_id]
+
+    def agregar(self, inicio, worker_id, valores, entradas=None):
+        """Escribe un lote: escenarios inicio .. inicio + len(valores) - 1"""
+        valores = np.asarray(valores, dtype=float)
+        cantidad = len(valores)
+        if cantidad == 0:
+            return
+        self._asegurar(self.filas + cantidad)
+        filas = slice(self.filas, self.filas + cantidad)
+        self.mapas['indice'][filas] = np.arange(inicio, inicio + cantidad)
+        self.mapas['worker'][filas] = self.codigo_worker(worker_id)
+        self.mapas['valor'][filas] = valores
+        entradas = entradas or {}
+        for nombre in entradas:
+            if PREFIJO_ENTRADA + nombre not in self.columnas:
+                self._agregar_entrada(nombre)
+        for columna in self.columnas:
+            if columna.startswith(PREFIJO_ENTRADA):
+                self.mapas[columna][filas] = entradas.get(columna[len(PREFIJO_ENTRADA):], np.nan)
+        self.filas += cantidad
+
+    def agregar_mensaje(self, msg):
+        """Guarda un 'resultados_lote' tal como lo devuelve protocolo.decodificar"""
+        self.agregar(msg.get('inicio') or 0, msg.get('worker_id', 'Anonimo'),
+                     msg['resultados'], msg.get('entradas'))
+
+    def sincronizar(self):
+        """Baja los datos a disco y publica el numero de filas validas (atomico)"""
+        for mapa in self.mapas.values():
+            mapa.flush()
+        meta = {'modelo_id': self.modelo_id, 'filas': self.filas,
+                'columnas': self.columnas, 'workers': self.workers}
+        ruta = os.path.join(self.ruta, 'meta.json')
+        with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(ruta + '.tmp', ruta)
+
+    def cerrar(self):
+        self.sincronizar()
+        self.mapas = {}
+
+
+class LectorResultados:
+    """
+    Lectura del almacen de una simulacion sin cargarlo en memoria: cada
+    columna es un np.memmap de solo lectura con las filas ya sincronizadas.
+    Se puede abrir mientras el escritor sigue agregando.
+    """
+
+    def __init__(self, modelo_id, directorio=DIRECTORIO_ALMACEN):
+        self.ruta = os.path.join(directorio, modelo_id)
+        meta = _leer_meta(self.ruta)
+        self.modelo_id = meta['modelo_id']
+        self.filas = meta['filas']
+        self.workers = meta['workers']
+        self.tipos = meta['columnas']
+
+    def __len__(self):
+        return self.filas
+
+    def entradas(self):
+        return [c[len(PREFIJO_ENTRADA):] for c in self.tipos if c.startswith(PREFIJO_ENTRADA)]
+
+    def columna(self, nombre):
+        """La columna entera como np.memmap (las entradas van por su nombre de variable)"""
+        if nombre not in self.tipos:
+            nombre = PREFIJO_ENTRADA + nombre
+        tipo = np.dtype(self.tipos[nombre])
+        if self.filas == 0:
+            return np.empty(0, dtype=tipo)
+        return np.memmap(_ruta_columna(self.ruta, nombre), dtype=tipo, mode='r', shape=(self.filas,))
+
+    def trozos(self, nombres=('valor',), filas=FILAS_POR_TROZO):
+        """Recorre las columnas pedidas de a 'filas': genera {nombre: array}"""
+        columnas = {nombre: self.columna(nombre) for nombre in nombres}
+        for desde in range(0, self.filas, filas):
+            yield {nombre: np.asarray(col[desde:desde + filas]) for nombre, col in columnas.items()}
+
+    def acumulador(self):
+        """Histograma, momentos y cuantiles de los valores, de a un trozo por vez"""
+        acumulador = Acumulador()
+        for trozo in self.trozos():
+            acumulador.agregar(trozo['valor'])
+        return acumulador
+
+    def cuantiles(self, probabilidades):
+        """Cuantiles aproximados (error relativo del sketch) sin ordenar la columna"""
+        sketch = self.acumulador().sketch
+        return [sketch.cuantil(q) for q in probabilidades]
+
+    def por_worker(self):
+        """Cantidad de resultados de cada worker_id"""
+        conteos = np.zeros(len(self.workers), dtype=np.int64)
+        for trozo in self.trozos(('worker',)):
+            conteos += np.bincount(trozo['worker'], minlength=len(self.workers))[:len(self.workers)]
+        return dict(zip(self.workers, conteos.tolist()))
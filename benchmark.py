@@ -0,0 +1,302 @@
+"""
+Banco de pruebas de rendimiento, sin RabbitMQ.
+
+Mide cada etapa por separado (generacion, serializacion, evaluacion,
+agregacion, recepcion del visualizador) y el pipeline completo sobre un
+broker en memoria, para una matriz de escenarios x variables x modelos.
+Por cada caso informa escenarios/s, latencia por mensaje (p50/p99) y el
+pico de memoria (RSS) del proceso que lo corrio.
+
+    python benchmark.py --salida benchmark.json
+    python benchmark.py --escenarios 10000 100000 --variables 2 --modelos simple
+
+Cada caso corre en su propio proceso para que el pico de RSS sea solo suyo.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import platform
+import resource
+import threading
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # El visualizador se mide sin ventana
+
+from consumidor import evaluar_unidad
+from estadisticas import Acumulador, fusionar
+from evaluador import ModeloCompilado
+from monitor import Ingesta
+from muestreo import MUESTREO_INDEPENDIENTE, generar_rango
+from productor import generar_mensajes_trabajo
+from protocolo import FORMATO_BINARIO, codificar_lote, codificar_resultados, decodificar
+from colas import CAPACIDAD_ANILLO
+
+ESCENARIOS = (10000, 100000, 1000000)
+VARIABLES = (2, 5)
+MODELOS = ('simple', 'medio', 'complejo')
+LOTE = 500
+SEMILLA = 12345
+# Cada cuanto se revisa si el proceso del caso sigue vivo mientras se espera su resultado
+ESPERA_RESULTADO = 1.0
+
+DISTRIBUCIONES = (('normal', [0, 1]), ('uniform', [0, 3.14]), ('lognormal', [0, 0.5]))
+
+
+class BrokerMemoria:
+    """
+    Colas en memoria entre hilos: el pipeline completo sin broker ni red.
+    Acotadas como los anillos de ColasLocales, para que el productor no
+    se adelante y la latencia medida sea la de un pipeline en regimen.
+    """
+
+    def __init__(self, capacidad=CAPACIDAD_ANILLO):
+        self.capacidad = capacidad
+        self.colas = {}
+        self.lock = threading.Lock()
+
+    def _cola(self, nombre):
+        with self.lock:
+            return self.colas.setdefault(nombre, queue.Queue(self.capacidad))
+
+    def publicar(self, cola, cuerpo, content_type=None):
+        self._cola(cola).put((cuerpo, content_type))
+
+    def consumir(self, cola, timeout=None):
+        cola = self._cola(cola)
+        while True:
+            try:
+                yield cola.get(timeout=timeout)
+            except queue.Empty:
+                yield None
+
+
+def crear_variables(cantidad):
+    return {f"v{i}": DISTRIBUCIONES[i % len(DISTRIBUCIONES)] for i in range(cantidad)}
+
+
+def crear_expresion(complejidad, nombres):
+    if complejidad == 'simple':
+        return " + ".join(nombres)
+    if complejidad == 'medio':
+        return f"{nombres[0]} * sin({nombres[1]}) + exp({nombres[-1]} / 10)"
+    # Varias funciones por variable
+    return " + ".join(f"sin({a}) * cos({b}) + log(1 + {a} ** 2)"
+                      for a, b in zip(nombres, nombres[1:] + nombres[:1]))
+
+
+def crear_modelo(variables, complejidad, total):
+    return {
+        'modelo_id': '00000000-0000-0000-0000-000000000001',
+        'tipo': 'modelo',
+        'variables': variables,
+        'expresion': crear_expresion(complejidad, list(variables)),
+        'total_escenarios': total,
+        'semilla': SEMILLA,
+        'orden_variables': list(variables),
+        'formato': FORMATO_BINARIO,
+        'resultados': 'individuales',
+    }
+
+
+def resumen(escenarios, duracion, latencias):
+    latencias = np.asarray(latencias) * 1e3
+    return {
+        'escenarios_por_segundo': escenarios / duracion if duracion > 0 else None,
+        'segundos': duracion,
+        'mensajes': len(latencias),
+        'latencia_p50_ms': float(np.percentile(latencias, 50)) if len(latencias) else None,
+        'latencia_p99_ms': float(np.percentile(latencias, 99)) if len(latencias) else None,
+    }
+
+
+def medir(escenarios, pasos):
+    """Corre cada paso (una funcion por mensaje) y devuelve el resumen de la etapa"""
+    latencias = []
+    inicio = time.perf_counter()
+    for paso in pasos:
+        antes = time.perf_counter()
+        paso()
+        latencias.append(time.perf_counter() - antes)
+    return resumen(escenarios, time.perf_counter() - inicio, latencias)
+
+
+def etapas(modelo, total):
+    """Mide cada etapa por separado, un mensaje (LOTE escenarios) por paso"""
+    variables = modelo['variables']
+    nombres = modelo['orden_variables']
+    inicios = range(0, total, LOTE)
+    cantidad = lambda inicio: min(LOTE, total - inicio)
+    resultado = {}
+
+    lotes = {}
+    def generar(inicio):
+        lotes[inicio] = generar_rango(variables, SEMILLA, inicio, cantidad(inicio))
+    resultado['generacion'] = medir(total, [lambda i=i: generar(i) for i in inicios])
+
+    cuerpos = {}
+    def serializar(inicio):
+        lote = {'modelo_id': modelo['modelo_id'], 'inicio': inicio,
+                'cantidad': cantidad(inicio), 'variables': lotes[inicio]}
+        cuerpos[inicio] = codificar_lote(lote, nombres, FORMATO_BINARIO)
+        decodificar(cuerpos[inicio], nombres=nombres)
+    resultado['serializacion'] = medir(total, [lambda i=i: serializar(i) for i in inicios])
+
+    compilado = ModeloCompilado(modelo['expresion'], nombres)
+    valores = {}
+    def evaluar(inicio):
+        valores[inicio], _ = compilado.evaluar(lotes[inicio], cantidad(inicio))
+    resultado['evaluacion'] = medir(total, [lambda i=i: evaluar(i) for i in inicios])
+    lotes.clear()
+    cuerpos.clear()
+
+    # Agregacion: cada lote a un parcial, y los parciales fusionados de a 10
+    parciales = []
+    def agregar(inicio):
+        parcial = Acumulador()
+        parcial.agregar(valores[inicio])
+        parciales.append(parcial.a_dict())
+        if len(parciales) == 10:
+            fusionar(parciales)
+            parciales.clear()
+    resultado['agregacion'] = medir(total, [lambda i=i: agregar(i) for i in inicios])
+
+    visualizador = Ingesta()
+    mensajes = {inicio: codificar_resultados(
+        {'tipo': 'resultados_lote', 'worker_id': 'benchmark', 'modelo_id': modelo['modelo_id'],
+         'inicio': inicio, 'resultados': valores[inicio], 'fallidos': 0}, FORMATO_BINARIO)
+        for inicio in inicios}
+    resultado['visualizador'] = medir(
+        total, [lambda i=i: visualizador.procesar_mensaje(decodificar(mensajes[i])) for i in inicios])
+    return resultado
+
+
+def pipeline(modelo, total, modo):
+    """
+    Productor, worker y visualizador en hilos unidos por BrokerMemoria.
+    La latencia de un mensaje va desde que se publica su unidad de trabajo
+    hasta que el visualizador recibe sus resultados.
+    """
+    broker = BrokerMemoria()
+    compilado = ModeloCompilado(modelo['expresion'], modelo['orden_variables'])
+    opciones = {'lote': LOTE, 'modo': modo, 'semilla': SEMILLA, 'formato': FORMATO_BINARIO,
+                'muestreo': MUESTREO_INDEPENDIENTE}
+    publicados = {}
+
+    def productor():
+        for cuerpo, content_type, inicio, _ in generar_mensajes_trabajo(
+                modelo, modelo['variables'], total, opciones):
+            publicados[inicio] = time.perf_counter()
+            broker.publicar('escenarios', cuerpo, content_type)
+        broker.publicar('escenarios', json.dumps({'tipo': 'fin_escenarios'}).encode('utf-8'), None)
+
+    def worker():
+        for cuerpo, content_type in broker.consumir('escenarios'):
+            salida = evaluar_unidad('benchmark', None, cuerpo, modelo, compilado, FORMATO_BINARIO)
+            if salida['mensaje'].get('tipo') == 'fin_escenarios':
+                break
+            broker.publicar('resultados', salida['cuerpo'], salida['content_type'])
+
+    visualizador = Ingesta(fuente=broker)
+    latencias = []
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=productor, daemon=True), threading.Thread(target=worker, daemon=True)]
+    for hilo in hilos:
+        hilo.start()
+
+    recibidos = 0
+    for cuerpo, content_type in broker.consumir('resultados'):
+        msg = decodificar(cuerpo)
+        visualizador.procesar_mensaje(msg)
+        latencias.append(time.perf_counter() - publicados[msg['inicio']])
+        recibidos += len(msg['resultados'])
+        if recibidos >= total:
+            break
+    duracion = time.perf_counter() - inicio
+    for hilo in hilos:
+        hilo.join()
+    return resumen(total, duracion, latencias)
+
+
+def correr_caso(caso, salida):
+    modelo = crear_modelo(crear_variables(caso['variables']), caso['modelo'], caso['escenarios'])
+    resultado = dict(caso, expresion=modelo['expresion'])
+    resultado['etapas'] = etapas(modelo, caso['escenarios'])
+    resultado['pipeline'] = {modo: pipeline(modelo, caso['escenarios'], modo)
+                             for modo in ('rangos', 'valores')}
+    # ru_maxrss viene en KB en Linux
+    resultado['rss_pico_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    salida.put(resultado)
+
+
+def esperar_resultado(proceso, salida):
+    """Resultado del caso, o None si el proceso termino sin entregarlo (excepcion, OOM)"""
+    while True:
+        try:
+            return salida.get(timeout=ESPERA_RESULTADO)
+        except queue.Empty:
+            if not proceso.is_alive():
+                # Pudo haber entregado justo antes de terminar
+                try:
+                    return salida.get(timeout=ESPERA_RESULTADO)
+                except queue.Empty:
+                    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del sistema Montecarlo sin broker")
+    parser.add_argument('--escenarios', type=int, nargs='+', default=list(ESCENARIOS))
+    parser.add_argument('--variables', type=int, nargs='+', default=list(VARIABLES))
+    parser.add_argument('--modelos', nargs='+', default=list(MODELOS), choices=MODELOS)
+    parser.add_argument('--salida', default='benchmark.json',
+                        help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    casos = [{'escenarios': e, 'variables': max(2, v), 'modelo': m}
+             for e in args.escenarios for v in args.variables for m in args.modelos]
+    resultados = []
+    fallidos = []
+    for caso in casos:
+        print(f"Caso: {caso['escenarios']} escenarios, {caso['variables']} variables, modelo {caso['modelo']}")
+        salida = multiprocessing.Queue()
+        proceso = multiprocessing.Process(target=correr_caso, args=(caso, salida))
+        proceso.start()
+        resultado = esperar_resultado(proceso, salida)
+        proceso.join()
+        if resultado is None:
+            print(f"   ERROR: el caso termino sin resultado (codigo de salida {proceso.exitcode})")
+            fallidos.append(dict(caso, codigo_salida=proceso.exitcode))
+            continue
+        resultados.append(resultado)
+
+        for etapa, medida in list(resultado['etapas'].items()) + \
+                [(f"pipeline {modo}", medida) for modo, medida in resultado['pipeline'].items()]:
+            print(f"   {etapa:<18}{medida['escenarios_por_segundo']:>14.0f} esc/s"
+                  f"   p50 {medida['latencia_p50_ms']:8.3f} ms   p99 {medida['latencia_p99_ms']:8.3f} ms")
+        print(f"   RSS pico: {resultado['rss_pico_mb']:.1f} MB")
+
+    informe = {
+        'fecha': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'lote': LOTE,
+        'casos': resultados,
+        'fallidos': fallidos,
+    }
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2)
+    print(f"Resultados guardados en {args.salida}")
+    if fallidos:
+        print(f"ERROR: {len(fallidos)} de {len(casos)} casos terminaron sin resultado")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import ast
+import glob
+import json
+import time
+import hashlib
+from estadisticas import agregado_desde_dict
+
+# Resultados de simulaciones ya corridas, para no repetirlas: el agregado de
+# cada una en DIRECTORIO_CACHE/<familia>_<escenarios>.json. La familia es un
+# hash de la forma canonica de las variables, la expresion, la semilla y el
+# muestreo: dos modelo.txt que solo difieren en espacios o comentarios caen
+# en la misma. Como cada escenario depende solo de su indice, una corrida con
+# mas escenarios de la misma familia parte del resultado guardado y simula
+# solo los que faltan.
+
+DIRECTORIO_CACHE = 'cache'
+
+# Al pasar de este tamaño se borran los resultados usados hace mas tiempo
+TAM_MAX_CACHE = 64 * 1024 * 1024
+
+# Con hipercubo latino el ultimo bloque depende del total: solo aciertos exactos
+_MUESTREOS_SIN_EXTENSION = ('lhs',)
+
+
+def forma_canonica(variables, expresion, semilla, muestreo):
+    """Texto que identifica los valores de una simulacion (sin el numero de escenarios)"""
+    def parametro(valor):
+        return [float(v) for v in valor] if isinstance(valor, (list, tuple)) else float(valor)
+
+    return json.dumps({
+        # El orden de las variables importa: cada una tiene su flujo aleatorio
+        'variables': [[nombre, dist.lower(), [parametro(p) for p in params]]
+                      for nombre, (dist, params) in variables.items()],
+        'expresion': ast.unparse(ast.parse(expresion, mode='eval')),
+        'semilla': semilla,
+        'muestreo': muestreo,
+    }, sort_keys=True, separators=(',', ':'))
+
+
+def familia(variables, expresion, semilla, muestreo):
+    return hashlib.sha256(forma_canonica(variables, expresion, semilla, muestreo).encode('utf-8')).hexdigest()[:32]
+
+
+def semilla_del_modelo(variables, expresion, muestreo):
+    """
+    Semilla de 'semilla = modelo': sale de la forma canonica, asi repetir el
+    mismo modelo.txt da la misma simulacion y acierta en la cache
+    """
+    resumen = hashlib.sha256(forma_canonica(variables, expresion, None, muestreo).encode('utf-8')).digest()
+    return int.from_bytes(resumen[:8], 'little') % (2 ** 63)
+
+
+def _ruta(clave, total, directorio):
+    return os.path.join(directorio, f"{clave}_{total}.json")
+
+
+def _leer(ruta):
+    with open(ruta, encoding='utf-8') as f:
+        datos = json.load(f)
+    os.utime(ruta)  # la fecha de modificacion marca el ultimo uso (LRU)
+    return datos['escenarios'], agregado_desde_dict(datos['agregado'])
+
+
+def buscar_en_cache(variables, expresion, semilla, muestreo, total, directorio=DIRECTORIO_CACHE):
+    """
+    (escenarios, agregado) guardado para esta simulacion: el de 'total'
+    escenarios si esta, si no el mas grande con menos escenarios (de ahi en
+    adelante es lo que falta simular). None si no hay ninguno.
+    """
+    clave = familia(variables, expresion, semilla, muestreo)
+    if os.path.exists(_ruta(clave, total, directorio)):
+        return _leer(_ruta(clave, total, directorio))
+    if muestreo in _MUESTREOS_SIN_EXTENSION:
+        return None
+    guardados = []
+    for ruta in glob.glob(os.path.join(directorio, f"{clave}_*.json")):
+        escenarios = int(os.path.basename(ruta)[len(clave) + 1:-len('.json')])
+        if escenarios < total:
+            guardados.append((escenarios, ruta))
+    if not guardados:
+        return None
+    return _leer(max(guardados)[1])
+
+
+def guardar_en_cache(variables, expresion, semilla, muestreo, total, agregado,
+                     directorio=DIRECTORIO_CACHE, tam_max=TAM_MAX_CACHE):
+    """Guarda el agregado de una simulacion completa (atomico) y recorta la cache"""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = _ruta(familia(variables, expresion, semilla, muestreo), total, directorio)
+    datos = {
+        'modelo': json.loads(forma_canonica(variables, expresion, semilla, muestreo)),
+        'escenarios': total,
+        'agregado': agregado.a_dict(),
+        'timestamp': time.time()
+    }
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f)
+    os.replace(temporal, ruta)
+    desalojar(directorio, tam_max)
+
+
+def desalojar(directorio=DIRECTORIO_CACHE, tam_max=TAM_MAX_CACHE):
+    """Borra los resultados usados hace mas tiempo hasta que la cache ocupe a lo sumo tam_max"""
+    entradas = []
+    for ruta in glob.glob(os.path.join(directorio, '*.json')):
+        estado = os.stat(ruta)
+        entradas.append((estado.st_mtime, estado.st_size, ruta))
+    ocupado = sum(tamano for _, tamano, _ in entradas)
+    for _, tamano, ruta in sorted(entradas):
+        if ocupado <= tam_max:
+            break
+        os.remove(ruta)
+        ocupado -= tamano
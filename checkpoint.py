@@ -0,0 +1,47 @@
+import os
+import json
+import time
+from estadisticas import agregado_desde_dict
+from planificacion import RangosCompletados
+
+# Estado de una simulacion en curso, para reanudarla si el productor cae:
+# los rangos de escenarios ya completados (intervalos fusionados) y el
+# agregado de sus resultados, en DIRECTORIO_CHECKPOINTS/<modelo_id>.json.
+# Ocupa lo mismo con mil escenarios que con mil millones.
+
+DIRECTORIO_CHECKPOINTS = 'checkpoints'
+
+# Cada cuanto se vuelve a escribir mientras llegan resultados
+INTERVALO_CHECKPOINT = 5.0
+
+
+def ruta_checkpoint(modelo_id, directorio=DIRECTORIO_CHECKPOINTS):
+    return os.path.join(directorio, f"{modelo_id}.json")
+
+
+def guardar_checkpoint(modelo_msg, opciones, completados, agregado, completo=False,
+                       directorio=DIRECTORIO_CHECKPOINTS):
+    """Escribe el checkpoint de forma atomica (un archivo temporal y os.replace)"""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = ruta_checkpoint(modelo_msg['modelo_id'], directorio)
+    estado = {
+        'modelo': modelo_msg,
+        'opciones': opciones,
+        'completados': completados.a_lista(),
+        'agregado': agregado.a_dict(),
+        'completo': completo,
+        'timestamp': time.time()
+    }
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(estado, f)
+    os.replace(temporal, ruta)
+
+
+def cargar_checkpoint(modelo_id, directorio=DIRECTORIO_CHECKPOINTS):
+    """Devuelve el estado guardado, con 'completados' y 'agregado' ya reconstruidos"""
+    with open(ruta_checkpoint(modelo_id, directorio), encoding='utf-8') as f:
+        estado = json.load(f)
+    estado['completados'] = RangosCompletados.desde_lista(estado['completados'])
+    estado['agregado'] = agregado_desde_dict(estado['agregado'])
+    return estado
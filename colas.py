@@ -0,0 +1,163 @@
+"""
+Colas de la simulacion.
+
+    - Nombres y argumentos de las colas de RabbitMQ (todos las declaran igual).
+    - LectorRabbitMQ: lee una cola de RabbitMQ con auto_ack (la ingesta del monitor).
+    - ColasLocales: las colas 'escenarios' y 'resultados' del modo local
+      (python productor.py modelo.txt local), en memoria compartida.
+
+El modo local es un ejecutor aparte, no otro backend del mismo pipeline: el
+productor y el Consumidor sobre RabbitMQ usan pika directamente (publisher
+confirms, una cola por simulacion, exchanges de modelos y parciales, prefetch)
+y el modo local tiene su propio generador y workers (productor.ejecutar_local,
+consumidor.trabajar_local). Por eso no tiene checkpoint, detencion por
+precision ni unidades adaptativas.
+
+En ColasLocales cada cola es un AnilloCompartido: ranuras de tamaño fijo en
+un bloque de multiprocessing.shared_memory, con semaforos para las ranuras
+libres y ocupadas. Publicar con el anillo lleno bloquea, asi que el generador
+nunca se adelanta mas de 'capacidad' mensajes a los workers.
+"""
+
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+import pika
+from protocolo import FORMATO_JSON, FORMATO_BINARIO, CONTENT_TYPE
+
+COLAS = ('escenarios', 'resultados')
+
+# Metricas: cola acotada y no durable; si nadie la lee se descartan las viejas
+COLA_METRICAS = 'metricas'
+_PARAMETROS_COLA = {COLA_METRICAS: {'durable': False, 'arguments': {'x-max-length': 1000}}}
+
+# Cada simulacion tiene su propia cola de trabajo 'escenarios.<modelo_id>'; el
+# broker la borra tras EXPIRA_COLA_TRABAJO sin consumidores ni declaraciones
+PREFIJO_COLA_TRABAJO = 'escenarios.'
+EXPIRA_COLA_TRABAJO = 3600 * 1000  # ms
+
+# Anillos del modo local
+CAPACIDAD_ANILLO = 32
+TAM_RANURA = 1 << 20
+
+# Cabecera de cada ranura: largo del cuerpo (u32) y formato (u8)
+_RANURA = struct.Struct('<IB3x')
+_CODIGO_FORMATO = {CONTENT_TYPE[FORMATO_JSON]: 0, CONTENT_TYPE[FORMATO_BINARIO]: 1}
+_CONTENT_TYPE_DE = {codigo: content_type for content_type, codigo in _CODIGO_FORMATO.items()}
+
+
+def parametros_cola(cola):
+    """Argumentos de queue_declare de una cola (todos deben declararla igual)"""
+    if cola.startswith(PREFIJO_COLA_TRABAJO):
+        return {'durable': True, 'arguments': {'x-expires': EXPIRA_COLA_TRABAJO}}
+    return _PARAMETROS_COLA.get(cola, {'durable': True})
+
+
+def cola_trabajo(modelo_id):
+    """Cola de unidades de trabajo de una simulacion"""
+    return PREFIJO_COLA_TRABAJO + modelo_id
+
+
+class LectorRabbitMQ:
+    """Consume colas de RabbitMQ por una conexion bloqueante propia"""
+
+    def __init__(self, host="localhost", colas=COLAS):
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=host, connection_attempts=5, retry_delay=2)
+        )
+        self.channel = self.connection.channel()
+        for cola in colas:
+            self.channel.queue_declare(queue=cola, **parametros_cola(cola))
+
+    def consumir(self, cola, timeout=None):
+        """Genera (cuerpo, content_type); si pasa 'timeout' sin mensajes genera None"""
+        for method, properties, body in self.channel.consume(cola, auto_ack=True,
+                                                             inactivity_timeout=timeout):
+            if method is None:
+                yield None
+            else:
+                yield body, properties.content_type
+
+    def cerrar(self):
+        if self.connection.is_open:
+            self.connection.close()
+
+
+class AnilloCompartido:
+    """Cola acotada de mensajes en memoria compartida, para varios productores y consumidores"""
+
+    def __init__(self, capacidad=CAPACIDAD_ANILLO, tam_ranura=TAM_RANURA):
+        self.capacidad = capacidad
+        self.tam_ranura = tam_ranura
+        self.memoria = shared_memory.SharedMemory(create=True, size=capacidad * tam_ranura)
+        self.libres = multiprocessing.Semaphore(capacidad)
+        self.ocupadas = multiprocessing.Semaphore(0)
+        self.lock_escritura = multiprocessing.Lock()
+        self.lock_lectura = multiprocessing.Lock()
+        self.escritos = multiprocessing.RawValue('q', 0)
+        self.leidos = multiprocessing.RawValue('q', 0)
+
+    def publicar(self, cuerpo, content_type=None):
+        if isinstance(cuerpo, str):
+            cuerpo = cuerpo.encode('utf-8')
+        largo = len(cuerpo)
+        if _RANURA.size + largo > self.tam_ranura:
+            raise ValueError(f"Mensaje de {largo} bytes no cabe en una ranura de {self.tam_ranura}")
+        codigo = _CODIGO_FORMATO.get(content_type, 0)
+
+        self.libres.acquire()
+        with self.lock_escritura:
+            desde = (self.escritos.value % self.capacidad) * self.tam_ranura
+            _RANURA.pack_into(self.memoria.buf, desde, largo, codigo)
+            desde += _RANURA.size
+            self.memoria.buf[desde:desde + largo] = cuerpo
+            self.escritos.value += 1
+        self.ocupadas.release()
+
+    def recibir(self, timeout=None):
+        """(cuerpo, content_type) del mensaje mas antiguo, o None si pasa 'timeout'"""
+        if not self.ocupadas.acquire(timeout=timeout):
+            return None
+        with self.lock_lectura:
+            desde = (self.leidos.value % self.capacidad) * self.tam_ranura
+            largo, codigo = _RANURA.unpack_from(self.memoria.buf, desde)
+            desde += _RANURA.size
+            cuerpo = bytes(self.memoria.buf[desde:desde + largo])
+            self.leidos.value += 1
+        self.libres.release()
+        return cuerpo, _CONTENT_TYPE_DE[codigo]
+
+    def cerrar(self):
+        self.memoria.close()
+
+    def liberar(self):
+        """Solo el proceso que creo el anillo, al terminar"""
+        self.memoria.close()
+        self.memoria.unlink()
+
+
+class ColasLocales:
+    """
+    Un AnilloCompartido por cola. Se crea en el proceso principal y se pasa a
+    los procesos hijos como argumento de multiprocessing.Process.
+    """
+
+    def __init__(self, colas=COLAS, capacidad=CAPACIDAD_ANILLO, tam_ranura=TAM_RANURA):
+        self.anillos = {cola: AnilloCompartido(capacidad, tam_ranura) for cola in colas}
+
+    def publicar(self, cola, cuerpo, content_type=None):
+        self.anillos[cola].publicar(cuerpo, content_type)
+
+    def consumir(self, cola, timeout=None):
+        """Genera (cuerpo, content_type); si pasa 'timeout' sin mensajes genera None"""
+        anillo = self.anillos[cola]
+        while True:
+            yield anillo.recibir(timeout)
+
+    def cerrar(self):
+        for anillo in self.anillos.values():
+            anillo.cerrar()
+
+    def liberar(self):
+        for anillo in self.anillos.values():
+            anillo.liberar()
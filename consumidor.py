@@ -1,174 +1,795 @@
 import pika
 import json
-import math
-import sys
+import os
 import time
 import random
-import numpy as np
+import socket
+import argparse
+import functools
+import threading
+import multiprocessing
+from estadisticas import AcumuladorBarrido, crear_agregado
+from evaluador import ModeloCompilado
+from metricas import Metricas
+from muestreo import MUESTREO_INDEPENDIENTE, generar_rango, variables_de_puntos
+from planificacion import PRIORIDAD_POR_DEFECTO, ColaJusta, PrefetchAdaptativo
+from protocolo import FORMATO_JSON, FORMATOS, CONTENT_TYPE, decodificar, codificar_resultados, modelo_id_de
+from colas import COLA_METRICAS, cola_trabajo, parametros_cola
+
+# Cada cuanto se publica el agregado parcial del worker (lo que ocurra antes)
+INTERVALO_PARCIAL = 2.0
+ESCENARIOS_POR_PARCIAL = 10000
+
+# Entregas sin confirmar que el broker envia a cada worker: el valor inicial,
+# que luego se adapta al ritmo del worker (PrefetchAdaptativo) salvo que se fije
+PREFETCH = 50
+# Cada cuanto se confirman (ack multiple) las entregas ya listas
+INTERVALO_ACKS = 0.2
+
+# Modelos: clave para pedir el modelo vigente, espera entre solicitudes y
+# tiempo maximo que una entrega espera a que llegue su modelo
+MODELO_ACTUAL = 'actual'
+ESPERA_SOLICITUD = 2.0
+ESPERA_MODELO_MAX = 30.0
+
+# Barridos de parametros: puntos de la grilla evaluados de una vez, hasta
+# CELDAS_BARRIDO valores (puntos x escenarios) por evaluacion
+CELDAS_BARRIDO = 1 << 22
+
+# Modo multiproceso: cada cuanto el supervisor revisa a sus hijos y publica su rendimiento
+INTERVALO_SUPERVISOR = 2.0
+
+
+def variables_ordenadas(modelo_msg):
+    """Variables del modelo en el orden usado para generar y codificar"""
+    variables = modelo_msg['variables']
+    orden = modelo_msg.get('orden_variables', list(variables))
+    return {nombre: variables[nombre] for nombre in orden}
+
+
+def columnas_de_trabajo(modelo_msg, mensaje):
+    """Devuelve ({variable: array}, cantidad) para cualquier tipo de unidad de trabajo"""
+    if mensaje.get('tipo') == 'lote':
+        return mensaje['variables'], mensaje['cantidad']
+    if mensaje.get('tipo') == 'rango':
+        # Solo llegan coordenadas: los valores se regeneran aqui
+        columnas = generar_rango(variables_ordenadas(modelo_msg), mensaje['semilla'],
+                                 mensaje['inicio'], mensaje['cantidad'],
+                                 modelo_msg.get('muestreo', MUESTREO_INDEPENDIENTE),
+                                 modelo_msg.get('total_escenarios'))
+        return columnas, mensaje['cantidad']
+    # Escenario individual (formato anterior)
+    return {nombre: [valor] for nombre, valor in mensaje['variables'].items()}, 1
+
+
+def evaluar_barrido(modelo_msg, compilado, mensaje, tiempos):
+    """
+    Evalua un rango en todos los puntos de la grilla, de a grupos de puntos
+    (broadcasting sobre el eje de los parametros). Devuelve el parcial de la
+    unidad (AcumuladorBarrido) y los valores no finitos.
+    """
+    variables = variables_ordenadas(modelo_msg)
+    puntos, cantidad = modelo_msg['puntos'], mensaje['cantidad']
+    parcial = AcumuladorBarrido(puntos)
+    fallidos = 0
+    grupo = max(1, CELDAS_BARRIDO // max(cantidad, 1))
+    for desde in range(0, puntos, grupo):
+        hasta = min(puntos, desde + grupo)
+        inicio = time.perf_counter()
+        columnas = generar_rango(variables_de_puntos(variables, desde, hasta), mensaje['semilla'],
+                                 mensaje['inicio'], cantidad,
+                                 modelo_msg.get('muestreo', MUESTREO_INDEPENDIENTE),
+                                 modelo_msg.get('total_escenarios'))
+        tiempos['generacion'] = tiempos.get('generacion', 0.0) + time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        valores, fallidos_grupo = compilado.evaluar(columnas, cantidad, hasta - desde)
+        parcial.agregar(valores, desde)
+        tiempos['evaluar'] = tiempos.get('evaluar', 0.0) + time.perf_counter() - inicio
+        fallidos += fallidos_grupo
+    return parcial, fallidos
+
+
+def acumular(agregado, salida):
+    """Suma una unidad evaluada a un agregado: sus valores, o su parcial si es un barrido"""
+    if 'parcial' in salida:
+        agregado.fusionar(salida['parcial'])
+    elif 'valores' in salida:
+        agregado.agregar(salida['valores'])
+
+
+def evaluar_unidad(worker_id, properties, body, modelo, compilado, formato):
+    """Decodifica y evalua una unidad de trabajo; no toca ningun estado compartido"""
+    inicio = time.perf_counter()
+    nombres = list(variables_ordenadas(modelo)) if modelo else None
+    mensaje = decodificar(body, properties, nombres)
+    salida = {'mensaje': mensaje, 'tiempos': {'decodificar': time.perf_counter() - inicio}}
+    if mensaje.get('tipo') == 'fin_escenarios':
+        return salida
+
+    if modelo and modelo.get('puntos') and mensaje.get('tipo') == 'rango' \
+            and mensaje.get('modelo_id') == modelo['modelo_id']:
+        # Barrido: solo agregados por punto (los individuales serian puntos x escenarios)
+        parcial, fallidos = evaluar_barrido(modelo, compilado, mensaje, salida['tiempos'])
+        salida.update(parcial=parcial, fallidos=fallidos, cantidad=mensaje['cantidad'])
+        return salida
+
+    if modelo and mensaje.get('modelo_id') == modelo['modelo_id']:
+        inicio = time.perf_counter()
+        columnas, cantidad = columnas_de_trabajo(modelo, mensaje)
+        salida['tiempos']['generacion'] = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        valores, fallidos = compilado.evaluar(columnas, cantidad)
+        salida['tiempos']['evaluar'] = time.perf_counter() - inicio
+        salida.update(valores=valores, fallidos=fallidos, cantidad=cantidad)
+
+        if cantidad and modelo.get('resultados', 'individuales') in ('individuales', 'entradas'):
+            # Enviar al visualizador: un solo mensaje por lote (fallidos = NaN)
+            resultado_msg = {
+                'tipo': 'resultados_lote',
+                'worker_id': worker_id,
+                'modelo_id': modelo['modelo_id'],
+                'inicio': mensaje.get('inicio', mensaje.get('escenario_id')),
+                'resultados': valores,
+                'fallidos': fallidos,
+                'timestamp': time.time()
+            }
+            if modelo.get('resultados') == 'entradas':
+                # Con los valores de entrada de cada escenario, para guardarlos junto al resultado
+                resultado_msg['entradas'] = {nombre: columnas[nombre] for nombre in nombres}
+            salida['cuerpo'] = codificar_resultados(resultado_msg, formato)
+            salida['content_type'] = CONTENT_TYPE[formato]
+    return salida
 
 
 class Consumidor:
-    def __init__(self, host_rabbitmq="localhost", consumidor_id=None):
+    """
+    Worker asincrono sobre SelectConnection. El hilo de pika recibe y publica;
+    un hilo aparte decodifica y evalua, de modo que recepcion, evaluacion y
+    publicacion se solapan. Las entregas se confirman en grupo (multiple=True)
+    solo cuando el broker confirmo (publisher confirms) los mensajes que
+    llevan sus resultados, asi que no se pierden resultados.
+
+    Los modelos llegan por el exchange fanout 'modelos' y quedan en cache por
+    modelo_id. Si llega trabajo de un modelo desconocido, la entrega espera
+    mientras se pide ese modelo al productor por 'solicitudes_modelo'.
+
+    Cada simulacion tiene su cola de trabajo (colas.cola_trabajo): al
+    conocer un modelo el worker empieza a consumir la suya, asi que atiende
+    varias simulaciones a la vez. El hilo de evaluacion las reparte segun
+    su 'prioridad' (ColaJusta), de modo que una larga no frena a una corta.
+    """
+
+    def __init__(self, host_rabbitmq="localhost", consumidor_id=None, contador=None,
+                 prefetch=None):
         self.host_rabbitmq = host_rabbitmq
+        self.contador = contador  # multiprocessing.Value compartido con el supervisor
+        # Sin un prefetch fijo se ajusta a lo que tarda cada unidad
+        self.prefetch = prefetch or PREFETCH
+        self.prefetch_adaptativo = PrefetchAdaptativo(PREFETCH) if prefetch is None else None
 
 
         suffix = random.randint(1000, 9999)
         self.consumidor_id = consumidor_id or f"worker_{int(time.time())}_{suffix}"
 
-        self.modelo_actual = None
-        self.modelo_id = None
         self.connection = None
-        self.channel = None
-        self.resultados = []
-
+        self.channel = None         # escenarios + publicaciones (con confirmaciones)
+        self.canal_modelo = None
+        self.cola_modelos = None    # cola exclusiva: difusion de modelos y respuestas
+
+        # Estado por modelo_id
+        self.modelos = {}
+        self.modelos_compilados = {}
+        self.agregados = {}         # Todo lo procesado de cada modelo
+        self.parciales = {}         # Lo procesado desde la ultima publicacion
+        self.en_parcial = {}        # entregas cuyo resultado solo esta en el parcial
+        self.rangos_parcial = {}    # [inicio, cantidad] de las unidades del parcial
+        self.ocupado_parcial = {}   # segundos evaluando las unidades del parcial
+        self.esperando_modelo = {}  # entregas de modelos aun desconocidos
+        self.solicitudes = {}       # modelo_id -> momento de la ultima solicitud
+        self.cancelados = set()     # modelos terminados: su trabajo pendiente se descarta
+        self.consumos = {}          # modelo_id -> consumer_tag de su cola de trabajo
+        self.ultimo_parcial = time.time()
+
+        # Evaluacion en un hilo aparte, con reparto justo entre simulaciones
+        self.tareas = ColaJusta()
+
+        # Confirmaciones: publicacion -> entregas que dependen de ella
+        self.numero_publicacion = 0
+        self.publicaciones = {}
+        self.pendientes = {}        # delivery_tag -> publicaciones sin confirmar
+        self.listas = set()         # entregas listas que aun no entran en el ack acumulado
+        self.liquidadas = set()     # entregas resueltas una a una (no se pueden volver a confirmar)
+        self.ultima_lista = 0
+        self.ultimo_ack = 0
+        self.momento_publicacion = {}  # numero de publicacion -> perf_counter al publicar
+
+        self.metricas = Metricas('worker', self.consumidor_id)
 
         self.tag_modelo = None
-        self.tag_escenarios = None
 
         print(f"Iniciando Worker: {self.consumidor_id}")
 
-    def conectar_rabbitmq(self):
-        try:
-            print(f"Conectando a RabbitMQ en {self.host_rabbitmq}...")
-            self.connection = pika.BlockingConnection(
-                pika.ConnectionParameters(host=self.host_rabbitmq, heartbeat=600)
-            )
-            self.channel = self.connection.channel()
-            self.channel.basic_qos(prefetch_count=50)
-
-            # Declarar colas
-            self.channel.queue_declare(queue='modelo', durable=True)
-            self.channel.queue_declare(queue='escenarios', durable=True)
-            self.channel.queue_declare(queue='resultados', durable=True)
-            return True
-        except Exception as e:
-            print(f"Error conectando a RabbitMQ: {e}")
-            return False
+    # --- Conexion -----------------------------------------------------------
 
-    def callback_modelo(self, ch, method, properties, body):
-        """Recibe la fórmula matemática"""
-        try:
-            modelo_msg = json.loads(body.decode('utf-8'))
-            if modelo_msg.get('tipo') == 'modelo':
-                self.modelo_actual = modelo_msg
-                self.modelo_id = modelo_msg['modelo_id']
-                self.resultados = []  # Limpiar memoria anterior
-
-                print(f"Modelo recibido: {modelo_msg['expresion']}")
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-
-
-                if self.tag_modelo:
-                    self.channel.basic_cancel(self.tag_modelo)
-                    self.tag_modelo = None
-
-                self.iniciar_consumo_escenarios()
-            else:
-                ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
-        except Exception as e:
-            print(f"Error modelo: {e}")
+    def conectar_rabbitmq(self):
+        print(f"Conectando a RabbitMQ en {self.host_rabbitmq}...")
+        self.connection = pika.SelectConnection(
+            pika.ConnectionParameters(host=self.host_rabbitmq, heartbeat=600),
+            on_open_callback=self.al_abrir_conexion,
+            on_open_error_callback=self.al_fallar_conexion,
+            on_close_callback=self.al_cerrar_conexion
+        )
 
-    def iniciar_consumo_escenarios(self):
+    def al_abrir_conexion(self, connection):
+        connection.channel(on_open_callback=self.al_abrir_canal)
+
+    def al_fallar_conexion(self, connection, error):
+        print(f"Error conectando a RabbitMQ: {error}")
+        connection.ioloop.stop()
+
+    def al_cerrar_conexion(self, connection, razon):
+        print(f"Conexión cerrada: {razon}")
+        connection.ioloop.stop()
+
+    def al_abrir_canal(self, channel):
+        self.channel = channel
+        channel.confirm_delivery(ack_nack_callback=self.al_confirmar)
+        # Limite de todo el canal (todas las colas de trabajo): se puede cambiar en marcha
+        channel.basic_qos(prefetch_count=self.prefetch, global_qos=True)
+
+        # Declarar colas y exchanges (las de trabajo, al conocer cada modelo)
+        channel.queue_declare(queue='resultados', durable=True)
+        channel.queue_declare(queue=COLA_METRICAS, **parametros_cola(COLA_METRICAS))
+        channel.exchange_declare(exchange='modelos', exchange_type='fanout', durable=True)
+        channel.exchange_declare(exchange='solicitudes_modelo', exchange_type='direct', durable=True)
+        channel.exchange_declare(exchange='parciales', exchange_type='fanout', durable=True)
+        channel.queue_bind(queue='resultados', exchange='parciales')
+        self.connection.channel(on_open_callback=self.al_abrir_canal_modelo)
+
+    def al_abrir_canal_modelo(self, channel):
+        self.canal_modelo = channel
+        channel.queue_declare(queue='', exclusive=True, callback=self.al_declarar_cola_modelos)
+
+    def al_declarar_cola_modelos(self, frame):
+        self.cola_modelos = frame.method.queue
+        self.canal_modelo.queue_bind(queue=self.cola_modelos, exchange='modelos',
+                                     callback=lambda _: self.consumir_modelo())
+
+    def consumir_modelo(self):
+        print("Buscando modelo...")
+        self.tag_modelo = self.canal_modelo.basic_consume(
+            queue=self.cola_modelos,
+            on_message_callback=self.callback_modelo,
+            auto_ack=True
+        )
+        # Los modelos vigentes (uno por productor activo) llegan enseguida,
+        # sin esperar ninguna retransmision; con cada uno se consume su cola
+        self.solicitar_modelo(MODELO_ACTUAL)
         print("Esperando escenarios de trabajo...")
-        self.tag_escenarios = self.channel.basic_consume(
-            queue='escenarios',
-            on_message_callback=self.callback_escenarios,
-            auto_ack=False
+        self.connection.ioloop.call_later(INTERVALO_ACKS, self.tarea_periodica)
+
+    def solicitar_modelo(self, modelo_id):
+        ahora = time.time()
+        if ahora - self.solicitudes.get(modelo_id, 0) < ESPERA_SOLICITUD:
+            return
+        self.solicitudes[modelo_id] = ahora
+        solicitud = {'tipo': 'solicitud_modelo', 'modelo_id': modelo_id, 'worker_id': self.consumidor_id}
+        self.canal_modelo.basic_publish(
+            exchange='solicitudes_modelo',
+            routing_key=modelo_id,
+            body=json.dumps(solicitud),
+            properties=pika.BasicProperties(reply_to=self.cola_modelos,
+                                            content_type=CONTENT_TYPE[FORMATO_JSON])
         )
 
-    def evaluar_modelo(self, expr, vars_dict):
-        funcs = {"sin": math.sin, "cos": math.cos, "tan": math.tan,
-                 "sqrt": math.sqrt, "exp": math.exp, "log": math.log,
-                 "pi": math.pi, "e": math.e}
-        try:
-            return eval(expr, {"__builtins__": None, **funcs}, vars_dict)
-        except Exception:
-            return None
+    # --- Modelo -------------------------------------------------------------
 
-    def callback_escenarios(self, ch, method, properties, body):
+    def callback_modelo(self, ch, method, properties, body):
+        """Recibe la fórmula matemática (difusión o respuesta a una solicitud)"""
         try:
-            mensaje = json.loads(body.decode('utf-8'))
-
-
-            if mensaje.get('tipo') == 'fin_escenarios':
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-
-                print(f"\nRESULTADOS FINALES - {self.consumidor_id}")
-                if len(self.resultados) > 0:
-                    arr_final = np.array(self.resultados)
-                    print(f"   Media final: {arr_final.mean():.6f}")
-                    print(f"   Desviacion estandar: {arr_final.std():.6f}")
-                    print(f"   Minimo: {arr_final.min():.6f}")
-                    print(f"   Maximo: {arr_final.max():.6f}")
-                    print(f"   Total procesados: {len(self.resultados)}")
-                else:
-                    print("   No se procesaron datos para este modelo.")
-
-
-                if self.tag_escenarios:
-                    self.channel.basic_cancel(self.tag_escenarios)
-                    self.tag_escenarios = None
-
-                # 2. Volver a escuchar modelos
-                print("Esperando nuevo modelo...")
-                self.tag_modelo = self.channel.basic_consume(
-                    queue='modelo',
-                    on_message_callback=self.callback_modelo
-                )
+            modelo_msg = json.loads(body.decode('utf-8'))
+            modelo_id = modelo_msg.get('modelo_id')
+            if modelo_msg.get('tipo') in ('cancelar', 'fin_escenarios') or modelo_msg.get('cancelado'):
+                self.cancelar_modelo(modelo_id, modelo_msg.get('tipo'))
+                return
+            if modelo_msg.get('tipo') != 'modelo' or modelo_id in self.modelos:
                 return
 
+            # Validar y compilar la expresion una sola vez por modelo
+            try:
+                self.modelos_compilados[modelo_id] = ModeloCompilado(
+                    modelo_msg['expresion'], modelo_msg['variables'])
+            except (SyntaxError, ValueError) as e:
+                print(f"Modelo rechazado: {e}")
+                return
 
-            if self.modelo_actual and mensaje.get('modelo_id') == self.modelo_id:
-                resultado = self.evaluar_modelo(
-                    self.modelo_actual['expresion'],
-                    mensaje['variables']
-                )
-
-                if resultado is not None:
-                    res_float = float(resultado)
-                    self.resultados.append(res_float)
+            self.modelos[modelo_id] = modelo_msg
+            self.agregados[modelo_id] = crear_agregado(modelo_msg.get('puntos'))
+            self.parciales[modelo_id] = crear_agregado(modelo_msg.get('puntos'))
+            self.en_parcial[modelo_id] = []
+            self.rangos_parcial[modelo_id] = []
+            self.ocupado_parcial[modelo_id] = 0.0
+            self.solicitudes.pop(modelo_id, None)
+            print(f"Modelo recibido: {modelo_msg['expresion']} (ID: {modelo_id}, "
+                  f"prioridad {modelo_msg.get('prioridad', PRIORIDAD_POR_DEFECTO)})")
+            self.consumir_trabajo(modelo_id)
+
+            # Trabajo que esperaba a este modelo
+            for delivery_tag, properties, body, _ in self.esperando_modelo.pop(modelo_id, []):
+                self.encolar(delivery_tag, properties, body, modelo_id)
+        except Exception as e:
+            print(f"Error modelo: {e}")
 
-                    # Enviar al visualizador
-                    resultado_msg = {
-                        'tipo': 'resultado',
-                        'worker_id': self.consumidor_id,
-                        'modelo_id': self.modelo_id,
-                        'resultado': res_float,
-                        'timestamp': time.time()
-                    }
-                    self.channel.basic_publish(
-                        exchange='',
-                        routing_key='resultados',
-                        body=json.dumps(resultado_msg),
-                        properties=pika.BasicProperties(delivery_mode=1)
+    def cancelar_modelo(self, modelo_id, tipo='cancelar'):
+        """
+        El productor alcanzo la precision pedida ('cancelar') o ya tiene todos
+        los resultados ('fin_escenarios'): se cierra el modelo y se descarta lo
+        pendiente (copias de unidades que ya completo otro worker)
+        """
+        if modelo_id in self.cancelados:
+            return
+        self.cancelados.add(modelo_id)
+        self.solicitudes.pop(modelo_id, None)
+        for delivery_tag, _, _, _ in self.esperando_modelo.pop(modelo_id, []):
+            self.marcar_lista(delivery_tag)
+        if modelo_id in self.modelos:
+            motivo = "completado" if tipo == 'fin_escenarios' else "cancelado por convergencia"
+            print(f"Modelo {modelo_id} {motivo}")
+            self.finalizar_modelo(modelo_id)
+
+    def consumir_trabajo(self, modelo_id):
+        """Empieza a consumir la cola de trabajo del modelo (se declara por si aun no existe)"""
+        cola = self.modelos[modelo_id].get('cola', cola_trabajo(modelo_id))
+
+        def al_declarar(_):
+            if modelo_id in self.cancelados or modelo_id in self.consumos:
+                return
+            self.consumos[modelo_id] = self.channel.basic_consume(
+                queue=cola,
+                on_message_callback=self.callback_escenarios,
+                auto_ack=False
+            )
 
-                    )
+        self.channel.queue_declare(queue=cola, callback=al_declarar, **parametros_cola(cola))
 
-                    if len(self.resultados) % 100 == 0:
-                        print(f"Procesados: {len(self.resultados)}")
+    def dejar_de_consumir(self, modelo_id):
+        """Cancela la suscripcion a la cola de un modelo terminado; lo ya recibido se sigue resolviendo"""
+        tag = self.consumos.pop(modelo_id, None)
+        if tag is not None and self.channel.is_open:
+            self.channel.basic_cancel(tag)
 
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+    # --- Evaluacion (hilo aparte) -------------------------------------------
 
+    def callback_escenarios(self, ch, method, properties, body):
+        # Espera en la cola, con el reloj del productor (aproximada entre nodos)
+        publicado = (getattr(properties, 'headers', None) or {}).get('publicado')
+        if publicado:
+            self.metricas.registrar('espera_cola', max(0.0, time.time() - publicado))
+        try:
+            modelo_id = modelo_id_de(body, properties)
         except Exception as e:
             print(f"Error procesando: {e}")
+            self.marcar_lista(method.delivery_tag)
+            return
+
+        if modelo_id in self.cancelados:
+            # Trabajo de un modelo ya terminado: se confirma sin evaluarlo
+            self.marcar_lista(method.delivery_tag)
+            return
+        if modelo_id is not None and modelo_id not in self.modelos:
+            # Modelo desconocido: se pide y la entrega espera (sin confirmar)
+            self.esperando_modelo.setdefault(modelo_id, []).append(
+                (method.delivery_tag, properties, body, time.time()))
+            self.solicitar_modelo(modelo_id)
+            return
+        self.encolar(method.delivery_tag, properties, body, modelo_id)
+
+    def encolar(self, delivery_tag, properties, body, modelo_id):
+        # Solo se encola: el modelo viaja con la tarea para no compartir estado con el hilo
+        modelo = self.modelos.get(modelo_id)
+        compilado = self.modelos_compilados.get(modelo_id)
+        formato = FORMATO_JSON
+        prioridad = PRIORIDAD_POR_DEFECTO
+        if modelo:
+            # Formato anunciado por el productor; JSON si no se conoce
+            formato = modelo.get('formato', FORMATO_JSON)
+            formato = formato if formato in FORMATOS else FORMATO_JSON
+            prioridad = modelo.get('prioridad', PRIORIDAD_POR_DEFECTO)
+        self.tareas.agregar(modelo_id, (delivery_tag, properties, body, modelo, compilado, formato), prioridad)
+
+    def hilo_evaluacion(self):
+        while True:
+            inicio = time.perf_counter()
+            modelo_id, (delivery_tag, properties, body, modelo, compilado, formato) = self.tareas.tomar()
+            ocioso = time.perf_counter() - inicio
+            try:
+                if modelo and modelo['modelo_id'] in self.cancelados:
+                    salida = {'mensaje': {'tipo': 'cancelado'}}
+                else:
+                    salida = evaluar_unidad(self.consumidor_id, properties, body, modelo, compilado, formato)
+            except Exception as e:
+                salida = {'error': e}
+            salida.setdefault('tiempos', {})['sin_trabajo'] = ocioso
+            self.tareas.cobrar(modelo_id, time.perf_counter() - inicio - ocioso)
+            self.connection.ioloop.add_callback_threadsafe(
+                functools.partial(self.completar_unidad, delivery_tag, salida))
+
+    # --- Resultados y confirmaciones (hilo de pika) -------------------------
+
+    def publicar(self, cuerpo, content_type, entregas, exchange='', routing_key='resultados'):
+        """Publica en 'resultados'; 'entregas' no se confirman hasta que el broker confirme"""
+        self.channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=cuerpo,
+            properties=pika.BasicProperties(delivery_mode=1, content_type=content_type)
+        )
+        # Todas las publicaciones del canal se numeran, tambien las que no llevan entregas
+        self.numero_publicacion += 1
+        self.publicaciones[self.numero_publicacion] = entregas
+        self.momento_publicacion[self.numero_publicacion] = time.perf_counter()
+
+    def completar_unidad(self, delivery_tag, salida):
+        for etapa, segundos in salida.get('tiempos', {}).items():
+            self.metricas.registrar(etapa, segundos)
+        if 'error' in salida:
+            print(f"Error procesando: {salida['error']}")
+            self.marcar_lista(delivery_tag)
+            return
+
+        mensaje = salida['mensaje']
+        modelo_id = mensaje.get('modelo_id')
+        if mensaje.get('tipo') == 'fin_escenarios':
+            self.marcar_lista(delivery_tag)
+            self.finalizar_modelo(modelo_id)
+            return
+
+        cantidad = salida.get('cantidad', 0)
+        if cantidad == 0 or modelo_id not in self.modelos or modelo_id in self.cancelados:
+            self.marcar_lista(delivery_tag)
+            return
+
+        self.metricas.contar('unidades')
+        self.metricas.contar('escenarios', cantidad)
+        ocupado = sum(salida['tiempos'].get(etapa, 0.0) for etapa in ('decodificar', 'generacion', 'evaluar'))
+        if self.prefetch_adaptativo is not None:
+            self.prefetch_adaptativo.registrar(ocupado)
+        agregado = self.agregados[modelo_id]
+        previos = agregado.cantidad
+        acumular(agregado, salida)
+        acumular(self.parciales[modelo_id], salida)
+        self.ocupado_parcial[modelo_id] += ocupado
+        if mensaje.get('inicio') is not None:
+            self.rangos_parcial[modelo_id].append([mensaje['inicio'], cantidad])
+        if self.contador is not None:
+            with self.contador.get_lock():
+                self.contador.value += cantidad
+
+        # La entrega espera al parcial que la incluye y, si hay, al lote de resultados
+        self.pendientes[delivery_tag] = 1
+        self.en_parcial[modelo_id].append(delivery_tag)
+        if 'cuerpo' in salida:
+            self.pendientes[delivery_tag] += 1
+            self.publicar(salida['cuerpo'], salida['content_type'], [delivery_tag])
+
+        # Con muchas entregas esperando al parcial se publica ya, para no agotar el prefetch.
+        # Con especulacion cada unidad va en su propio parcial: si una unidad se
+        # ejecuta dos veces, el productor puede descartar la copia que llegue segunda
+        if self.modelos[modelo_id].get('especulacion') \
+                or self.parciales[modelo_id].cantidad >= ESCENARIOS_POR_PARCIAL \
+                or len(self.en_parcial[modelo_id]) >= max(1, self.prefetch // 2):
+            self.publicar_parcial(modelo_id)
+
+        if agregado.cantidad // 100 > previos // 100:
+            print(f"Procesados: {agregado.cantidad}")
+
+    def publicar_parcial(self, modelo_id):
+        """Publica lo acumulado desde la ultima vez y empieza un parcial nuevo"""
+        parcial = self.parciales.get(modelo_id)
+        if parcial is None or parcial.cantidad == 0:
+            return
+        parcial_msg = {
+            'tipo': 'parcial',
+            'worker_id': self.consumidor_id,
+            'modelo_id': modelo_id,
+            'agregado': parcial.a_dict(),
+            'rangos': self.rangos_parcial[modelo_id],
+            'segundos': self.ocupado_parcial[modelo_id],  # para que el productor mida el ritmo
+            'timestamp': time.time()
+        }
+        # Por 'parciales' llega a 'resultados' y al productor, que sigue la convergencia
+        self.publicar(json.dumps(parcial_msg), CONTENT_TYPE[FORMATO_JSON], self.en_parcial[modelo_id],
+                      exchange='parciales')
+        self.en_parcial[modelo_id] = []
+        self.rangos_parcial[modelo_id] = []
+        self.ocupado_parcial[modelo_id] = 0.0
+        self.parciales[modelo_id] = crear_agregado(self.modelos[modelo_id].get('puntos'))
+
+    def al_confirmar(self, frame):
+        """Confirmacion (o rechazo) del broker de una o varias publicaciones"""
+        metodo = frame.method
+        confirmado = isinstance(metodo, pika.spec.Basic.Ack)
+        if metodo.multiple:
+            numeros = [n for n in self.publicaciones if n <= metodo.delivery_tag]
+        else:
+            numeros = [metodo.delivery_tag] if metodo.delivery_tag in self.publicaciones else []
+
+        for numero in sorted(numeros):
+            self.metricas.registrar('confirmacion', time.perf_counter() - self.momento_publicacion.pop(numero))
+            for delivery_tag in self.publicaciones.pop(numero):
+                if delivery_tag not in self.pendientes:
+                    continue
+                if not confirmado:
+                    # Resultado perdido: la entrega vuelve a la cola para repetirse
+                    del self.pendientes[delivery_tag]
+                    self.liquidar(delivery_tag)
+                    continue
+                self.pendientes[delivery_tag] -= 1
+                if self.pendientes[delivery_tag] == 0:
+                    del self.pendientes[delivery_tag]
+                    self.marcar_lista(delivery_tag)
+
+    def liquidar(self, delivery_tag):
+        """Devuelve una entrega a la cola de forma individual"""
+        self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        self.liquidadas.add(delivery_tag)
+        self.marcar_lista(delivery_tag)
+
+    def marcar_lista(self, delivery_tag):
+        self.listas.add(delivery_tag)
+        while self.ultima_lista + 1 in self.listas:
+            self.ultima_lista += 1
+            self.listas.discard(self.ultima_lista)
+        if self.ultima_lista - self.ultimo_ack >= max(1, self.prefetch // 2):
+            self.enviar_acks()
+
+    def enviar_acks(self, sueltas=False):
+        """
+        Confirma de una vez todas las entregas listas consecutivas. Con
+        'sueltas' tambien confirma una a una las listas que quedan detras de un
+        hueco: con varias simulaciones una entrega de la menos prioritaria
+        puede esperar su turno, y sin esto retendria el prefetch de las demas.
+        """
+        if sueltas:
+            for suelta in sorted(self.listas - self.liquidadas):
+                self.channel.basic_ack(delivery_tag=suelta)
+                self.liquidadas.add(suelta)
+                self.metricas.contar('acks')
+        tag = self.ultima_lista
+        while tag > self.ultimo_ack and tag in self.liquidadas:
+            tag -= 1
+        if tag > self.ultimo_ack:
+            self.channel.basic_ack(delivery_tag=tag, multiple=True)
+            self.metricas.contar('acks')
+            self.metricas.contar('entregas_confirmadas', tag - self.ultimo_ack)
+        self.liquidadas = {t for t in self.liquidadas if t > self.ultima_lista}
+        self.ultimo_ack = self.ultima_lista
+
+    def tarea_periodica(self):
+        if time.time() - self.ultimo_parcial >= INTERVALO_PARCIAL:
+            self.ultimo_parcial = time.time()
+            for modelo_id in list(self.parciales):
+                self.publicar_parcial(modelo_id)
+
+        # Modelos que aun no llegan: se vuelven a pedir, y si tardan demasiado
+        # la entrega vuelve a la cola para que la tome otro worker
+        for modelo_id, esperando in list(self.esperando_modelo.items()):
+            vigentes = [t for t in esperando if time.time() - t[3] < ESPERA_MODELO_MAX]
+            for tarea in esperando:
+                if tarea not in vigentes:
+                    self.liquidar(tarea[0])
+            if vigentes:
+                self.esperando_modelo[modelo_id] = vigentes
+                self.solicitar_modelo(modelo_id)
+            else:
+                del self.esperando_modelo[modelo_id]
+
+        self.enviar_acks(sueltas=len(self.consumos) > 1)
+        self.ajustar_prefetch()
+        if self.metricas.vencidas():
+            self.publicar_metricas()
+        self.connection.ioloop.call_later(INTERVALO_ACKS, self.tarea_periodica)
+
+    def ajustar_prefetch(self):
+        if self.prefetch_adaptativo is None or self.prefetch_adaptativo.valor == self.prefetch:
+            return
+        self.prefetch = self.prefetch_adaptativo.valor
+        self.channel.basic_qos(prefetch_count=self.prefetch, global_qos=True)
+
+    def publicar_metricas(self):
+        self.metricas.valor('en_evaluacion', len(self.tareas))
+        self.metricas.valor('prefetch', self.prefetch)
+        self.metricas.valor('sin_confirmar', len(self.pendientes))
+        self.publicar(json.dumps(self.metricas.a_mensaje()), CONTENT_TYPE[FORMATO_JSON], [],
+                      routing_key=COLA_METRICAS)
+
+    def finalizar_modelo(self, modelo_id):
+        print(f"\nRESULTADOS FINALES - {self.consumidor_id}")
+        self.dejar_de_consumir(modelo_id)
+        self.publicar_parcial(modelo_id)
+        agregado = self.agregados.get(modelo_id)
+        if isinstance(agregado, AcumuladorBarrido) and agregado.cantidad > 0:
+            print(f"   Barrido de {len(agregado.puntos)} puntos (el productor muestra cada uno)")
+            print(f"   Total procesados: {agregado.cantidad} escenarios por punto")
+        elif agregado is not None and agregado.cantidad > 0:
+            print(f"   Media final: {agregado.media:.6f}")
+            print(f"   Desviacion estandar: {agregado.desviacion:.6f}")
+            print(f"   Minimo: {agregado.minimo:.6f}")
+            print(f"   Maximo: {agregado.maximo:.6f}")
+            print(f"   Percentiles 5/50/95: {agregado.sketch.cuantil(0.05):.6f} / "
+                  f"{agregado.sketch.cuantil(0.5):.6f} / {agregado.sketch.cuantil(0.95):.6f}")
+            print(f"   Total procesados: {agregado.cantidad}")
+            print(f"   Resultados validos: {agregado.n}")
+            print(f"   Escenarios fallidos (NaN): {agregado.fallidos}")
+        else:
+            print("   No se procesaron datos para este modelo.")
+        print("Esperando nuevo trabajo...")
+
+    def iniciar(self):
+        self.conectar_rabbitmq()
+        threading.Thread(target=self.hilo_evaluacion, daemon=True).start()
+        try:
+            self.connection.ioloop.start()
+        except KeyboardInterrupt:
+            print("Deteniendo worker...")
+            if self.connection.is_open:
+                self.enviar_acks()
+                self.connection.close()
+                self.connection.ioloop.start()
+
+
+def proceso_worker(host, consumidor_id, contador, prefetch):
+    Consumidor(host, consumidor_id, contador, prefetch).iniciar()
+
+
+def trabajar_local(colas, modelo_msg, worker_id):
+    """
+    Worker del modo local (un proceso por nucleo): el modelo llega como
+    argumento y no hay confirmaciones que esperar. Termina con 'fin_escenarios'
+    tras publicar su ultimo parcial, marcado como final.
+    """
+    compilado = ModeloCompilado(modelo_msg['expresion'], modelo_msg['variables'])
+    formato = modelo_msg.get('formato', FORMATO_JSON)
+    parcial = crear_agregado(modelo_msg.get('puntos'))
+    ultimo_parcial = time.time()
+
+    def publicar_parcial(final=False):
+        parcial_msg = {
+            'tipo': 'parcial',
+            'worker_id': worker_id,
+            'modelo_id': modelo_msg['modelo_id'],
+            'agregado': parcial.a_dict(),
+            'final': final,
+            'timestamp': time.time()
+        }
+        colas.publicar('resultados', json.dumps(parcial_msg), CONTENT_TYPE[FORMATO_JSON])
+
+    for cuerpo, content_type in colas.consumir('escenarios'):
+        salida = evaluar_unidad(worker_id, None, cuerpo, modelo_msg, compilado, formato)
+        if salida['mensaje'].get('tipo') == 'fin_escenarios':
+            break
+        acumular(parcial, salida)
+        if 'cuerpo' in salida:
+            colas.publicar('resultados', salida['cuerpo'], salida['content_type'])
+
+        if parcial.cantidad >= ESCENARIOS_POR_PARCIAL or time.time() - ultimo_parcial >= INTERVALO_PARCIAL:
+            publicar_parcial()
+            parcial = crear_agregado(modelo_msg.get('puntos'))
+            ultimo_parcial = time.time()
+
+    publicar_parcial(final=True)
+    colas.cerrar()
+
+
+class Supervisor:
+    """Lanza N procesos Consumidor en este nodo, los reinicia si caen y publica su rendimiento"""
+
+    def __init__(self, host_rabbitmq, procesos, prefetch=None):
+        self.host_rabbitmq = host_rabbitmq
+        self.prefetch = prefetch
+        self.nodo = socket.gethostname()
+        self.procesos = procesos
+        self.hijos = {}      # worker_id -> Process
+        self.contadores = {}  # worker_id -> Value con los escenarios procesados
+        self.reinicios = {}
+        self.ultimos = {}    # worker_id -> escenarios en la revision anterior
+        self.connection = None
+        self.channel = None
 
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+    def worker_id(self, indice):
+        # ID estable: el mismo proceso conserva su ID aunque se reinicie
+        return f"{self.nodo}_p{indice}"
+
+    def lanzar(self, worker_id):
+        if worker_id not in self.contadores:
+            self.contadores[worker_id] = multiprocessing.Value('q', 0)
+        proceso = multiprocessing.Process(
+            target=proceso_worker,
+            args=(self.host_rabbitmq, worker_id, self.contadores[worker_id], self.prefetch),
+            name=worker_id,
+            daemon=True
+        )
+        proceso.start()
+        self.hijos[worker_id] = proceso
+
+    def revisar_hijos(self):
+        for worker_id, proceso in list(self.hijos.items()):
+            if not proceso.is_alive():
+                self.reinicios[worker_id] = self.reinicios.get(worker_id, 0) + 1
+                print(f"Proceso {worker_id} terminó (código {proceso.exitcode}), reiniciando...")
+                self.lanzar(worker_id)
+
+    def publicar_rendimiento(self, intervalo):
+        procesos = {}
+        for worker_id, contador in self.contadores.items():
+            total = contador.value
+            procesos[worker_id] = {
+                'escenarios': total,
+                'por_segundo': (total - self.ultimos.get(worker_id, 0)) / intervalo,
+                'reinicios': self.reinicios.get(worker_id, 0)
+            }
+            self.ultimos[worker_id] = total
+
+        rendimiento_msg = {
+            'tipo': 'rendimiento',
+            'nodo': self.nodo,
+            'procesos': procesos,
+            'escenarios': sum(p['escenarios'] for p in procesos.values()),
+            'por_segundo': sum(p['por_segundo'] for p in procesos.values()),
+            'timestamp': time.time()
+        }
+        self.channel.basic_publish(
+            exchange='',
+            routing_key='resultados',
+            body=json.dumps(rendimiento_msg),
+            properties=pika.BasicProperties(delivery_mode=1, content_type=CONTENT_TYPE[FORMATO_JSON])
+        )
 
     def iniciar(self):
-        if self.conectar_rabbitmq():
-            print("Buscando modelo...")
-            self.tag_modelo = self.channel.basic_consume(
-                queue='modelo',
-                on_message_callback=self.callback_modelo
-            )
-            try:
-                self.channel.start_consuming()
-            except KeyboardInterrupt:
-                print("Deteniendo worker...")
-                self.channel.stop_consuming()
+        print(f"Supervisor en {self.nodo}: lanzando {self.procesos} procesos")
+        for indice in range(self.procesos):
+            self.lanzar(self.worker_id(indice))
+
+        try:
+            while True:
+                try:
+                    if self.connection is None or self.connection.is_closed:
+                        self.connection = pika.BlockingConnection(
+                            pika.ConnectionParameters(host=self.host_rabbitmq, heartbeat=600))
+                        self.channel = self.connection.channel()
+                        self.channel.queue_declare(queue='resultados', durable=True)
+                    self.connection.sleep(INTERVALO_SUPERVISOR)
+                    self.revisar_hijos()
+                    self.publicar_rendimiento(INTERVALO_SUPERVISOR)
+                except pika.exceptions.AMQPError as e:
+                    # Sin broker no se publica, pero se sigue vigilando a los hijos
+                    print(f"Supervisor sin conexión: {e}")
+                    self.connection = None
+                    time.sleep(INTERVALO_SUPERVISOR)
+                    self.revisar_hijos()
+        except KeyboardInterrupt:
+            print("Deteniendo procesos...")
+        finally:
+            for proceso in self.hijos.values():
+                proceso.terminate()
+            for proceso in self.hijos.values():
+                proceso.join()
+            if self.connection and self.connection.is_open:
                 self.connection.close()
 
 
 if __name__ == "__main__":
-    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
-    Consumidor(host).iniciar()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Worker del sistema Montecarlo distribuido")
+    parser.add_argument("host", nargs="?", default="localhost", help="host de RabbitMQ")
+    parser.add_argument("--procesos", default=None,
+                        help="número de procesos worker en este nodo, o 'auto' (uno por CPU)")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="unidades de trabajo sin confirmar por worker (por defecto se adapta "
+                             f"a su ritmo, empezando en {PREFETCH})")
+    args = parser.parse_args()
+
+    if args.procesos is None:
+        Consumidor(args.host, prefetch=args.prefetch).iniciar()
+    else:
+        procesos = os.cpu_count() if args.procesos == 'auto' else int(args.procesos)
+        Supervisor(args.host, max(1, procesos), args.prefetch).iniciar()
@@ -0,0 +1,540 @@
+import sys
+import math
+import numpy as np
+from statistics import NormalDist
+
+# Estadisticas en streaming con memoria O(1) que se pueden fusionar de forma
+# exacta: cada worker acumula sus parciales y cualquiera puede combinarlos.
+
+NUM_BINS = 64
+ALFA_SKETCH = 0.01
+MAX_CUBETAS_SKETCH = 2048
+# Los indices de bin (valor / ancho) tienen que entrar en un int64: el ancho
+# nunca es menor que 2**-BITS_INDICE veces el valor de mayor magnitud
+BITS_INDICE = 62
+# Acumulador: desvios de hasta 2**BITS_SIN_ESCALA se elevan al cuadrado tal
+# cual; los mayores (valores de 1e150 en adelante) se escalan por potencias de
+# dos para que M2 no desborde
+BITS_SIN_ESCALA = 448
+# Rejilla de densidad de pares (x, y) y muestra de puntos para graficarlos
+NUM_BINS_DENSIDAD = 128
+CAPACIDAD_MUESTRA = 2000
+
+
+def _exponente_minimo(minimo, maximo):
+    """Exponente de ancho mas chico con el que valor / ancho no desborda"""
+    return math.frexp(max(abs(minimo), abs(maximo)))[1] - BITS_INDICE
+
+
+def _exponente_para(minimo, maximo, num_bins):
+    """Exponente del ancho con el que [minimo, maximo] entra en num_bins bins"""
+    # La mitad de la extension no desborda aunque los extremos sean +-1e308
+    mitad = maximo / 2 - minimo / 2
+    if mitad <= 0:
+        mitad = abs(maximo) / 2 or 0.5
+    # Con subnormales el cociente se iria a cero antes del log2
+    mitad = max(mitad, sys.float_info.min)
+    return math.ceil(math.log2(mitad / (num_bins - 1))) + 1
+
+
+def _escala_para(valor):
+    """Potencia de dos k tal que desvios de hasta 2 * |valor| divididos por 2**k se pueden elevar al cuadrado"""
+    return max(0, math.frexp(valor)[1] + 1 - BITS_SIN_ESCALA)
+
+
+def _desescalar(valor, k):
+    """valor * 2**k, o infinito si no entra en un float"""
+    try:
+        return math.ldexp(valor, k)
+    except OverflowError:
+        return math.copysign(math.inf, valor)
+
+
+class HistogramaAdaptativo:
+    """
+    Histograma de NUM_BINS bins de ancho 2**exponente alineados a multiplos
+    del ancho. Si un valor cae fuera de la ventana, el ancho se duplica
+    (fusionando bins vecinos) hasta que todo entra. Como los bordes siempre
+    son multiplos de potencias de dos, dos histogramas se fusionan sin error.
+    """
+
+    def __init__(self, num_bins=NUM_BINS):
+        self.num_bins = num_bins
+        self.exponente = None
+        self.desde = 0
+        self.conteos = np.zeros(num_bins, dtype=np.int64)
+
+    @property
+    def ancho(self):
+        return 2.0 ** self.exponente
+
+    @property
+    def total(self):
+        return int(self.conteos.sum())
+
+    def bordes(self):
+        if self.exponente is None:
+            return np.empty(0)
+        return (self.desde + np.arange(self.num_bins + 1)) * self.ancho
+
+    def _reubicar(self, exponente, desde):
+        """Pasa los conteos a un ancho 2**exponente (>= actual) y a la ventana 'desde'"""
+        nuevos = np.zeros(self.num_bins, dtype=np.int64)
+        if self.exponente is not None:
+            ocupados = np.nonzero(self.conteos)[0]
+            indices = (self.desde + ocupados) >> (exponente - self.exponente)
+            np.add.at(nuevos, indices - desde, self.conteos[ocupados])
+        self.conteos = nuevos
+        self.exponente = exponente
+        self.desde = desde
+
+    def _ajustar_ventana(self, indice_min, indice_max, exponente):
+        """Deja la ventana cubriendo [indice_min, indice_max] (en 'exponente' o mas grueso)"""
+        if self.exponente is not None:
+            if self.exponente > exponente:
+                corrimiento = self.exponente - exponente
+                indice_min >>= corrimiento
+                indice_max >>= corrimiento
+                exponente = self.exponente
+            ocupados = np.nonzero(self.conteos)[0]
+            if len(ocupados):
+                corrimiento = exponente - self.exponente
+                indice_min = min(indice_min, (self.desde + int(ocupados[0])) >> corrimiento)
+                indice_max = max(indice_max, (self.desde + int(ocupados[-1])) >> corrimiento)
+
+        while indice_max - indice_min + 1 > self.num_bins:
+            exponente += 1
+            indice_min >>= 1
+            indice_max >>= 1
+
+        if exponente == self.exponente and self.desde <= indice_min \
+                and indice_max < self.desde + self.num_bins:
+            return
+        # Centrar los datos en la ventana deja margen para crecer a ambos lados
+        holgura = (self.num_bins - (indice_max - indice_min + 1)) // 2
+        self._reubicar(exponente, indice_min - holgura)
+
+    def agregar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[np.isfinite(valores)]
+        if len(valores) == 0:
+            return
+        minimo, maximo = float(valores.min()), float(valores.max())
+
+        exponente = self.exponente
+        if exponente is None:
+            exponente = _exponente_para(minimo, maximo, self.num_bins)
+        # Un valor mucho mas grande que el ancho actual engruesa antes de dividir
+        exponente = max(exponente, _exponente_minimo(minimo, maximo))
+        ancho = 2.0 ** exponente
+        self._ajustar_ventana(math.floor(minimo / ancho), math.floor(maximo / ancho), exponente)
+
+        indices = np.floor(valores / self.ancho).astype(np.int64) - self.desde
+        # Redondeos en el borde superior
+        np.clip(indices, 0, self.num_bins - 1, out=indices)
+        self.conteos += np.bincount(indices, minlength=self.num_bins)
+
+    def fusionar(self, otro):
+        if otro.exponente is None or not otro.conteos.any():
+            return self
+        ocupados = np.nonzero(otro.conteos)[0]
+        exponente = otro.exponente if self.exponente is None else max(self.exponente, otro.exponente)
+        corrimiento = exponente - otro.exponente
+        self._ajustar_ventana((otro.desde + int(ocupados[0])) >> corrimiento,
+                              (otro.desde + int(ocupados[-1])) >> corrimiento, exponente)
+
+        indices = ((otro.desde + ocupados) >> (self.exponente - otro.exponente)) - self.desde
+        np.add.at(self.conteos, indices, otro.conteos[ocupados])
+        return self
+
+    def a_dict(self):
+        ocupados = np.nonzero(self.conteos)[0]
+        return {'num_bins': self.num_bins, 'exponente': self.exponente, 'desde': self.desde,
+                'bins': {int(k): int(self.conteos[k]) for k in ocupados}}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        histograma = cls(datos['num_bins'])
+        histograma.exponente = datos['exponente']
+        histograma.desde = datos['desde']
+        for k, conteo in datos['bins'].items():
+            histograma.conteos[int(k)] = conteo
+        return histograma
+
+
+class Densidad2D:
+    """
+    Conteos de pares (x, y) en una rejilla fija de num_bins x num_bins, con
+    la misma idea que HistogramaAdaptativo en cada eje: bins de ancho
+    2**exponente alineados a multiplos del ancho, que se duplican (fusionando
+    vecinos) cuando un punto cae fuera. La memoria y el costo de dibujarla no
+    dependen de cuantos puntos se agregaron.
+    """
+
+    def __init__(self, num_bins=NUM_BINS_DENSIDAD):
+        self.num_bins = num_bins
+        self.exponentes = [None, None]
+        self.desdes = [0, 0]
+        self.conteos = np.zeros((num_bins, num_bins), dtype=np.int64)  # [indice x, indice y]
+
+    @property
+    def total(self):
+        return int(self.conteos.sum())
+
+    def extension(self):
+        """(x0, x1, y0, y1) de la rejilla, para imshow(extent=...)"""
+        if self.exponentes[0] is None:
+            return None
+        (ex, ey), (dx, dy) = self.exponentes, self.desdes
+        return (dx * 2.0 ** ex, (dx + self.num_bins) * 2.0 ** ex,
+                dy * 2.0 ** ey, (dy + self.num_bins) * 2.0 ** ey)
+
+    def _reubicar(self, eje, exponente, desde):
+        """Pasa los conteos del eje a un ancho 2**exponente (>= actual) y a la ventana 'desde'"""
+        nuevos = np.zeros_like(self.conteos)
+        if self.exponentes[eje] is not None:
+            conteos = self.conteos if eje == 0 else self.conteos.T
+            ocupados = np.nonzero(conteos.any(axis=1))[0]
+            indices = ((self.desdes[eje] + ocupados) >> (exponente - self.exponentes[eje])) - desde
+            np.add.at(nuevos if eje == 0 else nuevos.T, indices, conteos[ocupados])
+        self.conteos = nuevos
+        self.exponentes[eje] = exponente
+        self.desdes[eje] = desde
+
+    def _ajustar_eje(self, eje, minimo, maximo):
+        exponente = self.exponentes[eje]
+        if exponente is None:
+            exponente = _exponente_para(minimo, maximo, self.num_bins)
+        exponente = max(exponente, _exponente_minimo(minimo, maximo))
+        ancho = 2.0 ** exponente
+        indice_min, indice_max = math.floor(minimo / ancho), math.floor(maximo / ancho)
+        if self.exponentes[eje] is not None:
+            ocupados = np.nonzero(self.conteos.any(axis=1 - eje))[0]
+            if len(ocupados):
+                corrimiento = exponente - self.exponentes[eje]
+                indice_min = min(indice_min, (self.desdes[eje] + int(ocupados[0])) >> corrimiento)
+                indice_max = max(indice_max, (self.desdes[eje] + int(ocupados[-1])) >> corrimiento)
+
+        while indice_max - indice_min + 1 > self.num_bins:
+            exponente += 1
+            indice_min >>= 1
+            indice_max >>= 1
+
+        desde = self.desdes[eje]
+        if exponente == self.exponentes[eje] and desde <= indice_min and indice_max < desde + self.num_bins:
+            return
+        holgura = (self.num_bins - (indice_max - indice_min + 1)) // 2
+        self._reubicar(eje, exponente, indice_min - holgura)
+
+    def _indices(self, eje, valores):
+        indices = np.floor(valores / 2.0 ** self.exponentes[eje]).astype(np.int64) - self.desdes[eje]
+        return np.clip(indices, 0, self.num_bins - 1)
+
+    def agregar(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        validos = np.isfinite(x) & np.isfinite(y)
+        x, y = x[validos], y[validos]
+        if len(x) == 0:
+            return
+        self._ajustar_eje(0, float(x.min()), float(x.max()))
+        self._ajustar_eje(1, float(y.min()), float(y.max()))
+        celdas = self._indices(0, x) * self.num_bins + self._indices(1, y)
+        self.conteos += np.bincount(celdas, minlength=self.num_bins ** 2).reshape(self.conteos.shape)
+
+    def conteo_en(self, x, y):
+        """Conteo de la celda donde cae cada punto (0 si la rejilla esta vacia)"""
+        x = np.asarray(x, dtype=np.float64)
+        if self.exponentes[0] is None:
+            return np.zeros(len(x), dtype=np.int64)
+        return self.conteos[self._indices(0, x), self._indices(1, np.asarray(y, dtype=np.float64))]
+
+
+class MuestraReservorio:
+    """Muestra uniforme de a lo sumo 'capacidad' filas de un flujo (algoritmo R, por lotes)"""
+
+    def __init__(self, capacidad=CAPACIDAD_MUESTRA, columnas=2, semilla=None):
+        self.capacidad = capacidad
+        self.vistos = 0
+        self.filas = np.empty((capacidad, columnas))
+        self.rng = np.random.default_rng(semilla)
+
+    def agregar(self, *columnas):
+        lote = np.column_stack(columnas).astype(np.float64)
+        # Las primeras filas llenan la muestra
+        libres = min(max(self.capacidad - self.vistos, 0), len(lote))
+        self.filas[self.vistos:self.vistos + libres] = lote[:libres]
+        # La fila numero i (desde 0) reemplaza a una al azar con probabilidad capacidad / (i + 1)
+        posiciones = self.vistos + np.arange(libres, len(lote))
+        destinos = (self.rng.random(len(posiciones)) * (posiciones + 1)).astype(np.int64)
+        elegidas = destinos < self.capacidad
+        self.filas[destinos[elegidas]] = lote[libres:][elegidas]
+        self.vistos += len(lote)
+
+    def muestra(self):
+        return self.filas[:min(self.vistos, self.capacidad)]
+
+
+class SketchCuantiles:
+    """
+    Sketch de cuantiles con error relativo ALFA_SKETCH (estilo DDSketch):
+    cada valor cae en la cubeta ceil(log_gamma(|x|)). Fusionar dos sketches
+    es sumar sus cubetas, asi que la fusion es exacta.
+    """
+
+    MINIMO_INDEXABLE = 1e-300
+
+    def __init__(self, alfa=ALFA_SKETCH, max_cubetas=MAX_CUBETAS_SKETCH):
+        self.alfa = alfa
+        self.gamma = (1 + alfa) / (1 - alfa)
+        self.log_gamma = math.log(self.gamma)
+        self.max_cubetas = max_cubetas
+        self.positivos = {}
+        self.negativos = {}
+        self.ceros = 0
+
+    @property
+    def total(self):
+        return self.ceros + sum(self.positivos.values()) + sum(self.negativos.values())
+
+    def _sumar(self, cubetas, magnitudes):
+        claves = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        unicas, conteos = np.unique(claves, return_counts=True)
+        for clave, conteo in zip(unicas.tolist(), conteos.tolist()):
+            cubetas[clave] = cubetas.get(clave, 0) + conteo
+
+    def _colapsar(self, cubetas):
+        """Si hay demasiadas cubetas se juntan las de menor magnitud"""
+        exceso = len(cubetas) - self.max_cubetas
+        if exceso <= 0:
+            return
+        claves = sorted(cubetas)
+        destino = claves[exceso]
+        for clave in claves[:exceso]:
+            cubetas[destino] += cubetas.pop(clave)
+
+    def agregar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[np.isfinite(valores)]
+        magnitudes = np.abs(valores)
+        ceros = magnitudes < self.MINIMO_INDEXABLE
+        self.ceros += int(np.count_nonzero(ceros))
+        self._sumar(self.positivos, valores[(valores > 0) & ~ceros])
+        self._sumar(self.negativos, -valores[(valores < 0) & ~ceros])
+        self._colapsar(self.positivos)
+        self._colapsar(self.negativos)
+
+    def fusionar(self, otro):
+        if otro.alfa != self.alfa:
+            raise ValueError("No se pueden fusionar sketches con distinto alfa")
+        for propias, ajenas in ((self.positivos, otro.positivos), (self.negativos, otro.negativos)):
+            for clave, conteo in ajenas.items():
+                propias[clave] = propias.get(clave, 0) + conteo
+            self._colapsar(propias)
+        self.ceros += otro.ceros
+        return self
+
+    def _valor(self, clave):
+        return 2 * self.gamma ** clave / (self.gamma + 1)
+
+    def cuantil(self, q):
+        total = self.total
+        if total == 0:
+            return float('nan')
+        rango = q * (total - 1)
+        acumulado = 0
+        for clave in sorted(self.negativos, reverse=True):
+            acumulado += self.negativos[clave]
+            if acumulado > rango:
+                return -self._valor(clave)
+        acumulado += self.ceros
+        if acumulado > rango:
+            return 0.0
+        for clave in sorted(self.positivos):
+            acumulado += self.positivos[clave]
+            if acumulado > rango:
+                return self._valor(clave)
+        return self._valor(max(self.positivos))
+
+    def a_dict(self):
+        return {'alfa': self.alfa, 'ceros': self.ceros,
+                'positivos': self.positivos, 'negativos': self.negativos}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        sketch = cls(datos['alfa'])
+        sketch.ceros = datos['ceros']
+        sketch.positivos = {int(k): v for k, v in datos['positivos'].items()}
+        sketch.negativos = {int(k): v for k, v in datos['negativos'].items()}
+        return sketch
+
+
+class Acumulador:
+    """
+    Conteo, media y M2 (Welford), minimo, maximo, histograma y cuantiles.
+    M2 se guarda dividido por 4**escala_m2 (escala_m2 es 0 salvo con valores
+    enormes, ver BITS_SIN_ESCALA).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.escala_m2 = 0
+        self.minimo = math.inf
+        self.maximo = -math.inf
+        self.fallidos = 0
+        self.histograma = HistogramaAdaptativo()
+        self.sketch = SketchCuantiles()
+
+    @property
+    def cantidad(self):
+        """Escenarios procesados, incluidos los que dieron NaN"""
+        return self.n + self.fallidos
+
+    @property
+    def varianza(self):
+        return _desescalar(self.m2 / self.n, 2 * self.escala_m2) if self.n > 0 else float('nan')
+
+    @property
+    def desviacion(self):
+        return _desescalar(math.sqrt(self.m2 / self.n), self.escala_m2) if self.n > 0 else float('nan')
+
+    @property
+    def error_estandar(self):
+        """Error estandar de la media (con la varianza muestral)"""
+        if self.n <= 1:
+            return float('nan')
+        return _desescalar(math.sqrt(self.m2 / (self.n - 1) / self.n), self.escala_m2)
+
+    def semiamplitud(self, confianza=0.95):
+        """Semiamplitud del intervalo de confianza de la media (aproximacion normal)"""
+        return NormalDist().inv_cdf(0.5 + confianza / 2) * self.error_estandar
+
+    def _combinar_momentos(self, n, media, m2, escala_m2=0):
+        # Formula de Chan et al. para combinar (n, media, M2) de dos grupos,
+        # con los desvios divididos por 2**k para que el cuadrado no desborde
+        total = self.n + n
+        mitad_delta = media / 2 - self.media / 2
+        k = max(self.escala_m2, escala_m2, _escala_para(mitad_delta))
+        # Sin escala se resta directo: la mitad de un subnormal se pierde
+        delta = media - self.media if k == 0 else math.ldexp(mitad_delta, 1 - k)
+        if k == 0:
+            self.media += delta * n / total
+        else:
+            # Promedio ponderado: no pasa del mayor de los dos aunque delta si
+            self.media = self.media * (self.n / total) + media * (n / total)
+        self.m2 = math.ldexp(self.m2, 2 * (self.escala_m2 - k)) \
+            + (math.ldexp(m2, 2 * (escala_m2 - k)) + delta * delta * self.n * n / total)
+        self.escala_m2 = k
+        self.n = total
+
+    def agregar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        finitos = valores[np.isfinite(valores)]
+        self.fallidos += len(valores) - len(finitos)
+        if len(finitos) == 0:
+            return
+        k = _escala_para(float(np.abs(finitos).max()))
+        escalados = np.ldexp(finitos, -k) if k else finitos
+        media = float(escalados.mean())
+        m2 = float(((escalados - media) ** 2).sum())
+        self._combinar_momentos(len(finitos), math.ldexp(media, k), m2, k)
+        self.minimo = min(self.minimo, float(finitos.min()))
+        self.maximo = max(self.maximo, float(finitos.max()))
+        self.histograma.agregar(finitos)
+        self.sketch.agregar(finitos)
+
+    def fusionar(self, otro):
+        if otro.n > 0:
+            self._combinar_momentos(otro.n, otro.media, otro.m2, otro.escala_m2)
+            self.minimo = min(self.minimo, otro.minimo)
+            self.maximo = max(self.maximo, otro.maximo)
+        self.fallidos += otro.fallidos
+        self.histograma.fusionar(otro.histograma)
+        self.sketch.fusionar(otro.sketch)
+        return self
+
+    def a_dict(self):
+        return {'n': self.n, 'media': self.media, 'm2': self.m2, 'escala_m2': self.escala_m2,
+                'minimo': self.minimo if self.n else None,
+                'maximo': self.maximo if self.n else None,
+                'fallidos': self.fallidos,
+                'histograma': self.histograma.a_dict(),
+                'sketch': self.sketch.a_dict()}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        acumulador = cls()
+        acumulador.n = datos['n']
+        acumulador.media = datos['media']
+        acumulador.m2 = datos['m2']
+        acumulador.escala_m2 = datos.get('escala_m2', 0)
+        if datos['n']:
+            acumulador.minimo = datos['minimo']
+            acumulador.maximo = datos['maximo']
+        acumulador.fallidos = datos['fallidos']
+        acumulador.histograma = HistogramaAdaptativo.desde_dict(datos['histograma'])
+        acumulador.sketch = SketchCuantiles.desde_dict(datos['sketch'])
+        return acumulador
+
+
+class AcumuladorBarrido:
+    """
+    Un Acumulador por punto de la grilla de un barrido de parametros. Cada
+    escenario se evalua en todos los puntos, asi que 'cantidad' cuenta
+    escenarios (no escenarios por puntos).
+    """
+
+    def __init__(self, puntos):
+        self.puntos = [Acumulador() for _ in range(puntos)]
+
+    @property
+    def cantidad(self):
+        return self.puntos[0].cantidad if self.puntos else 0
+
+    def agregar(self, valores, desde=0):
+        """Filas de 'valores' (puntos, cantidad) para los puntos desde, desde + 1, ..."""
+        for acumulador, fila in zip(self.puntos[desde:], np.atleast_2d(valores)):
+            acumulador.agregar(fila)
+
+    def fusionar(self, otro):
+        for acumulador, del_otro in zip(self.puntos, otro.puntos):
+            acumulador.fusionar(del_otro)
+        return self
+
+    def combinado(self):
+        """Todos los puntos en un solo Acumulador (la mezcla de sus distribuciones)"""
+        total = Acumulador()
+        for acumulador in self.puntos:
+            total.fusionar(acumulador)
+        return total
+
+    def a_dict(self):
+        return {'puntos': [acumulador.a_dict() for acumulador in self.puntos]}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        barrido = cls(0)
+        barrido.puntos = [Acumulador.desde_dict(punto) for punto in datos['puntos']]
+        return barrido
+
+
+def crear_agregado(puntos=None):
+    """Acumulador, o AcumuladorBarrido si la simulacion barre 'puntos' puntos"""
+    return Acumulador() if puntos is None else AcumuladorBarrido(puntos)
+
+
+def agregado_desde_dict(datos):
+    """Inversa de a_dict para cualquiera de los dos"""
+    return AcumuladorBarrido.desde_dict(datos) if 'puntos' in datos else Acumulador.desde_dict(datos)
+
+
+def fusionar(parciales):
+    """Combina agregados parciales (Acumulador o dict) de varios workers"""
+    total = Acumulador()
+    for parcial in parciales:
+        if isinstance(parcial, dict):
+            parcial = Acumulador.desde_dict(parcial)
+        total.fusionar(parcial)
+    return total
@@ -0,0 +1,109 @@
+import ast
+import math
+import operator
+import numpy as np
+
+# Funciones y constantes disponibles en la expresion del modelo (versiones numpy)
+FUNCIONES = {"sin": np.sin, "cos": np.cos, "tan": np.tan,
+             "sqrt": np.sqrt, "exp": np.exp, "log": np.log}
+CONSTANTES = {"pi": np.pi, "e": np.e}
+
+# Nodos del AST permitidos: solo aritmetica, nombres y llamadas a FUNCIONES
+NODOS_PERMITIDOS = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv,
+    ast.USub, ast.UAdd,
+)
+
+# Operaciones entre constantes que se calculan al validar (para acotar potencias)
+OPERADORES = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+              ast.Div: operator.truediv, ast.Pow: operator.pow, ast.Mod: operator.mod,
+              ast.FloorDiv: operator.floordiv}
+
+# Bits maximos del resultado de una potencia entera entre constantes: mas alla
+# no entra en un float64 y Python la calcularia con enteros enormes (2**2**2**2**2)
+MAX_BITS_POTENCIA = 1024
+
+
+class ModeloCompilado:
+    """Expresion del modelo validada y compilada una sola vez"""
+
+    def __init__(self, expresion, nombres_variables):
+        self.expresion = expresion
+        self.nombres_variables = list(nombres_variables)
+        arbol = ast.parse(expresion, mode='eval')
+        self._validar(arbol)
+        self.codigo = compile(arbol, '<modelo>', 'eval')
+        self.entorno = {"__builtins__": {}, **FUNCIONES, **CONSTANTES}
+
+    def _validar(self, arbol):
+        permitidos = set(self.nombres_variables) | set(CONSTANTES)
+        # Los nombres de FUNCIONES solo valen como la funcion de una llamada
+        llamadas = {id(nodo.func) for nodo in ast.walk(arbol) if isinstance(nodo, ast.Call)}
+        for nodo in ast.walk(arbol):
+            if not isinstance(nodo, NODOS_PERMITIDOS):
+                raise ValueError(f"Elemento no permitido en el modelo: {type(nodo).__name__}")
+            if isinstance(nodo, ast.Call):
+                if not isinstance(nodo.func, ast.Name) or nodo.func.id not in FUNCIONES:
+                    raise ValueError("Solo se permiten llamadas a: " + ", ".join(FUNCIONES))
+                if len(nodo.args) != 1 or nodo.keywords:
+                    raise ValueError(f"'{nodo.func.id}' recibe un solo argumento")
+            elif isinstance(nodo, ast.Name) and nodo.id in FUNCIONES:
+                if id(nodo) not in llamadas:
+                    raise ValueError(f"'{nodo.id}' es una funcion: se usa como {nodo.id}(...)")
+            elif isinstance(nodo, ast.Name) and nodo.id not in permitidos:
+                raise ValueError(f"Variable desconocida en el modelo: {nodo.id}")
+            elif isinstance(nodo, ast.Constant) and not isinstance(nodo.value, (int, float)):
+                raise ValueError(f"Constante no numerica en el modelo: {nodo.value!r}")
+        self._constante(arbol.body)
+
+    def _constante(self, nodo):
+        """
+        Valor de una subexpresion hecha solo de constantes (None si depende de
+        variables). Recorre todo el arbol y rechaza las potencias enteras
+        demasiado grandes antes de calcularlas.
+        """
+        if isinstance(nodo, ast.Constant):
+            return nodo.value
+        if isinstance(nodo, ast.UnaryOp):
+            operando = self._constante(nodo.operand)
+            if operando is None:
+                return None
+            return -operando if isinstance(nodo.op, ast.USub) else operando
+        if isinstance(nodo, ast.Call):
+            for argumento in nodo.args:
+                self._constante(argumento)
+            return None
+        if not isinstance(nodo, ast.BinOp):
+            return None
+        izquierda, derecha = self._constante(nodo.left), self._constante(nodo.right)
+        if izquierda is None or derecha is None:
+            return None
+        if isinstance(nodo.op, ast.Pow) and isinstance(izquierda, int) and isinstance(derecha, int) \
+                and abs(izquierda) > 1 and derecha * math.log2(abs(izquierda)) > MAX_BITS_POTENCIA:
+            raise ValueError(f"Potencia demasiado grande en el modelo: {ast.unparse(nodo)}")
+        try:
+            return OPERADORES[type(nodo.op)](izquierda, derecha)
+        except ArithmeticError as error:
+            raise ValueError(f"Operacion invalida en el modelo: {ast.unparse(nodo)} ({error})")
+
+    def evaluar(self, columnas, cantidad, puntos=None):
+        """
+        Evalua el modelo sobre arreglos completos {variable: array}.
+        Devuelve (resultados, fallidos): los escenarios cuyo resultado no es
+        finito (log de un negativo, division por cero...) quedan como NaN.
+        En un barrido las columnas barridas son (puntos, cantidad) y el
+        resultado tambien, por broadcasting con las demas.
+        """
+        variables = {nombre: np.asarray(columnas[nombre], dtype=np.float64)
+                     for nombre in self.nombres_variables}
+        with np.errstate(all='ignore'):
+            resultado = eval(self.codigo, self.entorno, variables)
+        forma = (cantidad,) if puntos is None else (puntos, cantidad)
+        resultado = np.array(np.broadcast_to(np.asarray(resultado, dtype=np.float64), forma))
+
+        invalidos = ~np.isfinite(resultado)
+        fallidos = int(np.count_nonzero(invalidos))
+        if fallidos:
+            resultado[invalidos] = np.nan
+        return resultado, fallidos
@@ -0,0 +1,82 @@
+import time
+import numpy as np
+
+# Metricas de ejecucion por etapa. Cada componente cuenta y mide tiempos en
+# memoria y cada INTERVALO_METRICAS publica un resumen en la cola 'metricas'
+# (ver colas.COLA_METRICAS); el visualizador las grafica.
+
+INTERVALO_METRICAS = 2.0
+
+# Muestras de tiempo guardadas por etapa y por intervalo (el resto solo se cuenta)
+MAX_MUESTRAS = 10000
+
+
+class Metricas:
+    """Contadores y tiempos por etapa del intervalo en curso; no es thread-safe"""
+
+    def __init__(self, componente, origen):
+        self.componente = componente  # productor, worker, ...
+        self.origen = origen          # id del proceso que publica
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.desde = time.time()
+        self.contadores = {}
+        self.valores = {}   # medidas instantaneas (profundidad de la cola, ...)
+        self.tiempos = {}   # etapa -> [segundos]
+        self.totales = {}   # etapa -> (cantidad, segundos), incluidas las no guardadas
+
+    def contar(self, nombre, cantidad=1):
+        self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def valor(self, nombre, valor):
+        self.valores[nombre] = valor
+
+    def registrar(self, etapa, segundos):
+        cantidad, total = self.totales.get(etapa, (0, 0.0))
+        self.totales[etapa] = (cantidad + 1, total + segundos)
+        muestras = self.tiempos.setdefault(etapa, [])
+        if len(muestras) < MAX_MUESTRAS:
+            muestras.append(segundos)
+
+    def medir(self, etapa):
+        return _Medicion(self, etapa)
+
+    def vencidas(self):
+        return time.time() - self.desde >= INTERVALO_METRICAS
+
+    def a_mensaje(self):
+        """Resumen del intervalo (tiempos en ms) y comienza uno nuevo"""
+        ahora = time.time()
+        latencias = {}
+        for etapa, muestras in self.tiempos.items():
+            cantidad, total = self.totales[etapa]
+            p50, p99 = np.percentile(muestras, [50, 99]) * 1e3
+            latencias[etapa] = {'n': cantidad, 'total_ms': total * 1e3,
+                                'p50_ms': float(p50), 'p99_ms': float(p99),
+                                'max_ms': max(muestras) * 1e3}
+        mensaje = {
+            'tipo': 'metricas',
+            'componente': self.componente,
+            'origen': self.origen,
+            'intervalo': ahora - self.desde,
+            'contadores': self.contadores,
+            'valores': self.valores,
+            'latencias': latencias,
+            'timestamp': ahora
+        }
+        self.reiniciar()
+        return mensaje
+
+
+class _Medicion:
+    def __init__(self, metricas, etapa):
+        self.metricas = metricas
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *error):
+        self.metricas.registrar(self.etapa, time.perf_counter() - self.inicio)
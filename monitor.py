@@ -1,108 +1,599 @@
-import pika
+import os
 import json
+import struct
 import numpy as np
 import matplotlib.pyplot as plt
 import threading
-import sys
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
 from threading import Lock
+from collections import deque
 import time
+from estadisticas import Acumulador, AcumuladorBarrido, Densidad2D, MuestraReservorio, agregado_desde_dict
+from almacen import DIRECTORIO_ALMACEN, AlmacenResultados, LectorResultados
+from protocolo import decodificar
+from colas import COLA_METRICAS, LectorRabbitMQ
 
+# Con un almacen, cada cuanto se publican en disco los resultados recibidos
+INTERVALO_SINCRONIZAR = 2.0
 
-class Visualizador:
-    def __init__(self, host_rabbitmq="localhost"):
+# La ingesta (recibir, agregar y guardar) corre en su propio proceso, sin
+# graficos, y cada INTERVALO_INSTANTANEA deja una instantanea compacta del
+# estado en memoria compartida. Quien dibuja (ventana o PNGs) la lee a su
+# ritmo: un redibujo lento ya no frena el consumo de 'resultados'.
+NOMBRE_INSTANTANEA = 'monitor_simulacion'
+TAM_INSTANTANEA = 1 << 20
+INTERVALO_INSTANTANEA = 0.5
+INTERVALO_VENTANA = 0.5
+INTERVALO_PNG = 10.0
+
+# Dispersion entrada/resultado (con 'resultados = entradas'): rejilla de densidad
+# de los pares y una muestra de puntos, de los que se dibujan sueltos (atipicos)
+# los de celdas con a lo sumo UMBRAL_ATIPICOS conteos. El costo no crece con
+# los resultados recibidos
+UMBRAL_ATIPICOS = 2
+
+# Cabecera del bloque: secuencia (impar mientras se escribe), largo del JSON y
+# PID de la ingesta que lo creo (para no pisar el de una ingesta viva)
+_CABECERA = struct.Struct('<QIi')
+
+
+def _abrir_sin_registrar(nombre):
+    """
+    Abre un bloque existente sin anotarlo en el resource_tracker: solo lo
+    registra (y lo borra) el proceso que lo crea. Antes de Python 3.13 abrirlo
+    tambien lo registra, y con fork el tracker es el mismo que el del creador.
+    """
+    try:
+        return shared_memory.SharedMemory(name=nombre, track=False)
+    except TypeError:
+        registrar = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=nombre)
+        finally:
+            resource_tracker.register = registrar
+
+
+def ingesta_activa(nombre):
+    """PID de la ingesta que publica en 'nombre', o None si no hay o ya termino"""
+    try:
+        memoria = _abrir_sin_registrar(nombre)
+    except FileNotFoundError:
+        return None
+    try:
+        pid = _CABECERA.unpack_from(memoria.buf, 0)[2]
+    finally:
+        memoria.close()
+    if pid <= 0:
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+class InstantaneaCompartida:
+    """
+    Ultima instantanea del monitor en un bloque de memoria compartida, con
+    un seqlock: el unico escritor deja la secuencia impar mientras escribe y
+    el lector reintenta si la ve impar o si cambio mientras copiaba. Ninguno
+    de los dos espera al otro.
+    """
+
+    def __init__(self, nombre=NOMBRE_INSTANTANEA, crear=False, tamano=TAM_INSTANTANEA, reemplazar=False):
+        self.creador = crear
+        self.pid = os.getpid()
+        if crear:
+            activa = ingesta_activa(nombre)
+            if activa is not None and not reemplazar:
+                raise FileExistsError(f"La ingesta {activa} ya publica en '{nombre}': usar otro --nombre")
+            try:
+                self.memoria = shared_memory.SharedMemory(name=nombre, create=True, size=tamano)
+            except FileExistsError:
+                # Quedo de una ingesta que no termino bien, o se reemplaza a pedido
+                vieja = shared_memory.SharedMemory(name=nombre)
+                vieja.close()
+                vieja.unlink()
+                self.memoria = shared_memory.SharedMemory(name=nombre, create=True, size=tamano)
+            _CABECERA.pack_into(self.memoria.buf, 0, 0, 0, self.pid)
+        else:
+            self.memoria = _abrir_sin_registrar(nombre)
+        self.secuencia = 0
+
+    def escribir(self, estado):
+        datos = json.dumps(estado).encode('utf-8')
+        if _CABECERA.size + len(datos) > self.memoria.size:
+            raise ValueError(f"Instantanea de {len(datos)} bytes no cabe en {self.memoria.size}")
+        buf = self.memoria.buf
+        self.secuencia += 1
+        _CABECERA.pack_into(buf, 0, self.secuencia, 0, self.pid)
+        buf[_CABECERA.size:_CABECERA.size + len(datos)] = datos
+        self.secuencia += 1
+        _CABECERA.pack_into(buf, 0, self.secuencia, len(datos), self.pid)
+
+    def leer(self, desde=0):
+        """La instantanea actual si es posterior a la secuencia 'desde', si no None"""
+        buf = self.memoria.buf
+        while True:
+            secuencia, largo, _ = _CABECERA.unpack_from(buf, 0)
+            if secuencia % 2:
+                time.sleep(0.001)
+                continue
+            if secuencia <= desde:
+                return None
+            datos = bytes(buf[_CABECERA.size:_CABECERA.size + largo])
+            if _CABECERA.unpack_from(buf, 0)[0] == secuencia:
+                estado = json.loads(datos)
+                estado['secuencia'] = secuencia
+                return estado
+
+    def cerrar(self):
+        self.memoria.close()
+        if self.creador:
+            self.memoria.unlink()
+
+
+def _recortar(estado):
+    """La misma instantanea con la mitad de los puntos de cada historia"""
+    estado = dict(estado)
+    estado['historia_media'] = estado['historia_media'][1::2]
+    estado['historia_cola'] = estado['historia_cola'][1::2]
+    estado['historia_workers'] = {w_id: h[1::2] for w_id, h in estado['historia_workers'].items()}
+    return estado
+
+
+class Ingesta:
+    """
+    Recibe resultados, parciales y metricas, los agrega y (con 'almacen') los
+    guarda. No dibuja: publica instantaneas para los Visualizador.
+    """
+
+    def __init__(self, host_rabbitmq="localhost", fuente=None, modelo_id=None, almacen=None, eje_x=None):
         self.host_rabbitmq = host_rabbitmq
-        self.resultados = []
+        self.fuente = fuente          # consumir(cola, timeout); por defecto, la cola 'resultados' de RabbitMQ
+        self.modelo_id = modelo_id    # Con varias simulaciones a la vez, mostrar solo esta (o prefijo)
+        self.resultados = Acumulador()  # Valores individuales: histograma y momentos, O(1) en memoria
+        self.agregado = Acumulador()  # Fusion de los parciales de todos los workers
         self.stats_workers = {}
+        self.nodo_de_worker = {}  # worker_id -> nodo (para workers lanzados por un Supervisor)
+        self.rendimiento_nodos = {}  # nodo -> escenarios/s del ultimo reporte
         self.lock = Lock()
         self.running = True
+        self.historia_media = deque(maxlen=600)
+        self.inicio = time.time()
 
-        plt.ion()
-        self.fig = plt.figure(figsize=(14, 8))
-        self.fig.canvas.manager.set_window_title('Monitor Distribuido')
-        gs = self.fig.add_gridspec(2, 2)
+        # Directorio donde guardar cada valor recibido (ver almacen.py), por modelo_id
+        self.directorio_almacen = almacen
+        self.almacenes = {}
+        self.ultima_sincronizacion = time.time()
 
-        self.ax_hist = self.fig.add_subplot(gs[0, 0])
-        self.ax_workers = self.fig.add_subplot(gs[0, 1])
-        self.ax_media = self.fig.add_subplot(gs[1, :])
-        plt.tight_layout(pad=4)
+        # Metricas de los componentes: por worker (t, escenarios/s, evaluacion p50 ms) y cola
+        self.historia_workers = {}
+        self.historia_cola = deque(maxlen=600)
+
+        # Dispersion de (entrada eje_x, resultado); por defecto la primera entrada que llegue
+        self.eje_x = eje_x
+        self.densidad = Densidad2D()
+        self.muestra = MuestraReservorio()
+
+    def procesar_mensaje(self, msg):
+        if self.modelo_id and not msg.get('modelo_id', self.modelo_id).startswith(self.modelo_id):
+            return
+        if msg.get('tipo') in ('resultado', 'resultados_lote'):
+            if msg['tipo'] == 'resultado':
+                vals = [float(msg['resultado'])]
+            else:
+                vals = np.asarray(msg['resultados'], dtype=float)
+            with self.lock:
+                self.resultados.agregar(vals)
+                if msg.get('entradas'):
+                    self.agregar_pares(msg['entradas'], vals)
+                if self.directorio_almacen and msg['tipo'] == 'resultados_lote':
+                    self.guardar(msg)
+
+        elif msg.get('tipo') == 'parcial':
+            parcial = agregado_desde_dict(msg['agregado'])
+            if isinstance(parcial, AcumuladorBarrido):
+                # Un barrido se muestra como la mezcla de todos sus puntos
+                parcial = parcial.combinado()
+            # Leer ID del worker para separar estadísticas
+            w_id = msg.get('worker_id', 'Anonimo')
+
+            with self.lock:
+                self.agregado.fusionar(parcial)
+                self.stats_workers[w_id] = self.stats_workers.get(w_id, 0) + parcial.cantidad
+
+        elif msg.get('tipo') == 'rendimiento':
+            with self.lock:
+                for w_id in msg['procesos']:
+                    self.nodo_de_worker[w_id] = msg['nodo']
+                self.rendimiento_nodos[msg['nodo']] = msg['por_segundo']
+
+        elif msg.get('tipo') == 'metricas':
+            t = msg['timestamp'] - self.inicio
+            with self.lock:
+                if msg['componente'] == 'worker':
+                    por_segundo = msg['contadores'].get('escenarios', 0) / max(msg['intervalo'], 1e-9)
+                    evaluacion = msg['latencias'].get('evaluar', {}).get('p50_ms', float('nan'))
+                    historia = self.historia_workers.setdefault(msg['origen'], deque(maxlen=300))
+                    historia.append((t, por_segundo, evaluacion))
+                elif 'profundidad_cola' in msg['valores']:
+                    self.historia_cola.append((t, msg['valores']['profundidad_cola']))
+
+    def agregar_pares(self, entradas, valores):
+        """Pares (entrada, resultado) de un lote para la dispersion (con self.lock tomado)"""
+        if self.eje_x is None:
+            self.eje_x = next(iter(entradas))
+        if self.eje_x not in entradas:
+            return
+        x = np.asarray(entradas[self.eje_x], dtype=float)
+        validos = np.isfinite(x) & np.isfinite(valores)
+        if validos.any():
+            self.densidad.agregar(x[validos], valores[validos])
+            self.muestra.agregar(x[validos], valores[validos])
+
+    def dispersion(self):
+        """Celdas ocupadas de la rejilla y puntos atipicos de la muestra (con self.lock tomado)"""
+        if not self.densidad.total:
+            return None
+        ocupadas = np.flatnonzero(self.densidad.conteos)
+        puntos = self.muestra.muestra()
+        atipicos = puntos[self.densidad.conteo_en(puntos[:, 0], puntos[:, 1]) <= UMBRAL_ATIPICOS]
+        return {'variable': self.eje_x, 'total': self.densidad.total,
+                'num_bins': self.densidad.num_bins, 'extension': list(self.densidad.extension()),
+                'celdas': ocupadas.tolist(), 'conteos': self.densidad.conteos.flat[ocupadas].tolist(),
+                'atipicos': atipicos.tolist()}
+
+    def guardar(self, msg):
+        """Agrega el lote al almacen de su simulacion (con self.lock tomado)"""
+        modelo_id = msg.get('modelo_id', 'sin_modelo')
+        if modelo_id not in self.almacenes:
+            self.almacenes[modelo_id] = AlmacenResultados(modelo_id, self.directorio_almacen)
+        self.almacenes[modelo_id].agregar_mensaje(msg)
+        if time.time() - self.ultima_sincronizacion >= INTERVALO_SINCRONIZAR:
+            for almacen in self.almacenes.values():
+                almacen.sincronizar()
+            self.ultima_sincronizacion = time.time()
+
+    def cargar_almacen(self, lector):
+        """Carga una simulacion guardada para volver a graficarla, de a un trozo por vez"""
+        with self.lock:
+            entradas = lector.entradas()
+            if entradas and self.eje_x not in entradas:
+                self.eje_x = entradas[0]
+            for trozo in lector.trozos(('valor', self.eje_x) if entradas else ('valor',)):
+                self.resultados.agregar(trozo['valor'])
+                if entradas:
+                    self.agregar_pares({self.eje_x: trozo[self.eje_x]}, trozo['valor'])
+            for w_id, cantidad in lector.por_worker().items():
+                self.stats_workers[w_id] = self.stats_workers.get(w_id, 0) + cantidad
 
-    def conectar_rabbitmq(self):
+    def conectar_rabbitmq(self, cola='resultados'):
         while self.running:
             try:
-                connection = pika.BlockingConnection(
-                    pika.ConnectionParameters(host=self.host_rabbitmq, connection_attempts=5, retry_delay=2)
-                )
-                channel = connection.channel()
-                channel.queue_declare(queue='resultados', durable=True)
-                print("Monitor conectado...")
-
-                def callback(ch, method, properties, body):
+                fuente = self.fuente or LectorRabbitMQ(self.host_rabbitmq, colas=(cola,))
+                print(f"Monitor conectado ({cola})...")
+
+                for mensaje in fuente.consumir(cola, timeout=1.0):
                     if not self.running:
-                        channel.stop_consuming()
-                        return
+                        break
+                    if mensaje is None:
+                        continue
                     try:
-                        msg = json.loads(body.decode('utf-8'))
-                        if msg.get('tipo') == 'resultado':
-                            val = float(msg['resultado'])
-                            # Leer ID del worker para separar estadísticas
-                            w_id = msg.get('worker_id', 'Anonimo')
-
-                            with self.lock:
-                                self.resultados.append(val)
-                                self.stats_workers[w_id] = self.stats_workers.get(w_id, 0) + 1
-
-                        ch.basic_ack(delivery_tag=method.delivery_tag)
+                        cuerpo, content_type = mensaje
+                        self.procesar_mensaje(decodificar(cuerpo))
                     except:
                         pass
-
-                channel.basic_consume(queue='resultados', on_message_callback=callback)
-                channel.start_consuming()
+                fuente.cerrar()
             except:
                 time.sleep(2)
 
-    def actualizar_grafica(self):
+    def instantanea(self):
+        """Estado compacto para dibujar: histograma, totales e historias"""
         with self.lock:
-            if not self.resultados: return
-            data = np.array(self.resultados)
-            workers = self.stats_workers.copy()
+            # Valores individuales si llegan, si no la fusion de los parciales
+            fuente = self.resultados if self.resultados.cantidad else self.agregado
+            return {
+                'cantidad': fuente.cantidad, 'n': fuente.n,
+                'media': fuente.media, 'desviacion': fuente.desviacion,
+                'conteos': fuente.histograma.conteos.tolist(),
+                'bordes': fuente.histograma.bordes().tolist(),
+                'historia_media': list(self.historia_media),
+                'workers': dict(self.stats_workers),
+                'nodo_de_worker': dict(self.nodo_de_worker),
+                'rendimiento_nodos': dict(self.rendimiento_nodos),
+                'historia_workers': {w_id: list(h) for w_id, h in self.historia_workers.items()},
+                'historia_cola': list(self.historia_cola),
+                'dispersion': self.dispersion(),
+            }
+
+    def publicar(self, compartida):
+        with self.lock:
+            fuente = self.resultados if self.resultados.cantidad else self.agregado
+            if fuente.cantidad:
+                self.historia_media.append((time.time() - self.inicio, fuente.media, fuente.desviacion))
+        estado = self.instantanea()
+        while True:
+            try:
+                compartida.escribir(estado)
+                return
+            except ValueError:
+                if not estado['historia_media'] and not estado['historia_cola'] \
+                        and not any(estado['historia_workers'].values()):
+                    raise
+                estado = _recortar(estado)
+
+    def iniciar(self, nombre=NOMBRE_INSTANTANEA, parar=None, reemplazar=False):
+        """
+        Consume y publica instantaneas hasta Ctrl+C (o hasta que se active
+        'parar'). Si otra ingesta viva ya publica en 'nombre' falla, salvo con
+        'reemplazar'
+        """
+        compartida = InstantaneaCompartida(nombre, crear=True, reemplazar=reemplazar)
+        threading.Thread(target=self.conectar_rabbitmq, daemon=True).start()
+        if self.fuente is None:
+            # Las metricas van por su propia conexion (pika no es thread-safe)
+            threading.Thread(target=self.conectar_rabbitmq, args=(COLA_METRICAS,), daemon=True).start()
+        print(f"Ingesta iniciada (instantaneas en '{nombre}').")
+        try:
+            while self.running and not (parar is not None and parar.is_set()):
+                self.publicar(compartida)
+                time.sleep(INTERVALO_INSTANTANEA)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+            with self.lock:
+                for almacen in self.almacenes.values():
+                    almacen.cerrar()
+            compartida.cerrar()
+
+
+class Visualizador:
+    """
+    Dibuja las instantaneas que publica una Ingesta, a su propio ritmo: en
+    una ventana o, con 'salida', en un PNG cada tanto (corridas desatendidas).
+    """
+
+    def __init__(self, salida=None):
+        self.salida = salida
+        if salida:
+            plt.switch_backend('Agg')
+            os.makedirs(salida, exist_ok=True)
+        else:
+            plt.ion()
+
+        # Estado de lo dibujado, para redibujar solo lo que cambia
+        self.barras_hist = None
+        self.bordes_hist = None
+        self.conteos_hist = None
+
+        self.fig = plt.figure(figsize=(14, 8))
+        self.fig.canvas.manager.set_window_title('Monitor Distribuido')
+        gs = self.fig.add_gridspec(2, 3)
+
+        self.ax_hist = self.fig.add_subplot(gs[0, 0])
+        self.ax_workers = self.fig.add_subplot(gs[0, 1])
+        self.ax_ritmo = self.fig.add_subplot(gs[0, 2])
+        self.ax_media = self.fig.add_subplot(gs[1, 0])
+        self.ax_dispersion = self.fig.add_subplot(gs[1, 1])
+        self.ax_latencia = self.fig.add_subplot(gs[1, 2])
+        self.ax_cola = self.ax_latencia.twinx()
+        # Densidad (log) como imagen y los atipicos encima; se crean una vez y solo se actualizan
+        self.imagen_dispersion = self.ax_dispersion.imshow(
+            np.zeros((1, 1)), origin='lower', aspect='auto', cmap='Blues', interpolation='nearest')
+        self.atipicos = self.ax_dispersion.scatter([], [], c='#c0392b', s=6, alpha=0.7)
+        self.ax_dispersion.set_title('Entrada vs resultado (resultados = entradas)')
+        plt.tight_layout(pad=4)
+
+    def dibujar_histograma(self, conteos, bordes):
+        """Crea las barras solo si cambian los bordes; si no, actualiza las alturas que cambiaron"""
+        if self.barras_hist is None or not np.array_equal(bordes, self.bordes_hist):
+            self.ax_hist.clear()
+            self.barras_hist = self.ax_hist.bar(bordes[:-1], conteos, width=np.diff(bordes),
+                                                align='edge', color='#2c3e50', alpha=0.8)
+            self.ax_hist.grid(alpha=0.3)
+            self.bordes_hist = bordes
+        else:
+            for k in np.nonzero(conteos != self.conteos_hist)[0]:
+                self.barras_hist[k].set_height(conteos[k])
+        self.conteos_hist = conteos
+        self.ax_hist.set_ylim(0, max(1, conteos.max()) * 1.05)
+
+    def actualizar_grafica(self, estado):
+        if estado['cantidad'] == 0: return
+        conteos = np.array(estado['conteos'], dtype=np.int64)
+        bordes = np.array(estado['bordes'])
+        n, media, desviacion = estado['n'], estado['media'], estado['desviacion']
+        workers = estado['workers']
+        nodo_de_worker = estado['nodo_de_worker']
+        rendimiento_nodos = estado['rendimiento_nodos']
 
         # Histograma Global
-        self.ax_hist.clear()
-        self.ax_hist.hist(data, bins=40, color='#2c3e50', alpha=0.8)
-        self.ax_hist.set_title(f'Distribución Global (N={len(data)})')
-        self.ax_hist.grid(alpha=0.3)
+        if len(bordes):
+            self.dibujar_histograma(conteos, bordes)
+        self.ax_hist.set_title(f'Distribución Global (N={n})')
 
-        # Barras Consumidores
+        # Media acumulada +- desviacion estandar
+        self.ax_media.clear()
+        if estado['historia_media']:
+            t, medias, desviaciones = (np.array(col) for col in zip(*estado['historia_media']))
+            self.ax_media.plot(t, medias, color='#c0392b')
+            self.ax_media.fill_between(t, medias - desviaciones, medias + desviaciones,
+                                       color='#c0392b', alpha=0.15)
+        self.ax_media.set_title(f'Media acumulada: {media:.6f}  (desv. {desviacion:.6f})')
+        self.ax_media.set_xlabel('segundos')
+        self.ax_media.grid(alpha=0.3)
+
+        # Barras por nodo, apiladas por proceso (núcleo)
         self.ax_workers.clear()
         if workers:
-            names = list(workers.keys())
-            vals = list(workers.values())
+            nodos = {}
+            for w_id, cantidad in sorted(workers.items()):
+                nodos.setdefault(nodo_de_worker.get(w_id, w_id), []).append(cantidad)
+            names = list(nodos.keys())
             # Generar mapa de colores
-            colors = plt.cm.viridis(np.linspace(0, 0.9, len(names)))
+            max_procesos = max(len(cantidades) for cantidades in nodos.values())
+            colors = plt.cm.viridis(np.linspace(0, 0.9, max_procesos))
 
-            bars = self.ax_workers.bar(names, vals, color=colors)
+            base = np.zeros(len(names))
+            for k in range(max_procesos):
+                vals = [cantidades[k] if k < len(cantidades) else 0 for cantidades in nodos.values()]
+                self.ax_workers.bar(names, vals, bottom=base, color=colors[k], edgecolor='white')
+                base += vals
             self.ax_workers.tick_params(axis='x', rotation=45)
-            self.ax_workers.set_title('Rendimiento por Nodo')
+            total_procesos = sum(len(cantidades) for cantidades in nodos.values())
+            self.ax_workers.set_title(f'Rendimiento por Nodo ({len(names)} nodos, {total_procesos} procesos)')
+
+            # Texto encima de barras: total del nodo y escenarios/s (total y por núcleo)
+            for x, (nodo, cantidades) in enumerate(nodos.items()):
+                texto = f'{int(base[x])}'
+                if nodo in rendimiento_nodos:
+                    por_segundo = rendimiento_nodos[nodo]
+                    texto += f'\n{por_segundo:.0f}/s ({por_segundo / len(cantidades):.0f}/s por núcleo)'
+                self.ax_workers.text(x, base[x], texto, ha='center', va='bottom')
+            self.ax_workers.set_ylim(0, max(base.max(), 1) * 1.3)
 
-            # Texto encima de barras
-            for rect in bars:
-                height = rect.get_height()
-                self.ax_workers.text(rect.get_x() + rect.get_width() / 2.0, height, f'{int(height)}', ha='center',
-                                     va='bottom')
+        self.dibujar_dispersion(estado.get('dispersion'))
+        self.dibujar_metricas(estado['historia_workers'], estado['historia_cola'])
 
+    def dibujar_dispersion(self, dispersion):
+        """Actualiza la imagen de la rejilla de densidad y los puntos atipicos"""
+        if dispersion is None:
+            return
+        num_bins = dispersion['num_bins']
+        conteos = np.zeros(num_bins * num_bins)
+        conteos[dispersion['celdas']] = dispersion['conteos']
+        conteos = np.log1p(conteos.reshape(num_bins, num_bins).T)  # filas = eje y
+        x0, x1, y0, y1 = dispersion['extension']
+        self.imagen_dispersion.set_data(conteos)
+        self.imagen_dispersion.set_extent((x0, x1, y0, y1))
+        self.imagen_dispersion.set_clim(0, max(conteos.max(), 1e-9))
+        self.ax_dispersion.set_xlim(x0, x1)
+        self.ax_dispersion.set_ylim(y0, y1)
+        self.atipicos.set_offsets(np.array(dispersion['atipicos']).reshape(-1, 2))
+        self.ax_dispersion.set_title(f"{dispersion['variable']} vs resultado (N={dispersion['total']})")
 
-    def iniciar(self):
-        t = threading.Thread(target=self.conectar_rabbitmq, daemon=True)
-        t.start()
+    def dibujar_metricas(self, historia_workers, historia_cola):
+        """Ritmo por worker, latencia de evaluacion y profundidad de 'escenarios' en el tiempo"""
+        self.ax_ritmo.clear()
+        self.ax_latencia.clear()
+        self.ax_cola.clear()
+        for w_id, historia in sorted(historia_workers.items()):
+            t, por_segundo, evaluacion = zip(*historia)
+            self.ax_ritmo.plot(t, por_segundo, label=w_id)
+            self.ax_latencia.plot(t, evaluacion, label=w_id)
+        if historia_cola:
+            t, profundidad = zip(*historia_cola)
+            self.ax_cola.plot(t, profundidad, color='#7f8c8d', linestyle='--')
+        self.ax_ritmo.set_title('Escenarios/s por worker')
+        self.ax_ritmo.grid(alpha=0.3)
+        if 0 < len(historia_workers) <= 8:
+            self.ax_ritmo.legend(fontsize='x-small')
+        self.ax_latencia.set_title("Evaluación p50 (ms) y cola 'escenarios' (--)")
+        self.ax_latencia.set_xlabel('segundos')
+        self.ax_latencia.grid(alpha=0.3)
+        self.ax_cola.yaxis.tick_right()  # clear() la devuelve a la izquierda
+
+    def guardar_png(self):
+        ruta = os.path.join(self.salida, time.strftime('monitor_%Y%m%d_%H%M%S.png'))
+        self.fig.savefig(ruta)
+        return ruta
+
+    def iniciar(self, nombre=NOMBRE_INSTANTANEA, intervalo=None):
+        """Dibuja cada instantanea nueva; espera a que la ingesta cree la memoria compartida"""
+        intervalo = intervalo or (INTERVALO_PNG if self.salida else INTERVALO_VENTANA)
+        compartida = None
+        while compartida is None:
+            # Un bloque que quedo de una ingesta que murio se va a reemplazar: no leerlo
+            if ingesta_activa(nombre) is None:
+                time.sleep(0.5)
+                continue
+            try:
+                compartida = InstantaneaCompartida(nombre)
+            except FileNotFoundError:
+                time.sleep(0.5)
         print("Monitor iniciado.")
+        secuencia = 0
         try:
-            while self.running:
-                self.actualizar_grafica()
-                plt.pause(0.5)
+            while True:
+                estado = compartida.leer(secuencia)
+                if estado is not None:
+                    secuencia = estado['secuencia']
+                    self.actualizar_grafica(estado)
+                    if self.salida and estado['cantidad']:
+                        print(f"Guardado {self.guardar_png()}")
+                if self.salida:
+                    time.sleep(intervalo)
+                else:
+                    plt.pause(intervalo)
         except KeyboardInterrupt:
-            self.running = False
+            pass
+        finally:
+            compartida.cerrar()
+
+
+def ingestar(host, modelo_id, almacen, eje_x, nombre, parar, reemplazar):
+    """Proceso de ingesta lanzado por el monitor"""
+    Ingesta(host, modelo_id=modelo_id, almacen=almacen, eje_x=eje_x).iniciar(nombre, parar, reemplazar)
 
 
 if __name__ == "__main__":
-    host = sys.argv[1] if len(sys.argv) > 1 else "localhost"
-    Visualizador(host).iniciar()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Monitor de simulaciones")
+    parser.add_argument('host', nargs='?', default='localhost')
+    parser.add_argument('modelo_id', nargs='?', default=None, help="Mostrar solo esta simulacion (o prefijo)")
+    parser.add_argument('--almacen', metavar='DIR', help="Guardar cada valor recibido en DIR/<modelo_id>/")
+    parser.add_argument('--abrir', metavar='MODELO_ID',
+                        help="Graficar una simulacion ya guardada en el almacen (sin RabbitMQ)")
+    parser.add_argument('--png', metavar='DIR', help="Escribir un PNG cada --cada segundos en DIR en vez de abrir una ventana")
+    parser.add_argument('--cada', type=float, default=None, help="Segundos entre cuadros")
+    parser.add_argument('--solo-ingesta', action='store_true', help="Solo recibir y publicar instantaneas, sin dibujar")
+    parser.add_argument('--conectar', action='store_true', help="Solo dibujar, leyendo de una ingesta ya iniciada")
+    parser.add_argument('--nombre', default=None,
+                        help=f"Nombre de la memoria compartida (por defecto {NOMBRE_INSTANTANEA}); "
+                             "dado a mano, reemplaza a otra ingesta que lo este usando")
+    parser.add_argument('--eje', metavar='VARIABLE', default=None,
+                        help="Entrada del eje x de la dispersion (por defecto la primera)")
+    args = parser.parse_args()
+    # Con el nombre por defecto no se pisa a otra ingesta viva
+    reemplazar = args.nombre is not None
+    nombre = args.nombre or NOMBRE_INSTANTANEA
+    activa = ingesta_activa(nombre)
+    if activa is not None and not reemplazar and not (args.conectar or args.abrir):
+        print(f"ERROR: la ingesta {activa} ya publica en '{nombre}'. Para verla: --conectar; "
+              f"para otra ingesta: --nombre OTRO")
+        raise SystemExit(1)
+
+    if args.abrir:
+        lector = LectorResultados(args.abrir, args.almacen or DIRECTORIO_ALMACEN)
+        ingesta = Ingesta(modelo_id=args.abrir, eje_x=args.eje)
+        ingesta.cargar_almacen(lector)
+        print(f"{len(lector)} resultados de {args.abrir}; percentiles 5/50/95: "
+              + " / ".join(f"{q:.6f}" for q in lector.cuantiles((0.05, 0.5, 0.95))))
+        visualizador = Visualizador(args.png)
+        visualizador.actualizar_grafica(ingesta.instantanea())
+        if args.png:
+            print(f"Guardado {visualizador.guardar_png()}")
+        else:
+            plt.ioff()
+            plt.show()
+    elif args.solo_ingesta:
+        Ingesta(args.host, modelo_id=args.modelo_id, almacen=args.almacen, eje_x=args.eje).iniciar(nombre, reemplazar=reemplazar)
+    else:
+        proceso = None
+        parar = multiprocessing.Event()
+        if not args.conectar:
+            proceso = multiprocessing.Process(
+                target=ingestar, args=(args.host, args.modelo_id, args.almacen, args.eje, nombre, parar, reemplazar))
+            proceso.start()
+        try:
+            Visualizador(args.png).iniciar(nombre, args.cada)
+        finally:
+            if proceso is not None:
+                parar.set()
+                proceso.join()
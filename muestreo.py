@@ -0,0 +1,278 @@
+import warnings
+import numpy as np
+
+# Los numeros aleatorios se generan con Philox (basado en contador): cada
+# bloque de BLOQUE_RNG escenarios y cada variable tienen su propio flujo,
+# identificado por (semilla, bloque, variable). Asi cualquier worker puede
+# regenerar exactamente los escenarios [inicio, inicio + cantidad).
+BLOQUE_RNG = 4096
+
+# Escenarios generados por bloque: acota la memoria sin importar 'escenarios'
+TAM_BLOQUE = 4 * BLOQUE_RNG
+
+# Muestreos: independiente, o con reduccion de varianza transformando
+# uniformes con la inversa de la funcion de distribucion de cada variable.
+#   antitetico : el escenario 2k+1 usa 1 - u del escenario 2k
+#   lhs        : cada bloque de BLOQUE_RNG escenarios es un hipercubo latino
+#   sobol      : secuencia de Sobol aleatorizada (scramble), por tramos
+#   halton     : secuencia de Halton aleatorizada, por tramos
+# Todos dependen solo del indice del escenario, asi que se reparten en
+# rangos igual que el muestreo independiente.
+MUESTREO_INDEPENDIENTE = 'independiente'
+MUESTREOS = (MUESTREO_INDEPENDIENTE, 'antitetico', 'lhs', 'sobol', 'halton')
+
+# Los extremos 0 y 1 darian infinitos en la inversa de la distribucion
+_EPSILON_U = 1e-12
+
+# Flujo de Philox de las uniformes (el 0 es el del muestreo independiente)
+_FLUJO_UNIFORMES = 1
+
+# Barridos de parametros: un parametro de una variable puede ser una lista de
+# valores, y la simulacion se corre en cada punto de la grilla (producto
+# cartesiano de todas las listas, el ultimo eje varia mas rapido). Los
+# parametros barridos viajan como columnas (puntos, 1) y las muestras salen
+# (puntos, cantidad): todos los puntos usan los mismos numeros aleatorios
+# (numeros aleatorios comunes), asi las diferencias entre puntos se deben a
+# los parametros y no al azar, y cada punto da lo mismo sin importar la grilla.
+
+
+def ejes_barrido(variables):
+    """(variable, posicion del parametro, valores) de cada parametro con varios valores"""
+    return [(nombre, k, list(valor)) for nombre, (_, params) in variables.items()
+            for k, valor in enumerate(params) if isinstance(valor, (list, tuple))]
+
+
+def puntos_barrido(variables):
+    """Puntos de la grilla del barrido, o None si ningun parametro tiene varios valores"""
+    ejes = ejes_barrido(variables)
+    return int(np.prod([len(valores) for _, _, valores in ejes])) if ejes else None
+
+
+def variables_de_puntos(variables, desde=0, hasta=None):
+    """Las variables con cada parametro barrido como columna (puntos, 1) de los puntos [desde, hasta)"""
+    ejes = ejes_barrido(variables)
+    if not ejes:
+        return variables
+    hasta = puntos_barrido(variables) if hasta is None else hasta
+    indices = np.unravel_index(np.arange(desde, hasta), [len(valores) for _, _, valores in ejes])
+    resultado = {nombre: (dist, list(params)) for nombre, (dist, params) in variables.items()}
+    for (nombre, k, valores), indice in zip(ejes, indices):
+        resultado[nombre][1][k] = np.asarray(valores, dtype=np.float64)[indice][:, None]
+    return resultado
+
+
+def describir_punto(variables, punto):
+    """Texto con las variables barridas en el punto numero 'punto' de la grilla"""
+    barridas = {nombre for nombre, _, _ in ejes_barrido(variables)}
+    partes = []
+    for nombre, (dist, params) in variables_de_puntos(variables, punto, punto + 1).items():
+        if nombre in barridas:
+            valores = ", ".join(f"{float(np.ravel(p)[0]):g}" for p in params)
+            partes.append(f"{nombre} ~ {dist}({valores})")
+    return "; ".join(partes)
+
+
+def crear_generador(semilla, bloque=0, variable=0, flujo=0):
+    """Generador del bloque 'bloque' de la variable numero 'variable'"""
+    bit_generator = np.random.Philox(key=semilla % (2 ** 128),
+                                     counter=[0, flujo, bloque, variable])
+    return np.random.Generator(bit_generator)
+
+
+def _lote_barrido(rng, dist, params, cantidad):
+    """
+    Como generar_lote con parametros (puntos, 1): una sola tirada, transformada
+    en cada punto con la misma formula que usa numpy, asi cada fila es la
+    muestra que daria generar_lote con los parametros de ese punto
+    """
+    if dist == "normal":
+        mu, sigma = params
+        return mu + sigma * rng.standard_normal(cantidad)
+    elif dist == "uniform":
+        low, high = params
+        return low + (high - low) * rng.random(cantidad)
+    elif dist in ("exp", "exponential"):
+        lam = params[0]
+        return rng.standard_exponential(cantidad) / lam
+    elif dist == "lognormal":
+        mu, sigma = params
+        return np.exp(mu + sigma * rng.standard_normal(cantidad))
+    elif dist == "triangular":
+        # Generator.triangular: una uniforme por muestra, por la inversa a trozos
+        low, mode, high = params
+        u = rng.random(cantidad)
+        base = high - low
+        return np.where(u <= (mode - low) / base, low + np.sqrt(u * (mode - low) * base),
+                        high - np.sqrt((1 - u) * (high - mode) * base))
+    elif dist == "poisson":
+        # Poisson usa un numero variable de tiradas por muestra: cada punto parte del mismo estado
+        estado = rng.bit_generator.state
+        filas = []
+        for lam in np.ravel(params[0]):
+            rng.bit_generator.state = estado
+            filas.append(rng.poisson(lam, cantidad))
+        return np.array(filas, dtype=np.float64)
+    raise ValueError(f"Distribución no soportada: {dist}")
+
+
+def generar_lote(rng, dist, params, cantidad):
+    """Genera 'cantidad' muestras de una distribucion en una sola llamada"""
+    dist = dist.lower()
+    if any(isinstance(p, np.ndarray) for p in params):
+        return _lote_barrido(rng, dist, params, cantidad)
+
+    if dist == "normal":
+        mu, sigma = params
+        return rng.normal(mu, sigma, cantidad)
+    elif dist == "uniform":
+        low, high = params
+        return rng.uniform(low, high, cantidad)
+    elif dist == "poisson":
+        lam = params[0]
+        return rng.poisson(lam, cantidad).astype(np.float64)
+    elif dist in ("exp", "exponential"):
+        lam = params[0]
+        return rng.exponential(1 / lam, cantidad)
+    elif dist == "triangular":
+        low, mode, high = params
+        return rng.triangular(low, mode, high, cantidad)
+    elif dist == "lognormal":
+        mu, sigma = params
+        return rng.lognormal(mu, sigma, cantidad)
+    else:
+        raise ValueError(f"Distribución no soportada: {dist}")
+
+
+def inversa_distribucion(dist, params, u):
+    """Transforma uniformes en (0, 1) en muestras de la distribucion"""
+    # scipy solo hace falta para los muestreos con reduccion de varianza
+    from scipy import stats
+
+    dist = dist.lower()
+    u = np.clip(u, _EPSILON_U, 1 - _EPSILON_U)
+
+    if dist == "normal":
+        mu, sigma = params
+        return stats.norm.ppf(u, mu, sigma)
+    elif dist == "uniform":
+        low, high = params
+        return low + (high - low) * u
+    elif dist == "poisson":
+        lam = params[0]
+        return stats.poisson.ppf(u, lam)
+    elif dist in ("exp", "exponential"):
+        lam = params[0]
+        return stats.expon.ppf(u, scale=1 / lam)
+    elif dist == "triangular":
+        low, mode, high = params
+        return stats.triang.ppf(u, (mode - low) / (high - low), loc=low, scale=high - low)
+    elif dist == "lognormal":
+        mu, sigma = params
+        return stats.lognorm.ppf(u, sigma, scale=np.exp(mu))
+    else:
+        raise ValueError(f"Distribución no soportada: {dist}")
+
+
+def _uniformes_por_bloque(semilla, variable, primero, ultimo, generar_bloque):
+    """Concatena las uniformes de los bloques [primero, ultimo] de una variable"""
+    partes = [generar_bloque(crear_generador(semilla, bloque, variable, _FLUJO_UNIFORMES), bloque)
+              for bloque in range(primero, ultimo + 1)]
+    return partes[0] if len(partes) == 1 else np.concatenate(partes)
+
+
+def _uniformes_antiteticas(semilla, variable, inicio, cantidad):
+    # Un par por cada dos escenarios: el par k da u al escenario 2k y 1 - u al 2k+1
+    primer_par, ultimo_par = inicio // 2, (inicio + cantidad - 1) // 2
+    primer_bloque, ultimo_bloque = primer_par // BLOQUE_RNG, ultimo_par // BLOQUE_RNG
+    base = _uniformes_por_bloque(semilla, variable, primer_bloque, ultimo_bloque,
+                                 lambda rng, _: rng.random(BLOQUE_RNG))
+    indices = np.arange(inicio, inicio + cantidad)
+    u = base[indices // 2 - primer_bloque * BLOQUE_RNG]
+    return np.where(indices % 2 == 1, 1 - u, u)
+
+
+def _uniformes_lhs(semilla, variable, inicio, cantidad, total):
+    # Cada bloque es un hipercubo latino: una muestra por estrato, estratos permutados
+    def bloque_lhs(rng, bloque):
+        tam = BLOQUE_RNG
+        if total is not None:
+            tam = max(1, min(BLOQUE_RNG, total - bloque * BLOQUE_RNG))
+        u = (rng.permutation(tam) + rng.random(tam)) / tam
+        return np.pad(u, (0, BLOQUE_RNG - tam), constant_values=0.5)
+
+    primer_bloque = inicio // BLOQUE_RNG
+    ultimo_bloque = (inicio + cantidad - 1) // BLOQUE_RNG
+    u = _uniformes_por_bloque(semilla, variable, primer_bloque, ultimo_bloque, bloque_lhs)
+    desde = inicio - primer_bloque * BLOQUE_RNG
+    return u[desde:desde + cantidad]
+
+
+def _uniformes_qmc(muestreo, semilla, num_variables, inicio, cantidad):
+    # Misma semilla = mismo scramble; fast_forward salta al tramo del rango
+    from scipy.stats import qmc
+
+    clase = qmc.Sobol if muestreo == 'sobol' else qmc.Halton
+    motor = clase(d=num_variables, scramble=True, seed=np.random.default_rng(semilla))
+    if inicio:
+        motor.fast_forward(inicio)
+    with warnings.catch_warnings():
+        # Sobol avisa si el tramo no es potencia de dos; se acepta (ver 'lote' en modelo.txt)
+        warnings.simplefilter('ignore', UserWarning)
+        return motor.random(cantidad)
+
+
+def generar_rango(variables, semilla, inicio, cantidad, muestreo=MUESTREO_INDEPENDIENTE, total=None):
+    """
+    Regenera los escenarios [inicio, inicio + cantidad) de forma determinista.
+    El resultado no depende de como se haya partido el trabajo en rangos.
+    'total' solo lo usa el hipercubo latino para que el ultimo bloque quede completo.
+    """
+    if muestreo != MUESTREO_INDEPENDIENTE:
+        return _generar_rango_uniformes(variables, semilla, inicio, cantidad, muestreo, total)
+
+    primer_bloque = inicio // BLOQUE_RNG
+    ultimo_bloque = (inicio + cantidad - 1) // BLOQUE_RNG
+    desde = inicio - primer_bloque * BLOQUE_RNG
+
+    rango = {}
+    for indice, (nombre, (dist, params)) in enumerate(variables.items()):
+        if cantidad <= 0:
+            rango[nombre] = np.empty(0)
+            continue
+        partes = [generar_lote(crear_generador(semilla, bloque, indice), dist, params, BLOQUE_RNG)
+                  for bloque in range(primer_bloque, ultimo_bloque + 1)]
+        valores = partes[0] if len(partes) == 1 else np.concatenate(partes, axis=-1)
+        rango[nombre] = valores[..., desde:desde + cantidad]
+    return rango
+
+
+def _generar_rango_uniformes(variables, semilla, inicio, cantidad, muestreo, total):
+    if muestreo not in MUESTREOS:
+        raise ValueError(f"Muestreo no soportado: {muestreo}")
+    if cantidad <= 0:
+        return {nombre: np.empty(0) for nombre in variables}
+
+    if muestreo in ('sobol', 'halton'):
+        puntos = _uniformes_qmc(muestreo, semilla, len(variables), inicio, cantidad)
+        columnas = [puntos[:, indice] for indice in range(len(variables))]
+    elif muestreo == 'antitetico':
+        columnas = [_uniformes_antiteticas(semilla, indice, inicio, cantidad)
+                    for indice in range(len(variables))]
+    else:
+        columnas = [_uniformes_lhs(semilla, indice, inicio, cantidad, total)
+                    for indice in range(len(variables))]
+
+    return {nombre: inversa_distribucion(dist, params, u)
+            for (nombre, (dist, params)), u in zip(variables.items(), columnas)}
+
+
+def generar_escenarios(variables, total, semilla, tam_bloque=TAM_BLOQUE, muestreo=MUESTREO_INDEPENDIENTE,
+                       desde=0, hasta=None):
+    """
+    Genera los escenarios [desde, hasta) (por defecto todos) por bloques de tamaño fijo.
+    Devuelve (inicio, cantidad, {variable: array}) para cada bloque.
+    """
+    hasta = total if hasta is None else hasta
+    for inicio in range(desde, hasta, tam_bloque):
+        cantidad = min(tam_bloque, hasta - inicio)
+        yield inicio, cantidad, generar_rango(variables, semilla, inicio, cantidad, muestreo, total)
@@ -0,0 +1,214 @@
+import math
+import time
+import bisect
+import threading
+from collections import deque
+
+# Reparto de la capacidad de un worker entre varias simulaciones a la vez.
+# Cada simulacion trae una 'prioridad' (peso, 1 por defecto): con varias
+# activas, cada una recibe tiempo de evaluacion en proporcion a su peso.
+
+PRIORIDAD_POR_DEFECTO = 1
+
+# Unidades de trabajo adaptativas: cada una deberia tardar unos
+# SEGUNDOS_POR_UNIDAD en un worker tipico, entre LOTE_MIN y LOTE_MAX escenarios
+SEGUNDOS_POR_UNIDAD = 1.0
+LOTE_MIN = 64
+LOTE_MAX = 1 << 20
+# Al final del trabajo ninguna unidad pasa de restantes / (FRACCION_FINAL * workers)
+FRACCION_FINAL = 2
+# Un worker que no reporta en este tiempo deja de contarse
+VENTANA_WORKERS = 30.0
+# Peso de la ultima medida en los promedios moviles
+SUAVIZADO = 0.3
+
+# Prefetch adaptativo: cada worker retiene unos SEGUNDOS_EN_PREFETCH de trabajo
+SEGUNDOS_EN_PREFETCH = 2.0
+PREFETCH_MIN = 2
+PREFETCH_MAX = 500
+# Histeresis: el prefetch solo cambia si el recomendado se aleja del vigente al
+# menos CAMBIO_MIN_PREFETCH unidades y una FRACCION_CAMBIO_PREFETCH de su valor
+# (cada cambio es un basic_qos, y los tiempos por unidad son ruidosos)
+CAMBIO_MIN_PREFETCH = 2
+FRACCION_CAMBIO_PREFETCH = 0.25
+
+
+class ColaJusta:
+    """
+    Cola de tareas por trabajo con reparto justo ponderado (fair share).
+    Cada trabajo tiene su fila y un tiempo virtual que avanza
+    segundos / peso con lo que se le cobra; siempre se atiende la fila no
+    vacia de menor tiempo virtual. Un trabajo que llega (o vuelve a tener
+    tareas) arranca en el tiempo virtual actual: no paga lo que no uso, y
+    uno corto no espera a que termine uno largo. Es thread-safe.
+    """
+
+    def __init__(self):
+        self.filas = {}     # trabajo -> deque de tareas
+        self.pesos = {}
+        self.virtual = {}   # trabajo -> tiempo virtual
+        self.reloj = 0.0    # tiempo virtual del ultimo trabajo atendido
+        self.cantidad = 0
+        self.condicion = threading.Condition()
+
+    def agregar(self, trabajo, tarea, peso=PRIORIDAD_POR_DEFECTO):
+        with self.condicion:
+            fila = self.filas.get(trabajo)
+            if fila is None:
+                fila = self.filas[trabajo] = deque()
+            if not fila:
+                self.virtual[trabajo] = max(self.virtual.get(trabajo, self.reloj), self.reloj)
+            self.pesos[trabajo] = max(float(peso), 1e-9)
+            fila.append(tarea)
+            self.cantidad += 1
+            self.condicion.notify()
+
+    def tomar(self):
+        """(trabajo, tarea) del trabajo con menos servicio; bloquea si no hay tareas"""
+        with self.condicion:
+            while self.cantidad == 0:
+                self.condicion.wait()
+            trabajo = min((t for t, fila in self.filas.items() if fila), key=self.virtual.__getitem__)
+            self.reloj = self.virtual[trabajo]
+            self.cantidad -= 1
+            return trabajo, self.filas[trabajo].popleft()
+
+    def cobrar(self, trabajo, segundos):
+        """Carga al trabajo el tiempo que llevo atender una de sus tareas"""
+        with self.condicion:
+            if trabajo in self.virtual:
+                self.virtual[trabajo] += segundos / self.pesos[trabajo]
+
+    def __len__(self):
+        return self.cantidad
+
+
+def _suavizar(anterior, medida):
+    return medida if anterior is None else anterior + SUAVIZADO * (medida - anterior)
+
+
+class TamanoAdaptativo:
+    """
+    Tamaño de las unidades de trabajo a partir del ritmo medido de cada
+    worker (escenarios por segundo de evaluacion, de sus parciales). Cada
+    unidad apunta a SEGUNDOS_POR_UNIDAD en el worker mediano. Cerca del final
+    se achican (guided self-scheduling): con 'restantes' escenarios por
+    repartir ninguna pasa de restantes / (FRACCION_FINAL * workers), asi los
+    ultimos trozos son chicos y los workers terminan casi a la vez.
+    """
+
+    def __init__(self, inicial, minimo=LOTE_MIN, maximo=LOTE_MAX, segundos=SEGUNDOS_POR_UNIDAD):
+        self.inicial = inicial
+        self.minimo = minimo
+        self.maximo = maximo
+        self.segundos = segundos
+        self.ritmos = {}    # worker_id -> (escenarios/s suavizado, ultimo reporte)
+
+    def registrar(self, worker_id, cantidad, segundos):
+        if cantidad <= 0 or segundos <= 0:
+            return
+        anterior = self.ritmos.get(worker_id, (None, 0))[0]
+        self.ritmos[worker_id] = (_suavizar(anterior, cantidad / segundos), time.time())
+
+    def vigentes(self):
+        desde = time.time() - VENTANA_WORKERS
+        return sorted(ritmo for ritmo, visto in self.ritmos.values() if visto >= desde)
+
+    def ritmo_tipico(self):
+        """Escenarios/s del worker mediano, o None si aun no hay medidas"""
+        ritmos = self.vigentes()
+        return ritmos[len(ritmos) // 2] if ritmos else None
+
+    def siguiente(self, restantes):
+        ritmos = self.vigentes()
+        tamano = self.inicial
+        if ritmos:
+            tamano = ritmos[len(ritmos) // 2] * self.segundos
+            tamano = min(tamano, math.ceil(restantes / (FRACCION_FINAL * len(ritmos))))
+        return int(min(restantes, max(self.minimo, min(self.maximo, tamano))))
+
+
+class PrefetchAdaptativo:
+    """
+    Prefetch de un worker segun cuanto tarda en atender una unidad: retiene
+    unos SEGUNDOS_EN_PREFETCH de trabajo (al menos PREFETCH_MIN unidades,
+    para solapar recepcion y evaluacion). Un nodo lento retiene pocas y deja
+    el resto en la cola para los rapidos. Las variaciones chicas del
+    recomendado no cambian 'valor' (ver CAMBIO_MIN_PREFETCH).
+    """
+
+    def __init__(self, inicial, minimo=PREFETCH_MIN, maximo=PREFETCH_MAX, segundos=SEGUNDOS_EN_PREFETCH):
+        self.valor = inicial
+        self.minimo = minimo
+        self.maximo = maximo
+        self.segundos = segundos
+        self.por_unidad = None
+
+    def registrar(self, segundos):
+        """Tiempo que llevo atender una unidad; devuelve el prefetch recomendado"""
+        self.por_unidad = _suavizar(self.por_unidad, segundos)
+        recomendado = int(max(self.minimo, min(self.maximo,
+                                               math.ceil(self.segundos / max(self.por_unidad, 1e-6)))))
+        if abs(recomendado - self.valor) >= max(CAMBIO_MIN_PREFETCH, FRACCION_CAMBIO_PREFETCH * self.valor):
+            self.valor = recomendado
+        return self.valor
+
+
+class RangosCompletados:
+    """Escenarios [inicio, fin) ya procesados, fusionados en intervalos disjuntos"""
+
+    def __init__(self):
+        self.inicios = []
+        self.fines = []
+        self.cantidad = 0
+
+    def solapa(self, inicio, cantidad):
+        """True si algun escenario de [inicio, inicio + cantidad) ya esta completado"""
+        k = bisect.bisect_right(self.fines, inicio)
+        return k < len(self.inicios) and self.inicios[k] < inicio + cantidad
+
+    def agregar(self, inicio, cantidad):
+        """Marca el rango como completado; devuelve cuantos escenarios son nuevos"""
+        fin = inicio + cantidad
+        # Intervalos que se solapan o tocan con [inicio, fin): del i al j - 1
+        i = bisect.bisect_left(self.fines, inicio)
+        j = bisect.bisect_right(self.inicios, fin)
+        repetidos = sum(max(0, min(fin, self.fines[k]) - max(inicio, self.inicios[k])) for k in range(i, j))
+        if i < j:
+            inicio, fin = min(inicio, self.inicios[i]), max(fin, self.fines[j - 1])
+        self.inicios[i:j] = [inicio]
+        self.fines[i:j] = [fin]
+        self.cantidad += cantidad - repetidos
+        return cantidad - repetidos
+
+    def faltantes(self, total):
+        """Rangos (inicio, cantidad) de [0, total) que aun no estan completados"""
+        faltan = []
+        desde = 0
+        for inicio, fin in zip(self.inicios, self.fines):
+            if inicio >= total:
+                break
+            if inicio > desde:
+                faltan.append((desde, inicio - desde))
+            desde = max(desde, fin)
+        if desde < total:
+            faltan.append((desde, total - desde))
+        return faltan
+
+    def cubre(self, total):
+        return not self.faltantes(total)
+
+    def contiene(self, inicio, cantidad):
+        """True si todo [inicio, inicio + cantidad) ya esta completado"""
+        k = bisect.bisect_right(self.inicios, inicio) - 1
+        return k >= 0 and self.fines[k] >= inicio + cantidad
+
+    def a_lista(self):
+        return [[inicio, fin] for inicio, fin in zip(self.inicios, self.fines)]
+
+    @classmethod
+    def desde_lista(cls, intervalos):
+        rangos = cls()
+        for inicio, fin in intervalos:
+            rangos.agregar(inicio, fin - inicio)
+        return rangos
@@ -1,16 +1,88 @@
 import pika
 import json
 import numpy as np
+import os
+import re
 import sys
 import time
 import uuid
+import multiprocessing
 from datetime import datetime
+from cache import buscar_en_cache, guardar_en_cache, semilla_del_modelo
+from checkpoint import INTERVALO_CHECKPOINT, cargar_checkpoint, guardar_checkpoint, ruta_checkpoint
+from consumidor import trabajar_local
+from estadisticas import AcumuladorBarrido, agregado_desde_dict, crear_agregado
+from evaluador import ModeloCompilado
+from metricas import Metricas
+from muestreo import (MUESTREO_INDEPENDIENTE, MUESTREOS, describir_punto, generar_escenarios, generar_rango,
+                      puntos_barrido, variables_de_puntos)
+from planificacion import PRIORIDAD_POR_DEFECTO, RangosCompletados, TamanoAdaptativo
+from protocolo import FORMATO_BINARIO, FORMATO_JSON, FORMATOS, CONTENT_TYPE, codificar_lote, decodificar
+from colas import COLA_METRICAS, TAM_RANURA, ColasLocales, cola_trabajo, parametros_cola
+
+
+# Clave con la que un worker pide el modelo vigente sin conocer su modelo_id
+MODELO_ACTUAL = 'actual'
+
+# 'semilla = modelo' en modelo.txt: la semilla sale del modelo (ver cache.semilla_del_modelo)
+SEMILLA_DEL_MODELO = 'modelo'
+
+# Escenarios minimos antes de dar por convergida una simulacion
+MIN_ESCENARIOS_CONVERGENCIA = 1000
+
+# Control de flujo de la cola de trabajo de la simulacion (en mensajes)
+COLA_ALTA = 2000
+COLA_BAJA = 500
+CONSULTA_CADA = 100
+# Ventana de publicaciones de trabajo que el broker confirma juntas (un solo
+# tx_commit): como mucho VENTANA_CONFIRMACION mensajes o INTERVALO_CONFIRMACION
+# segundos sin confirmar
+VENTANA_CONFIRMACION = 64
+INTERVALO_CONFIRMACION = 0.1
+
+# Especulacion: una unidad tomada que tarda FACTOR_REZAGO veces lo esperado
+# (y al menos REZAGO_MIN segundos) se vuelve a publicar para otro worker.
+# Sin unidades adaptativas solo se recuperan las que no llegaron nunca, tras
+# REZAGO_SIN_ESPECULACION (pueden pasar un buen rato en el prefetch de un worker)
+FACTOR_REZAGO = 3.0
+REZAGO_MIN = 2.0
+REZAGO_SIN_ESPECULACION = 60.0
+MAX_COPIAS = 3
+INTERVALO_ESPECULACION = 0.5
+
+
+def leer_parametro(texto):
+    """Un parametro de una variable: un numero, una lista [a, b, c] o una grilla desde:hasta:puntos"""
+    if texto.startswith("["):
+        valores = [float(v) for v in texto.strip("[]").replace(",", " ").split()]
+        if not valores:
+            raise ValueError("lista vacia")
+        return valores
+    if ":" in texto:
+        desde, hasta, puntos = texto.split(":")
+        return np.linspace(float(desde), float(hasta), int(puntos)).tolist()
+    return float(texto)
+
+
+def validar_modelo(variables, modelo):
+    """
+    Compila el modelo y lo evalua en un escenario, como un worker: un modelo
+    que fallaria en todos los workers se rechaza antes de publicar nada
+    """
+    compilado = ModeloCompilado(modelo, variables)
+    puntos = puntos_barrido(variables)
+    columnas = generar_rango(variables_de_puntos(variables, 0, 1), 0, 0, 1)
+    compilado.evaluar(columnas, 1, 1 if puntos else None)
 
 
 def leer_modelo_txt(path):
     variables = {}
     modelo = None
     num_simulaciones = None
+    opciones = {'semilla': None, 'lote': 500, 'lote_adaptativo': True, 'formato': FORMATO_BINARIO, 'modo': 'rangos',
+                'resultados': 'individuales', 'error_relativo': None, 'semiamplitud': None,
+                'confianza': 0.95, 'muestreo': MUESTREO_INDEPENDIENTE,
+                'prioridad': PRIORIDAD_POR_DEFECTO, 'cache': True}
 
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -31,16 +103,96 @@ def leer_modelo_txt(path):
                 except:
                     print("ERROR: Formato incorrecto para número de simulaciones")
             continue
+        clave = linea.split("=")[0].strip().lower() if "=" in linea else None
+        if clave == "semilla":
+            try:
+                valor = linea.split("=")[1].strip().lower()
+                opciones['semilla'] = valor if valor == SEMILLA_DEL_MODELO else int(valor)
+                print(f"Semilla: {opciones['semilla']}")
+            except:
+                print("ERROR: Formato incorrecto para la semilla")
+            continue
+        if clave == "lote":
+            try:
+                valor = linea.split("=")[1].strip().lower()
+                opciones['lote_adaptativo'] = valor == "auto"
+                if not opciones['lote_adaptativo']:
+                    opciones['lote'] = max(1, int(valor))
+                print(f"Escenarios por lote: {valor}")
+            except:
+                print("ERROR: Formato incorrecto para el tamaño de lote")
+            continue
+        if clave == "prioridad":
+            try:
+                opciones['prioridad'] = int(linea.split("=")[1].strip())
+                if opciones['prioridad'] < 1:
+                    raise ValueError
+                print(f"Prioridad: {opciones['prioridad']}")
+            except:
+                opciones['prioridad'] = PRIORIDAD_POR_DEFECTO
+                print("ERROR: La prioridad debe ser un entero mayor o igual a 1")
+            continue
+        if clave == "cache":
+            valor = linea.split("=")[1].strip().lower()
+            if valor in ('si', 'no'):
+                opciones['cache'] = valor == 'si'
+                print(f"Cache de resultados: {valor}")
+            else:
+                print(f"ERROR: Valor inválido para cache: {valor}")
+            continue
+        if clave == "modo":
+            modo = linea.split("=")[1].strip().lower()
+            if modo in ('rangos', 'valores'):
+                opciones['modo'] = modo
+                print(f"Modo de envío: {modo}")
+            else:
+                print(f"ERROR: Modo de envío no soportado: {modo}")
+            continue
+        if clave == "resultados":
+            resultados = linea.split("=")[1].strip().lower()
+            if resultados in ('individuales', 'agregados', 'entradas'):
+                opciones['resultados'] = resultados
+                print(f"Resultados: {resultados}")
+            else:
+                print(f"ERROR: Opción de resultados no soportada: {resultados}")
+            continue
+        if clave in ("error_relativo", "semiamplitud", "confianza"):
+            try:
+                valor = float(linea.split("=")[1].strip())
+                if valor <= 0 or (clave == "confianza" and valor >= 1):
+                    raise ValueError
+                opciones[clave] = valor
+                print(f"Objetivo de precisión: {clave} = {valor}")
+            except:
+                print(f"ERROR: Valor inválido para {clave}")
+            continue
+        if clave == "muestreo":
+            muestreo = linea.split("=")[1].strip().lower()
+            if muestreo in MUESTREOS:
+                opciones['muestreo'] = muestreo
+                print(f"Muestreo: {muestreo}")
+            else:
+                print(f"ERROR: Muestreo no soportado: {muestreo}")
+            continue
+        if clave == "formato":
+            formato = linea.split("=")[1].strip().lower()
+            if formato in FORMATOS:
+                opciones['formato'] = formato
+                print(f"Formato de mensajes: {formato}")
+            else:
+                print(f"ERROR: Formato de mensajes no soportado: {formato}")
+            continue
         if "=" in linea and not linea.startswith("#"):
             partes = linea.split("=")
             if len(partes) == 2:
                 nombre = partes[0].strip()
                 valor = partes[1].strip()
-                partes_valor = valor.split()
+                # Las listas [a, b] pueden llevar espacios: son un solo parametro
+                partes_valor = re.findall(r"\[[^\]]*\]|\S+", valor)
                 if len(partes_valor) >= 2:
                     dist = partes_valor[0].lower()
                     try:
-                        params = list(map(float, partes_valor[1:]))
+                        params = list(map(leer_parametro, partes_valor[1:]))
                         variables[nombre] = (dist, params)
                         print(f"Variable registrada: {nombre} ~ {dist}{params}")
                     except:
@@ -55,34 +207,36 @@ def leer_modelo_txt(path):
         print("ERROR: No se encontró la expresión del modelo.")
         exit(1)
 
+    try:
+        validar_modelo(variables, modelo)
+    except Exception as e:
+        print(f"ERROR: Modelo inválido: {e}")
+        exit(1)
+
     if num_simulaciones is None:
         print("ADVERTENCIA: No se indicó número de simulaciones, usando 10000 por defecto.")
         num_simulaciones = 10000
 
-    return variables, modelo, num_simulaciones
-
-
-def limpiar_colas_existentes(host):
-    """Eliminar las colas existentes para evitar conflictos"""
-    try:
-        connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host=host)
-        )
-        channel = connection.channel()
+    puntos = puntos_barrido(variables)
+    if puntos is not None:
+        print(f"Barrido de parámetros: {puntos} puntos en la grilla")
+        # Cada punto se agrega por separado en los workers; las unidades son rangos
+        if opciones['resultados'] != 'agregados' or opciones['modo'] != 'rangos':
+            print("ADVERTENCIA: un barrido usa modo = rangos y resultados = agregados")
+            opciones['resultados'], opciones['modo'] = 'agregados', 'rangos'
 
-        # Eliminar colas existentes
-        for queue in ['modelo', 'escenarios', 'resultados']:
-            try:
-                channel.queue_delete(queue=queue)
-                print(f"Cola '{queue}' eliminada")
-            except Exception as e:
-                print(f"No se pudo eliminar cola '{queue}': {e}")
+    if opciones['semilla'] == SEMILLA_DEL_MODELO:
+        # Derivada del modelo: el mismo modelo.txt da la misma simulacion (y sale de la cache)
+        opciones['semilla'] = semilla_del_modelo(variables, modelo, opciones['muestreo'])
+        print(f"Semilla derivada del modelo: {opciones['semilla']}")
+    elif opciones['semilla'] is None:
+        # Semilla aleatoria pero registrada, para poder repetir la simulación.
+        # Cada corrida es otra muestra: no hay nada que buscar ni guardar en la cache
+        opciones['semilla'] = int(np.random.SeedSequence().entropy % (2 ** 63))
+        opciones['cache'] = False
+        print(f"Semilla generada: {opciones['semilla']} (sin cache: fijar la semilla para usarla)")
 
-        connection.close()
-        return True
-    except Exception as e:
-        print(f"Error limpiando colas: {e}")
-        return False
+    return variables, modelo, num_simulaciones, opciones
 
 
 def conectar_rabbitmq(host):
@@ -91,10 +245,18 @@ def conectar_rabbitmq(host):
         connection = pika.BlockingConnection(pika.ConnectionParameters(host=host))
         channel = connection.channel()
 
-        # Declarar colas  adicionales para evitar conflictos
-        channel.queue_declare(queue='modelo', durable=True)
-        channel.queue_declare(queue='escenarios', durable=True)
+        # Colas compartidas por todas las simulaciones; la de trabajo es propia
+        # de cada una (la declara PublicadorEscenarios)
         channel.queue_declare(queue='resultados', durable=True)
+        channel.queue_declare(queue=COLA_METRICAS, **parametros_cola(COLA_METRICAS))
+
+        # Modelos: difusion a todos los workers y solicitudes de los que llegan tarde
+        channel.exchange_declare(exchange='modelos', exchange_type='fanout', durable=True)
+        channel.exchange_declare(exchange='solicitudes_modelo', exchange_type='direct', durable=True)
+
+        # Los parciales de los workers llegan a 'resultados' y a quien siga la convergencia
+        channel.exchange_declare(exchange='parciales', exchange_type='fanout', durable=True)
+        channel.queue_bind(queue='resultados', exchange='parciales')
 
         print(f"Conectado a RabbitMQ en {host}")
         return connection, channel
@@ -103,77 +265,660 @@ def conectar_rabbitmq(host):
         return None, None
 
 
-def generar_valor_individual(dist, params):
-    dist = dist.lower()
-
-    if dist == "normal":
-        mu, sigma = params
-        return np.random.normal(mu, sigma)
-    elif dist == "uniform":
-        low, high = params
-        return np.random.uniform(low, high)
-    elif dist == "poisson":
-        lam = params[0]
-        return np.random.poisson(lam)
-    elif dist in ("exp", "exponential"):
-        lam = params[0]
-        return np.random.exponential(1 / lam)
-    elif dist == "triangular":
-        low, mode, high = params
-        return np.random.triangular(low, mode, high)
-    elif dist == "lognormal":
-        mu, sigma = params
-        return np.random.lognormal(mu, sigma)
+class ServidorModelo:
+    """
+    Responde las solicitudes de modelo de los workers: cada una llega por el
+    exchange 'solicitudes_modelo' (clave = modelo_id o 'actual') y se contesta
+    directo a la cola reply_to del worker, asi nadie espera una retransmision.
+    Con varias simulaciones en curso cada productor contesta 'actual', y el
+    worker que llega recibe todos los modelos vigentes.
+    """
+
+    def __init__(self, channel, modelo_msg):
+        self.channel = channel
+        self.modelo_msg = modelo_msg
+        self.cuerpo = json.dumps(modelo_msg)
+        self.atendidas = 0
+
+        cola = channel.queue_declare(queue='', exclusive=True).method.queue
+        for clave in (modelo_msg['modelo_id'], MODELO_ACTUAL):
+            channel.queue_bind(queue=cola, exchange='solicitudes_modelo', routing_key=clave)
+        channel.basic_consume(queue=cola, on_message_callback=self.atender, auto_ack=True)
+
+    def difundir(self):
+        """Envia el modelo a todos los workers conectados"""
+        self.channel.basic_publish(exchange='modelos', routing_key='', body=self.cuerpo)
+
+    def cancelar(self, tipo='cancelar'):
+        """
+        Avisa que el modelo termino ('cancelar' al converger, 'fin_escenarios' al
+        completarse); a los que lo pidan despues se les entrega ya cancelado
+        """
+        self.cuerpo = json.dumps(dict(self.modelo_msg, cancelado=True))
+        cancelar_msg = {'tipo': tipo, 'modelo_id': self.modelo_msg['modelo_id'],
+                        'timestamp': datetime.now().isoformat()}
+        self.channel.basic_publish(exchange='modelos', routing_key='', body=json.dumps(cancelar_msg))
+
+    def atender(self, ch, method, properties, body):
+        if not properties.reply_to:
+            return
+        ch.basic_publish(
+            exchange='',
+            routing_key=properties.reply_to,
+            body=self.cuerpo,
+            properties=pika.BasicProperties(correlation_id=properties.correlation_id,
+                                            content_type=CONTENT_TYPE[FORMATO_JSON])
+        )
+        self.atendidas += 1
+
+
+class Coordinador:
+    """
+    Sigue la convergencia de la simulacion fusionando los parciales de los
+    workers. Cuando se alcanza la precision pedida (error relativo de la media
+    o semiamplitud del intervalo de confianza; en un barrido, en todos los
+    puntos) se deja de generar trabajo y se avisa a los workers por 'modelos'
+    para que descarten lo pendiente; lo que sigue en la cola se purga.
+
+    Tambien lleva los rangos completados, con los que sabe cuando termino la
+    simulacion (cuenta resultados, no espera avisos de fin), y los guarda
+    junto al agregado en un checkpoint cada INTERVALO_CHECKPOINT segundos.
+    Con 'tamanos' mide el ritmo de cada worker para dimensionar las unidades.
+    Un parcial que repite escenarios ya contados (una copia especulativa, o
+    trabajo de antes de reanudar) se descarta entero: sus rangos siguen
+    pendientes y se vuelven a publicar si nadie los completa.
+    """
+
+    def __init__(self, channel, servidor_modelo, opciones, tamanos=None):
+        self.channel = channel
+        self.servidor_modelo = servidor_modelo
+        self.modelo_id = servidor_modelo.modelo_msg['modelo_id']
+        self.error_relativo = opciones['error_relativo']
+        self.semiamplitud = opciones['semiamplitud']
+        self.confianza = opciones['confianza']
+        self.opciones = opciones
+        self.tamanos = tamanos
+        self.agregado = crear_agregado(servidor_modelo.modelo_msg.get('puntos'))
+        self.completados = RangosCompletados()
+        self.unidades = {}      # inicio -> [cantidad, momento de publicacion, copias] sin completar
+        self.agotadas = set()   # unidades que siguen sin completar tras MAX_COPIAS copias
+        self.duplicados = 0
+        self.detenido = False
+        self.ultimo_checkpoint = time.time()
+
+        cola = channel.queue_declare(queue='', exclusive=True).method.queue
+        channel.queue_bind(queue=cola, exchange='parciales')
+        channel.basic_consume(queue=cola, on_message_callback=self.atender, auto_ack=True)
+
+    @property
+    def activo(self):
+        return self.error_relativo is not None or self.semiamplitud is not None
+
+    def convergido(self):
+        if not self.activo:
+            return False
+        if isinstance(self.agregado, AcumuladorBarrido):
+            return all(self.precision_alcanzada(punto) for punto in self.agregado.puntos)
+        return self.precision_alcanzada(self.agregado)
+
+    def precision_alcanzada(self, agregado):
+        if agregado.n < MIN_ESCENARIOS_CONVERGENCIA:
+            return False
+        if self.error_relativo is not None:
+            media = abs(agregado.media)
+            if media == 0 or agregado.error_estandar / media > self.error_relativo:
+                return False
+        if self.semiamplitud is not None:
+            if agregado.semiamplitud(self.confianza) > self.semiamplitud:
+                return False
+        return True
+
+    def atender(self, ch, method, properties, body):
+        try:
+            mensaje = json.loads(body.decode('utf-8'))
+        except Exception:
+            return
+        if mensaje.get('tipo') != 'parcial' or mensaje.get('modelo_id') != self.modelo_id:
+            return
+        parcial = agregado_desde_dict(mensaje['agregado'])
+        rangos = mensaje.get('rangos', [])
+        if any(self.completados.solapa(inicio, cantidad) for inicio, cantidad in rangos):
+            # Segunda ejecucion de alguna unidad (especulativa, rezagada o de antes de reanudar)
+            self.duplicados += 1
+            return
+        for inicio, cantidad in rangos:
+            self.completados.agregar(inicio, cantidad)
+            self.unidades.pop(inicio, None)
+        if self.tamanos is not None and mensaje.get('segundos'):
+            self.tamanos.registrar(mensaje.get('worker_id'), parcial.cantidad, mensaje['segundos'])
+
+        self.agregado.fusionar(parcial)
+        if time.time() - self.ultimo_checkpoint >= INTERVALO_CHECKPOINT:
+            self.guardar()
+        if not self.detenido and self.convergido():
+            self.detener()
+
+    def restaurar(self, estado):
+        """Parte de los rangos completados y el agregado de un checkpoint"""
+        self.completados = estado['completados']
+        self.agregado = estado['agregado']
+        if not self.detenido and self.convergido():
+            self.detener()
+
+    def guardar(self, completo=False):
+        guardar_checkpoint(self.servidor_modelo.modelo_msg, self.opciones, self.completados,
+                           self.agregado, completo)
+        self.ultimo_checkpoint = time.time()
+
+    def completo(self):
+        return self.completados.cubre(self.servidor_modelo.modelo_msg['total_escenarios'])
+
+    def publicada(self, inicio, cantidad):
+        self.unidades[inicio] = [cantidad, time.time(), 0]
+
+    def rezagadas(self, desde):
+        """
+        Unidades sin completar que llevan demasiado desde que fueron tomadas
+        ('desde' es cuando la cola quedo vacia: todas ya tenian worker).
+        Cada una se devuelve a lo sumo MAX_COPIAS veces, con la espera renovada;
+        si la ultima copia tampoco llega, la unidad queda en 'agotadas'.
+        """
+        ritmo = self.tamanos.ritmo_tipico() if self.tamanos is not None else None
+        ahora = time.time()
+        for inicio, unidad in sorted(self.unidades.items()):
+            cantidad, publicada, copias = unidad
+            if self.completados.contiene(inicio, cantidad):
+                del self.unidades[inicio]
+                continue
+            if self.tamanos is None:
+                limite = REZAGO_SIN_ESPECULACION
+            else:
+                limite = max(REZAGO_MIN, FACTOR_REZAGO * (cantidad / ritmo if ritmo else REZAGO_MIN))
+            if ahora - max(publicada, desde) <= limite:
+                continue
+            if copias < MAX_COPIAS:
+                unidad[1] = ahora
+                unidad[2] += 1
+                yield inicio, cantidad
+            else:
+                self.agotadas.add(inicio)
+
+    def vaciar_cola(self):
+        """Descarta las unidades que siguen en la cola de trabajo: ya no hacen falta"""
+        descartadas = self.channel.queue_purge(queue=self.servidor_modelo.modelo_msg['cola']).method.message_count
+        if descartadas:
+            print(f"Descartadas {descartadas} unidades pendientes de la cola '{self.servidor_modelo.modelo_msg['cola']}'")
+
+    def detener(self):
+        self.detenido = True
+        agregado = self.agregado
+        if isinstance(agregado, AcumuladorBarrido):
+            print(f"Precisión alcanzada en los {len(agregado.puntos)} puntos con {agregado.cantidad} escenarios")
+            imprimir_agregado(agregado, self.servidor_modelo.modelo_msg['variables'], self.confianza)
+        else:
+            print(f"Precisión alcanzada con {agregado.cantidad} escenarios: media {agregado.media:.6f} "
+                  f"± {agregado.semiamplitud(self.confianza):.6f} ({self.confianza:.0%})")
+        self.servidor_modelo.cancelar()
+        self.vaciar_cola()
+
+
+class PublicadorEscenarios:
+    """
+    Publica en la cola de trabajo de la simulacion ('escenarios.<modelo_id>')
+    por ventanas: un canal propio en modo transaccion y un tx_commit cada
+    VENTANA_CONFIRMACION mensajes, en vez de esperar la confirmacion de cada
+    uno (el canal bloqueante espera un viaje al broker por mensaje). Lo que el
+    broker devuelve sin rutear se vuelve a publicar. Si la cola supera
+    COLA_ALTA mensajes se detiene hasta que baje de COLA_BAJA: a toda
+    velocidad mientras los workers den abasto, en pausa si se atrasan.
+    Mide generacion, publicacion y tiempo bloqueado y los publica en 'metricas'.
+    """
+
+    def __init__(self, connection, channel, cola, alta=COLA_ALTA, baja=COLA_BAJA, origen="productor"):
+        self.connection = connection
+        self.channel = channel
+        self.cola = cola
+        self.alta = alta
+        self.baja = baja
+        self.publicados = 0
+        self.desde_consulta = 0
+        self.profundidad_estimada = 0
+        self.tiempo_pausado = 0.0
+        self.metricas = Metricas('productor', origen)
+        self.fin_ultima = None
+        self.channel.queue_declare(queue=cola, **parametros_cola(cola))
+        # Canal aparte: las metricas, consultas y respuestas de modelo del
+        # canal principal no esperan al commit de la ventana
+        self.canal_trabajo = connection.channel()
+        self.canal_trabajo.tx_select()
+        self.canal_trabajo.add_on_return_callback(self._devuelto)
+        self.sin_confirmar = 0
+        self.inicio_ventana = None
+        self.devueltos = []
+
+    def profundidad(self):
+        profundidad = self.channel.queue_declare(queue=self.cola, passive=True).method.message_count
+        self.metricas.valor('profundidad_cola', profundidad)
+        return profundidad
+
+    def publicar_metricas(self):
+        self.channel.basic_publish(exchange='', routing_key=COLA_METRICAS,
+                                   body=json.dumps(self.metricas.a_mensaje()))
+
+    def esperar_si_llena(self):
+        # Consultar la cola cuesta un viaje al broker: se estima entre consultas
+        if self.profundidad_estimada + self.desde_consulta < self.alta and self.desde_consulta < CONSULTA_CADA:
+            return
+        self.profundidad_estimada = self.profundidad()
+        self.desde_consulta = 0
+        if self.profundidad_estimada < self.alta:
+            return
+
+        print(f"Cola '{self.cola}' con {self.profundidad_estimada} mensajes, esperando a los workers...")
+        inicio = time.time()
+        self.confirmar()  # lo que quedo en la ventana no llega a la cola hasta el commit
+        while self.profundidad_estimada > self.baja:
+            self.connection.sleep(0.2)  # Atiende heartbeats y solicitudes mientras espera
+            self.profundidad_estimada = self.profundidad()
+            if self.metricas.vencidas():
+                self.publicar_metricas()
+        self.tiempo_pausado += time.time() - inicio
+        self.metricas.registrar('bloqueado', time.time() - inicio)
+
+    def _devuelto(self, channel, method, properties, body):
+        # El broker no pudo rutear el mensaje (mandatory): va en la proxima ventana
+        self.devueltos.append((body, properties))
+
+    def _enviar(self, cuerpo, propiedades):
+        self.canal_trabajo.basic_publish(exchange='', routing_key=self.cola, body=cuerpo,
+                                         properties=propiedades, mandatory=True)
+        self.sin_confirmar += 1
+        if self.inicio_ventana is None:
+            self.inicio_ventana = time.perf_counter()
+
+    def confirmar(self):
+        """Cierra la ventana: espera a que el broker confirme todo lo publicado en ella"""
+        while self.sin_confirmar:
+            with self.metricas.medir('confirmacion'):
+                self.canal_trabajo.tx_commit()
+            self.sin_confirmar = 0
+            self.inicio_ventana = None
+            # Los devueltos llegan antes del commit-ok y se entregan aca
+            self.connection.process_data_events(time_limit=0)
+            if self.devueltos:
+                self.metricas.contar('reintentos', len(self.devueltos))
+                self.connection.sleep(0.1)
+                devueltos, self.devueltos = self.devueltos, []
+                for cuerpo, propiedades in devueltos:
+                    self._enviar(cuerpo, propiedades)
+
+    def publicar(self, cuerpo, content_type):
+        # Lo que paso desde la publicacion anterior es generar (y codificar) este mensaje
+        inicio = time.perf_counter()
+        if self.fin_ultima is not None:
+            self.metricas.registrar('generacion', inicio - self.fin_ultima)
+
+        self.esperar_si_llena()
+        with self.metricas.medir('publicacion'):
+            self._enviar(cuerpo, pika.BasicProperties(delivery_mode=2, content_type=content_type,
+                                                      headers={'publicado': time.time()}))
+            if self.sin_confirmar >= VENTANA_CONFIRMACION \
+                    or time.perf_counter() - self.inicio_ventana >= INTERVALO_CONFIRMACION:
+                self.confirmar()
+        self.publicados += 1
+        self.desde_consulta += 1
+        self.metricas.contar('mensajes')
+        # Atender solicitudes de modelo pendientes sin bloquear
+        self.connection.process_data_events(time_limit=0)
+        if self.metricas.vencidas():
+            self.publicar_metricas()
+        self.fin_ultima = time.perf_counter()
+
+
+def mensaje_rango(modelo_id, semilla, inicio, cantidad):
+    rango = {
+        'tipo': 'rango',
+        'modelo_id': modelo_id,
+        'semilla': semilla,
+        'inicio': inicio,
+        'cantidad': cantidad
+    }
+    return json.dumps(rango).encode('utf-8')
+
+
+def generar_mensajes_trabajo(modelo_msg, variables, total_simulaciones, opciones, tamanos=None, rangos=None):
+    """
+    Devuelve (cuerpo, content_type, inicio, cantidad) por cada unidad de trabajo
+    de los 'rangos' (inicio, cantidad) pedidos, por defecto todo [0, total_simulaciones).
+    Con 'tamanos' (TamanoAdaptativo) el tamaño de cada unidad se decide al generarla.
+    """
+    modelo_id = modelo_msg['modelo_id']
+    if rangos is None:
+        rangos = [(0, total_simulaciones)]
+    if tamanos is None:
+        tamano = lambda restantes: opciones['lote']
     else:
-        raise ValueError(f"Distribución no soportada: {dist}")
+        tamano = tamanos.siguiente
+    restantes = sum(cantidad for _, cantidad in rangos)
+
+    for rango_inicio, rango_cantidad in rangos:
+        rango_fin = rango_inicio + rango_cantidad
+
+        if opciones['modo'] == 'rangos':
+            inicio = rango_inicio
+            while inicio < rango_fin:
+                cantidad = min(tamano(restantes), rango_fin - inicio)
+                yield mensaje_rango(modelo_id, opciones['semilla'], inicio, cantidad), \
+                    CONTENT_TYPE[FORMATO_JSON], inicio, cantidad
+                inicio += cantidad
+                restantes -= cantidad
+            continue
+
+        # Los valores se generan por bloques (una llamada por variable y bloque)
+        for bloque_inicio, cantidad_bloque, bloque in generar_escenarios(
+                variables, total_simulaciones, opciones['semilla'], muestreo=opciones['muestreo'],
+                desde=rango_inicio, hasta=rango_fin):
+            lote_inicio = 0
+            while lote_inicio < cantidad_bloque:
+                lote_fin = min(lote_inicio + tamano(restantes), cantidad_bloque)
+                lote = {
+                    'tipo': 'lote',
+                    'modelo_id': modelo_id,
+                    'inicio': bloque_inicio + lote_inicio,
+                    'cantidad': lote_fin - lote_inicio,
+                    'variables': {nombre: valores[lote_inicio:lote_fin]
+                                  for nombre, valores in bloque.items()},
+                    'timestamp': datetime.now().isoformat()
+                }
+                cuerpo = codificar_lote(lote, modelo_msg['orden_variables'], opciones['formato'])
+                yield cuerpo, CONTENT_TYPE[opciones['formato']], lote['inicio'], lote['cantidad']
+                restantes -= lote['cantidad']
+                lote_inicio = lote_fin
+
+
+def esperar_completado(connection, publicador, coordinador, semilla):
+    """
+    Tras publicar todo, espera a que los resultados cubran todos los rangos.
+    Cuando la cola queda vacia (cada unidad ya tiene worker), las que tardan
+    demasiado se vuelven a publicar como rango para que las tome otro worker;
+    cuenta la primera ejecucion que llegue. Devuelve cuantas copias se publicaron.
+    Si una unidad no llega ni tras MAX_COPIAS copias (por ejemplo, un modelo que
+    falla en todos los workers) lanza RuntimeError en vez de esperar para siempre.
+    """
+    copias = 0
+    vacia_desde = None
+    while not coordinador.detenido and not coordinador.completo():
+        connection.process_data_events(time_limit=INTERVALO_ESPECULACION)
+        if publicador.profundidad() > 0:
+            vacia_desde = None
+            continue
+        vacia_desde = vacia_desde or time.time()
+        for inicio, cantidad in list(coordinador.rezagadas(vacia_desde)):
+            publicador.fin_ultima = None  # la espera no es tiempo de generacion
+            publicador.publicar(mensaje_rango(coordinador.modelo_id, semilla, inicio, cantidad),
+                                CONTENT_TYPE[FORMATO_JSON])
+            copias += 1
+        publicador.confirmar()
+        agotadas = [inicio for inicio in sorted(coordinador.agotadas) if inicio in coordinador.unidades]
+        if agotadas:
+            inicio = agotadas[0]
+            fin = inicio + coordinador.unidades[inicio][0]
+            raise RuntimeError(f"{len(agotadas)} unidades sin resultado tras {MAX_COPIAS + 1} intentos "
+                               f"(la primera, escenarios [{inicio}, {fin})): los workers las descartan, "
+                               f"revise sus errores")
+    return copias
+
+
+def crear_mensaje_modelo(variables, modelo_expr, total_simulaciones, opciones):
+    modelo_id = str(uuid.uuid4())
+    return {
+        'modelo_id': modelo_id,
+        'timestamp': datetime.now().isoformat(),
+        'variables': variables,
+        'expresion': modelo_expr,
+        'total_escenarios': total_simulaciones,
+        'semilla': opciones['semilla'],
+        'orden_variables': list(variables.keys()),
+        'formato': opciones['formato'],
+        'formatos': list(FORMATOS),
+        'modo': opciones['modo'],
+        'resultados': opciones['resultados'],
+        'muestreo': opciones['muestreo'],
+        'puntos': puntos_barrido(variables),  # None si no es un barrido
+        'cola': cola_trabajo(modelo_id),
+        'prioridad': opciones.get('prioridad', PRIORIDAD_POR_DEFECTO),
+        # Unidades adaptativas: cada una en su propio parcial, para poder re-ejecutarlas
+        'especulacion': opciones.get('lote_adaptativo', False),
+        'tipo': 'modelo'
+    }
+
+
+def publicar_local(colas, modelo_msg, variables, total_simulaciones, opciones, procesos, rangos=None):
+    """Proceso generador del modo local: el anillo lleno lo frena, como la cola a PublicadorEscenarios"""
+    for cuerpo, content_type, _, _ in generar_mensajes_trabajo(
+            modelo_msg, variables, total_simulaciones, opciones, rangos=rangos):
+        colas.publicar('escenarios', cuerpo, content_type)
+
+    fin_msg = {'tipo': 'fin_escenarios', 'modelo_id': modelo_msg['modelo_id'],
+               'total_escenarios': total_simulaciones}
+    for i in range(procesos):  # Uno por worker: cada uno termina con el suyo
+        colas.publicar('escenarios', json.dumps(fin_msg), CONTENT_TYPE[FORMATO_JSON])
+    colas.cerrar()
+
+
+def imprimir_agregado(agregado, variables=None, confianza=0.95):
+    if isinstance(agregado, AcumuladorBarrido):
+        # Una linea por punto de la grilla
+        for k, punto in enumerate(agregado.puntos):
+            print(f"   [{k}] {describir_punto(variables, k)}: media {punto.media:.6f} "
+                  f"± {punto.semiamplitud(confianza):.6f}, desv. {punto.desviacion:.6f}, "
+                  f"p5/p50/p95 {punto.sketch.cuantil(0.05):.6f} / {punto.sketch.cuantil(0.5):.6f} / "
+                  f"{punto.sketch.cuantil(0.95):.6f}, fallidos {punto.fallidos}")
+        return
+    print(f"   Media: {agregado.media:.6f}")
+    print(f"   Desviacion estandar: {agregado.desviacion:.6f}")
+    print(f"   Minimo: {agregado.minimo:.6f}")
+    print(f"   Maximo: {agregado.maximo:.6f}")
+    print(f"   Percentiles 5/50/95: {agregado.sketch.cuantil(0.05):.6f} / "
+          f"{agregado.sketch.cuantil(0.5):.6f} / {agregado.sketch.cuantil(0.95):.6f}")
+    print(f"   Escenarios fallidos (NaN): {agregado.fallidos}")
+
+
+def consultar_cache(variables, modelo_expr, total_simulaciones, opciones):
+    """Resultado guardado de esta simulacion (ver cache.py), si la cache esta activa"""
+    if not opciones.get('cache', True):
+        return None
+    return buscar_en_cache(variables, modelo_expr, opciones['semilla'], opciones['muestreo'], total_simulaciones)
+
+
+def guardar_resultado(variables, modelo_expr, total_simulaciones, opciones, agregado):
+    if opciones.get('cache', True):
+        guardar_en_cache(variables, modelo_expr, opciones['semilla'], opciones['muestreo'],
+                         total_simulaciones, agregado)
+
+
+def ejecutar_local(variables, modelo_expr, total_simulaciones, opciones, procesos):
+    """
+    Corre todo en esta maquina sin RabbitMQ: un proceso generador, 'procesos'
+    workers y la recepcion de resultados en este proceso, unidos por anillos
+    en memoria compartida (ColasLocales). Es un ejecutor aparte: no
+    comparte el camino de publicacion y consumo del modo con RabbitMQ. Sin checkpoint, sin detencion por
+    precision y con unidades de 'lote' fijo. Si un proceso cae o faltan
+    escenarios termina con error en vez de informar un resultado parcial.
+    """
+    modelo_msg = crear_mensaje_modelo(variables, modelo_expr, total_simulaciones, opciones)
+    agregado = crear_agregado(modelo_msg['puntos'])
+    rangos = None
+    en_cache = consultar_cache(variables, modelo_expr, total_simulaciones, opciones)
+    if en_cache is not None:
+        guardados, agregado = en_cache
+        if guardados == total_simulaciones:
+            print(f"Resultado en cache ({total_simulaciones} escenarios, semilla {opciones['semilla']}): no se simula")
+            imprimir_agregado(agregado, modelo_msg['variables'], opciones['confianza'])
+            return agregado
+        rangos = [(guardados, total_simulaciones - guardados)]
+        print(f"En cache hay {guardados} escenarios con la misma semilla: "
+              f"se simulan solo los {total_simulaciones - guardados} que faltan")
+    if opciones['error_relativo'] is not None or opciones['semiamplitud'] is not None:
+        print("ADVERTENCIA: el modo local no detiene por precisión; se simulan todos los escenarios")
+
+    # Una ranura debe poder llevar el lote mas grande (valores o resultados en JSON)
+    # y el parcial de un barrido (un agregado por punto)
+    tam_ranura = max(TAM_RANURA, opciones['lote'] * (len(variables) + 1) * 32 + 4096,
+                     (modelo_msg['puntos'] or 0) * 64 * 1024)
+    colas = ColasLocales(tam_ranura=tam_ranura)
+
+    generador = multiprocessing.Process(
+        target=publicar_local,
+        args=(colas, modelo_msg, variables, total_simulaciones, opciones, procesos, rangos),
+        name='generador', daemon=True)
+    workers = [multiprocessing.Process(
+        target=trabajar_local, args=(colas, modelo_msg, f"local_p{i}"),
+        name=f"local_p{i}", daemon=True) for i in range(procesos)]
+    hijos = [generador] + workers
+
+    def caidos():
+        return [f"{hijo.name} (codigo {hijo.exitcode})" for hijo in hijos if hijo.exitcode not in (None, 0)]
+
+    print(f"Modo local: {procesos} workers, {total_simulaciones} escenarios")
+    inicio = time.time()
+    for hijo in hijos:
+        hijo.start()
+
+    individuales = 0
+    finales = 0
+    ultimo_progreso = time.time()
+    try:
+        for mensaje in colas.consumir('resultados', timeout=1.0):
+            # Un worker caido se lleva las unidades que tenia: el resultado ya no es completo
+            if mensaje is None or time.time() - ultimo_progreso >= 1:
+                if caidos() or not any(worker.is_alive() for worker in workers):
+                    break
+            if mensaje is None:
+                continue
+            cuerpo, content_type = mensaje
+            msg = decodificar(cuerpo)
+            if msg.get('tipo') == 'parcial':
+                agregado.fusionar(agregado_desde_dict(msg['agregado']))
+                if msg.get('final'):
+                    finales += 1
+                    if finales == procesos:
+                        break
+            elif msg.get('tipo') == 'resultados_lote':
+                individuales += len(msg['resultados'])
+
+            if time.time() - ultimo_progreso >= 1:
+                ultimo_progreso = time.time()
+                porcentaje = agregado.cantidad / total_simulaciones * 100
+                print(f"Procesados {agregado.cantidad}/{total_simulaciones} escenarios ({porcentaje:.1f}%)")
+    finally:
+        errores = caidos()
+        for hijo in hijos:
+            hijo.join(timeout=5)
+            if hijo.is_alive():
+                hijo.terminate()
+                hijo.join()
+        colas.liberar()
+
+    if errores:
+        print(f"ERROR: terminaron con error: {', '.join(errores)}")
+    if finales < procesos or agregado.cantidad != total_simulaciones:
+        print(f"ERROR: llegaron {agregado.cantidad}/{total_simulaciones} escenarios "
+              f"({finales}/{procesos} workers terminaron bien); no hay resultado")
+        sys.exit(1)
+
+    duracion = time.time() - inicio
+    simulados = agregado.cantidad - (en_cache[0] if en_cache is not None else 0)
+    print(f"Simulación local completada en {duracion:.2f} segundos "
+          f"({simulados / max(duracion, 1e-9):.0f} escenarios/s)")
+    imprimir_agregado(agregado, modelo_msg['variables'], opciones['confianza'])
+    if individuales:
+        print(f"   Resultados individuales recibidos: {individuales}")
+    guardar_resultado(variables, modelo_expr, total_simulaciones, opciones, agregado)
+    return agregado
 
 
 def main():
+    # --reanudar modelo_id: continuar una simulacion desde su checkpoint
+    reanudar = None
+    if "--reanudar" in sys.argv[:-1]:
+        k = sys.argv.index("--reanudar")
+        reanudar = sys.argv[k + 1]
+        del sys.argv[k:k + 2]
+
     if len(sys.argv) < 2:
-        print("Uso: python productor.py modelo.txt [host_rabbitmq]")
+        print("Uso: python productor.py modelo.txt [host_rabbitmq | local [procesos]] [--reanudar modelo_id]")
         sys.exit(1)
 
     archivo_modelo = sys.argv[1]
     host_rabbitmq = sys.argv[2] if len(sys.argv) > 2 else "localhost"
 
+    if host_rabbitmq == "local":
+        # Sin broker: todo el pipeline en esta maquina
+        procesos = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+        print(f"Leyendo modelo desde: {archivo_modelo}")
+        variables, modelo_expr, total_simulaciones, opciones = leer_modelo_txt(archivo_modelo)
+        ejecutar_local(variables, modelo_expr, total_simulaciones, opciones, procesos)
+        return
+
     print("PRODUCTOR - SISTEMA MONTECARLO DISTRIBUIDO")
     print("Este productor permite que consumidores se unan en cualquier momento")
-
-    # PRIMERO limpiar colas existentes
-    print(f"Limpiando colas existentes en: {host_rabbitmq}")
-    if not limpiar_colas_existentes(host_rabbitmq):
-        print("Advertencia: No se pudieron limpiar todas las colas")
-
-    # Leer modelo
-    print(f"Leyendo modelo desde: {archivo_modelo}")
-    variables, modelo_expr, total_simulaciones = leer_modelo_txt(archivo_modelo)
+    print("y puede correr a la vez que otras simulaciones en el mismo broker")
+
+    # Leer modelo, o tomarlo del checkpoint (con su semilla) si se reanuda
+    estado = None
+    if reanudar:
+        try:
+            estado = cargar_checkpoint(reanudar)
+        except FileNotFoundError:
+            print(f"ERROR: No hay checkpoint en '{ruta_checkpoint(reanudar)}'.")
+            sys.exit(1)
+        modelo_msg, opciones = estado['modelo'], estado['opciones']
+        variables = {nombre: tuple(modelo_msg['variables'][nombre]) for nombre in modelo_msg['orden_variables']}
+        modelo_expr, total_simulaciones = modelo_msg['expresion'], modelo_msg['total_escenarios']
+        print(f"Reanudando {reanudar} desde su checkpoint ({estado['completados'].cantidad}/"
+              f"{total_simulaciones} escenarios completados); no se lee {archivo_modelo}")
+    else:
+        print(f"Leyendo modelo desde: {archivo_modelo}")
+        variables, modelo_expr, total_simulaciones, opciones = leer_modelo_txt(archivo_modelo)
+        modelo_msg = crear_mensaje_modelo(variables, modelo_expr, total_simulaciones, opciones)
+        # Si ya se simulo, el resultado sale de la cache; si se simulo con menos
+        # escenarios, se parte de ahi como de un checkpoint y se simula el resto
+        en_cache = consultar_cache(variables, modelo_expr, total_simulaciones, opciones)
+        if en_cache is not None:
+            guardados, agregado = en_cache
+            if guardados == total_simulaciones:
+                print(f"Resultado en cache ({total_simulaciones} escenarios, semilla {opciones['semilla']}): "
+                      f"no se simula")
+                imprimir_agregado(agregado, modelo_msg['variables'], opciones['confianza'])
+                return
+            print(f"En cache hay {guardados} escenarios con la misma semilla: "
+                  f"se simulan solo los {total_simulaciones - guardados} que faltan")
+            estado = {'completados': RangosCompletados.desde_lista([[0, guardados]]), 'agregado': agregado}
 
     # Conectar a RabbitMQ
     connection, channel = conectar_rabbitmq(host_rabbitmq)
     if not connection:
         sys.exit(1)
 
+    coordinador = None
     try:
         # 1. Publicar el modelo
-        modelo_id = str(uuid.uuid4())
-        modelo_msg = {
-            'modelo_id': modelo_id,
-            'timestamp': datetime.now().isoformat(),
-            'variables': variables,
-            'expresion': modelo_expr,
-            'total_escenarios': total_simulaciones,
-            'tipo': 'modelo'
-        }
-
-        print(f"Publicando modelo (ID: {modelo_id})")
-        for i in range(5):  # Copias para nuevos consumidores
-            channel.basic_publish(
-                exchange='',
-                routing_key='modelo',
-                body=json.dumps(modelo_msg),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
-            time.sleep(0.5)
+        modelo_id = modelo_msg['modelo_id']
+
+        print(f"Publicando modelo (ID: {modelo_id}, cola '{modelo_msg['cola']}', "
+              f"prioridad {modelo_msg['prioridad']})")
+        servidor_modelo = ServidorModelo(channel, modelo_msg)
+        servidor_modelo.difundir()
+        # Unidades a la medida del ritmo de los workers, o de 'lote' escenarios fijos
+        tamanos = TamanoAdaptativo(opciones['lote']) if opciones['lote_adaptativo'] else None
+        coordinador = Coordinador(channel, servidor_modelo, opciones, tamanos)
+        # La cola de trabajo se declara antes de restaurar: si lo ya hecho
+        # alcanza la precision, restaurar la vacia (queue_purge) al detener
+        publicador = PublicadorEscenarios(connection, channel, modelo_msg['cola'],
+                                          origen=f"productor_{modelo_id[:8]}")
+        if estado is not None:
+            coordinador.restaurar(estado)
 
         print(f"Modelo publicado: {modelo_expr}")
         print(f"Variables: {list(variables.keys())}")
@@ -181,83 +926,86 @@ def main():
 
         # 2. Generar y publicar escenarios
         print(f"Generando {total_simulaciones} escenarios...")
-
-        def crear_escenario(escenario_id):
-            datos_vars = {}
-            for nombre, (dist, params) in variables.items():
-                datos_vars[nombre] = generar_valor_individual(dist, params)
-
-            return {
-                'escenario_id': escenario_id,
-                'modelo_id': modelo_id,
-                'variables': datos_vars,
-                'timestamp': datetime.now().isoformat()
-            }
-
-        # Enviar escenarios en lotes pequeños para mejor distribución
+        if coordinador.activo:
+            print("Con objetivo de precisión: 'escenarios' es el máximo")
+
+        # Modo 'rangos': solo se envian coordenadas (semilla, inicio, cantidad)
+        # Modo 'valores': se envian los valores generados, por lotes
+        # Al reanudar solo se publica lo que falta. Lo que quedo en la cola se
+        # descarta (se vuelve a publicar); lo que ya tenia un worker puede llegar
+        # igual, y el coordinador descarta lo que ya estaba contado
+        faltantes = coordinador.completados.faltantes(total_simulaciones)
+        por_enviar = sum(cantidad for _, cantidad in faltantes)
+        if estado is not None:
+            channel.queue_purge(queue=modelo_msg['cola'])
+            print(f"Faltan {por_enviar} escenarios en {len(faltantes)} rangos")
         inicio_escenarios = time.time()
-        lote_size = 50
-
-        for lote_inicio in range(0, total_simulaciones, lote_size):
-            lote_fin = min(lote_inicio + lote_size, total_simulaciones)
-
-            for i in range(lote_inicio, lote_fin):
-                escenario = crear_escenario(i)
-                channel.basic_publish(
-                    exchange='',
-                    routing_key='escenarios',
-                    body=json.dumps(escenario),
-                    properties=pika.BasicProperties(delivery_mode=2)
-                )
-
-            # Mostrar progreso
-            porcentaje = (lote_fin / total_simulaciones) * 100
-            print(f"Enviados {lote_fin}/{total_simulaciones} escenarios ({porcentaje:.1f}%)")
-
-            # Pequeña pausa entre lotes para permitir balanceo
-            if lote_fin < total_simulaciones:
-                time.sleep(0.1)
-
+        ultimo_progreso = 0
+        total_enviados = 0
+
+        for cuerpo, content_type, inicio, cantidad in generar_mensajes_trabajo(
+                modelo_msg, variables, total_simulaciones, opciones, tamanos, faltantes):
+            if coordinador.detenido:
+                break
+            coordinador.publicada(inicio, cantidad)
+            publicador.publicar(cuerpo, content_type)
+            total_enviados += cantidad
+
+            # Mostrar progreso (como mucho una vez por segundo)
+            if time.time() - ultimo_progreso >= 1 or total_enviados == por_enviar:
+                ultimo_progreso = time.time()
+                porcentaje = (total_enviados / por_enviar) * 100
+                print(f"Enviados {total_enviados}/{por_enviar} escenarios ({porcentaje:.1f}%)")
+
+        if not coordinador.detenido:
+            publicador.confirmar()
         tiempo_escenarios = time.time() - inicio_escenarios
-        print(f"Todos los escenarios enviados en {tiempo_escenarios:.2f} segundos")
-
-        # 3. Enviar mensaje de finalización
-        fin_msg = {
-            'tipo': 'fin_escenarios',
-            'modelo_id': modelo_id,
-            'total_escenarios': total_simulaciones,
-            'timestamp': datetime.now().isoformat()
-        }
-
-        print("Enviando mensajes de finalización...")
-        for i in range(3):
-            channel.basic_publish(
-                exchange='',
-                routing_key='escenarios',
-                body=json.dumps(fin_msg),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
-            time.sleep(1)
-
+        if coordinador.detenido:
+            print(f"Generación detenida: {total_enviados}/{por_enviar} escenarios enviados "
+                  f"en {tiempo_escenarios:.2f} segundos")
+        else:
+            print(f"Todos los escenarios enviados en {tiempo_escenarios:.2f} segundos")
+        if tiempo_escenarios > 0:
+            tiempo_activo = max(tiempo_escenarios - publicador.tiempo_pausado, 1e-9)
+            print(f"Ritmo sostenido: {total_enviados / tiempo_escenarios:.0f} escenarios/s, "
+                  f"{publicador.publicados / tiempo_escenarios:.1f} mensajes/s "
+                  f"({publicador.tiempo_pausado:.2f} s en pausa por cola llena; "
+                  f"{total_enviados / tiempo_activo:.0f} escenarios/s sin contar pausas)")
+
+        # 3. Esperar a que los resultados cubran todos los escenarios (las
+        # unidades rezagadas se re-ejecutan) y avisar el fin a todos los workers.
+        # Si se detuvo por convergencia, el aviso de cancelacion ya cierra el modelo
+        if not coordinador.detenido:
+            print("Esperando los resultados de todas las unidades...")
+            copias = esperar_completado(connection, publicador, coordinador, opciones['semilla'])
+        if not coordinador.detenido:
+            print(f"Todos los escenarios completados en {time.time() - inicio_escenarios:.2f} segundos "
+                  f"({copias} unidades re-ejecutadas, {coordinador.duplicados} parciales duplicados descartados)")
+            imprimir_agregado(coordinador.agregado, modelo_msg['variables'], opciones['confianza'])
+            guardar_resultado(variables, modelo_expr, total_simulaciones, opciones, coordinador.agregado)
+            servidor_modelo.cancelar('fin_escenarios')
+            # Copias especulativas que nadie tomo
+            coordinador.vaciar_cola()
+        coordinador.guardar(completo=True)
+
+        publicador.publicar_metricas()
         print("Simulación completada.")
 
+        print(f"Solicitudes de modelo atendidas: {servidor_modelo.atendidas}")
         print("Presiona Ctrl+C para finalizar")
 
-        # Reenviar modelo para nuevos consumidores
-        while True:
-            channel.basic_publish(
-                exchange='',
-                routing_key='modelo',
-                body=json.dumps(modelo_msg),
-                properties=pika.BasicProperties(delivery_mode=2)
-            )
-            time.sleep(10)
+        # Seguir atendiendo a los workers que se unan tarde
+        channel.start_consuming()
 
     except KeyboardInterrupt:
         print("\nProductor finalizado por el usuario")
     except Exception as e:
         print(f"Error durante el envío: {e}")
+        sys.exit(1)  # 'finally' guarda el checkpoint igual
     finally:
+        if coordinador is not None and not coordinador.completo() and not coordinador.detenido:
+            coordinador.guardar()
+            print(f"Checkpoint guardado: reanudar con --reanudar {coordinador.modelo_id}")
         connection.close()
         print("Conexión cerrada")
 
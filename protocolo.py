@@ -0,0 +1,202 @@
+"""
+Codificacion de los mensajes de las colas 'escenarios' y 'resultados'.
+
+Formato binario (version 1), todo little-endian:
+    cabecera  : magic 'MC', version (u8), tipo (u8), modelo_id (16 bytes),
+                inicio (u64), cantidad (u32), columnas (u16), largo del
+                texto extra (u16)
+    texto     : worker_id en UTF-8 (solo resultados), con relleno hasta
+                multiplo de 8 bytes. Si los resultados llevan las entradas,
+                sigue un salto de linea y los nombres de las variables
+                separados por comas
+    datos     : 'columnas' arreglos float64 de 'cantidad' elementos,
+                uno detras de otro (una columna por variable; en los
+                resultados, la primera son los valores y el resto las entradas)
+
+Los datos se leen con np.frombuffer sin copiar. Los mensajes de control
+(modelo, fin_escenarios) siguen siendo JSON.
+"""
+
+import json
+import struct
+import time
+import uuid
+import numpy as np
+
+FORMATO_JSON = 'json'
+FORMATO_BINARIO = 'binario'
+FORMATOS = (FORMATO_BINARIO, FORMATO_JSON)
+
+CONTENT_TYPE = {
+    FORMATO_JSON: 'application/json',
+    FORMATO_BINARIO: 'application/x-montecarlo',
+}
+
+MAGIC = b'MC'
+VERSION = 1
+TIPO_LOTE = 1
+TIPO_RESULTADOS = 2
+
+_CABECERA = struct.Struct('<2sBB16sQIHH')
+_DTYPE = np.dtype('<f8')
+
+
+def _relleno(n):
+    return (-n) % 8
+
+
+def _codificar(tipo, modelo_id, inicio, columnas, texto=b''):
+    cantidad = len(columnas[0]) if columnas else 0
+    partes = [
+        _CABECERA.pack(MAGIC, VERSION, tipo, uuid.UUID(modelo_id).bytes,
+                       inicio, cantidad, len(columnas), len(texto)),
+        texto,
+        b'\0' * _relleno(_CABECERA.size + len(texto)),
+    ]
+    for columna in columnas:
+        partes.append(np.ascontiguousarray(columna, dtype=_DTYPE).tobytes())
+    return b''.join(partes)
+
+
+def _decodificar(body):
+    magic, version, tipo, modelo_bytes, inicio, cantidad, ncols, largo = \
+        _CABECERA.unpack_from(body)
+    if magic != MAGIC:
+        raise ValueError("Mensaje binario sin cabecera valida")
+    if version != VERSION:
+        raise ValueError(f"Version de formato no soportada: {version}")
+
+    desde = _CABECERA.size
+    texto = bytes(body[desde:desde + largo]).decode('utf-8')
+    desde += largo + _relleno(desde + largo)
+
+    datos = np.frombuffer(body, dtype=_DTYPE, count=ncols * cantidad, offset=desde)
+    columnas = datos.reshape(ncols, cantidad)
+    return tipo, str(uuid.UUID(bytes=modelo_bytes)), inicio, cantidad, columnas, texto
+
+
+def es_binario(body, properties=None):
+    content_type = getattr(properties, 'content_type', None)
+    if content_type:
+        return content_type == CONTENT_TYPE[FORMATO_BINARIO]
+    return bytes(body[:2]) == MAGIC
+
+
+def modelo_id_de(body, properties=None):
+    """modelo_id de un mensaje sin decodificar los datos (None si no trae)"""
+    if es_binario(body, properties):
+        return str(uuid.UUID(bytes=bytes(body[4:20])))
+    return json.loads(body.decode('utf-8')).get('modelo_id')
+
+
+def codificar_lote(lote, nombres, formato=FORMATO_JSON):
+    """Codifica un mensaje 'lote'; 'nombres' fija el orden de las columnas"""
+    if formato == FORMATO_BINARIO:
+        columnas = [lote['variables'][nombre] for nombre in nombres]
+        return _codificar(TIPO_LOTE, lote['modelo_id'], lote['inicio'], columnas)
+
+    mensaje = dict(lote)
+    mensaje['variables'] = {nombre: np.asarray(valores).tolist()
+                            for nombre, valores in lote['variables'].items()}
+    return json.dumps(mensaje).encode('utf-8')
+
+
+def codificar_resultados(resultado_msg, formato=FORMATO_JSON):
+    """Codifica un 'resultados_lote'; 'entradas' ({variable: array}) es opcional"""
+    entradas = resultado_msg.get('entradas') or {}
+    if formato == FORMATO_BINARIO:
+        texto = resultado_msg['worker_id']
+        if entradas:
+            texto += '\n' + ','.join(entradas)
+        return _codificar(TIPO_RESULTADOS, resultado_msg['modelo_id'],
+                          resultado_msg.get('inicio') or 0,
+                          [resultado_msg['resultados']] + list(entradas.values()),
+                          texto.encode('utf-8'))
+
+    mensaje = dict(resultado_msg)
+    mensaje['resultados'] = np.asarray(resultado_msg['resultados']).tolist()
+    if entradas:
+        mensaje['entradas'] = {nombre: np.asarray(valores).tolist() for nombre, valores in entradas.items()}
+    return json.dumps(mensaje).encode('utf-8')
+
+
+def decodificar(body, properties=None, nombres=None):
+    """
+    Decodifica un mensaje de cualquiera de los dos formatos a un diccionario.
+    Para lotes binarios hace falta 'nombres' (orden de variables del modelo).
+    """
+    if not es_binario(body, properties):
+        return json.loads(body.decode('utf-8'))
+
+    tipo, modelo_id, inicio, cantidad, columnas, texto = _decodificar(body)
+    if tipo == TIPO_LOTE:
+        if nombres is None or len(nombres) != len(columnas):
+            raise ValueError("El lote no coincide con las variables del modelo")
+        return {
+            'tipo': 'lote',
+            'modelo_id': modelo_id,
+            'inicio': inicio,
+            'cantidad': cantidad,
+            'variables': dict(zip(nombres, columnas)),
+        }
+    if tipo == TIPO_RESULTADOS:
+        worker_id, _, nombres_entradas = texto.partition('\n')
+        mensaje = {
+            'tipo': 'resultados_lote',
+            'modelo_id': modelo_id,
+            'worker_id': worker_id,
+            'inicio': inicio,
+            'resultados': columnas[0] if len(columnas) else np.empty(0),
+        }
+        if nombres_entradas:
+            mensaje['entradas'] = dict(zip(nombres_entradas.split(','), columnas[1:]))
+        return mensaje
+    raise ValueError(f"Tipo de mensaje binario desconocido: {tipo}")
+
+
+def comparar_formatos(cantidad=500, num_variables=2, repeticiones=200):
+    """Compara tamaño y velocidad del JSON por escenario, JSON por lote y binario"""
+    from datetime import datetime
+
+    rng = np.random.default_rng(0)
+    modelo_id = str(uuid.uuid4())
+    nombres = [f"v{i}" for i in range(num_variables)]
+    columnas = {nombre: rng.normal(size=cantidad) for nombre in nombres}
+    lote = {'tipo': 'lote', 'modelo_id': modelo_id, 'inicio': 0,
+            'cantidad': cantidad, 'variables': columnas,
+            'timestamp': datetime.now().isoformat()}
+
+    def por_escenario():
+        return [json.dumps({'escenario_id': k, 'modelo_id': modelo_id,
+                            'variables': {n: float(columnas[n][k]) for n in nombres},
+                            'timestamp': datetime.now().isoformat()}).encode('utf-8')
+                for k in range(cantidad)]
+
+    casos = [
+        ('json por escenario', por_escenario,
+         lambda cuerpos: [json.loads(c.decode('utf-8')) for c in cuerpos]),
+        ('json por lote', lambda: codificar_lote(lote, nombres, FORMATO_JSON),
+         lambda cuerpo: decodificar(cuerpo)),
+        ('binario por lote', lambda: codificar_lote(lote, nombres, FORMATO_BINARIO),
+         lambda cuerpo: decodificar(cuerpo, nombres=nombres)),
+    ]
+
+    print(f"{cantidad} escenarios x {num_variables} variables, {repeticiones} repeticiones")
+    print(f"{'formato':<20}{'bytes':>10}{'codificar (us)':>16}{'decodificar (us)':>18}")
+    for nombre, codificar, decodificar_caso in casos:
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            cuerpo = codificar()
+        t_cod = (time.perf_counter() - inicio) / repeticiones * 1e6
+
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            decodificar_caso(cuerpo)
+        t_dec = (time.perf_counter() - inicio) / repeticiones * 1e6
+
+        tamano = sum(map(len, cuerpo)) if isinstance(cuerpo, list) else len(cuerpo)
+        print(f"{nombre:<20}{tamano:>10}{t_cod:>16.1f}{t_dec:>18.1f}")
+
+
+if __name__ == "__main__":
+    comparar_formatos()